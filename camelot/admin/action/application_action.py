@@ -255,43 +255,37 @@ class Refresh( Action ):
     icon = Icon('tango/16x16/actions/view-refresh.png')
     
     def model_run( self, model_context ):
-        import sqlalchemy.exc as sa_exc
         from camelot.core.orm import Session
+        from camelot.core.orm.refresh import SessionRefresh
         from camelot.view import action_steps
-        from camelot.view.remote_signals import get_signal_handler
+        from camelot.view.completion import clear_completion_cache
+        from camelot.view.remote_signals import get_signal_handler, EntityChangeset
+        from camelot.view.proxy.row_count import row_count_cache
         LOGGER.debug('session refresh requested')
         progress_db_message = ugettext('Reload data from database')
         progress_view_message = ugettext('Update screens')
         session = Session()
         signal_handler = get_signal_handler()
-        refreshed_objects = []
-        expunged_objects = []
         #
-        # Loop over the objects one by one to be able to detect the deleted
-        # objects
+        # Reload the objects in chunks, the objects that are no longer in
+        # the database were deleted outside the scope of this session, so
+        # they are expunged and considered deleted from the application its
+        # point of view
         #
-        session_items = len( session.identity_map )
-        for i, (_key, obj) in enumerate( session.identity_map.items() ):
-            try:
-                session.refresh( obj )
-                refreshed_objects.append( obj )
-            except sa_exc.InvalidRequestError:
-                #
-                # this object could not be refreshed, it was probably deleted
-                # outside the scope of this session, so assume it is deleted
-                # from the application its point of view
-                #
-                session.expunge( obj )
-                expunged_objects.append( obj )
-            if i%10 == 0:
-                yield action_steps.UpdateProgress( i, 
-                                                   session_items, 
-                                                   progress_db_message )
+        session_refresh = SessionRefresh( session )
+        for completed, total in session_refresh.refresh():
+            yield action_steps.UpdateProgress( completed, 
+                                               total, 
+                                               progress_db_message )
         yield action_steps.UpdateProgress( text = progress_view_message )
-        for obj in refreshed_objects:
-            signal_handler.sendEntityUpdate( None, obj )
-        for obj in expunged_objects:
-            signal_handler.sendEntityDelete( None, obj )
+        row_count_cache.clear()
+        clear_completion_cache()
+        changeset = EntityChangeset()
+        for obj in session_refresh.refreshed:
+            changeset.add_update( obj )
+        for obj in session_refresh.expunged:
+            changeset.add_delete( obj )
+        signal_handler.send_entity_changes( None, changeset )
         yield action_steps.Refresh()
 
 class Exit( Action ):
@@ -303,10 +297,12 @@ class Exit( Action ):
     tooltip = _('Exit the application')
     
     def gui_run( self, gui_context ):
+        from camelot.core.files.thumbnails import stop_thumbnail_generator
         from camelot.view.model_thread import get_model_thread
         model_thread = get_model_thread()
         gui_context.workspace.close_all_views()
         model_thread.stop()
+        stop_thumbnail_generator()
         QtCore.QCoreApplication.exit(0)
         
 class ChangeLogging( Action ):
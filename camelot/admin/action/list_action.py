@@ -23,13 +23,12 @@
 #  ============================================================================
 
 import copy
-import datetime
 import logging
 
 from camelot.admin.action.base import Action
 from application_action import ( ApplicationActionGuiContext,
                                  ApplicationActionModelContext )
-from camelot.core.utils import ugettext, ugettext_lazy as _
+from camelot.core.utils import ugettext_lazy as _
 from camelot.view.art import Icon
 
 from PyQt4 import QtGui
@@ -97,8 +96,10 @@ class ListActionModelContext( ApplicationActionModelContext ):
                 yield obj
         else:
             for (first_row, last_row) in self.selected_rows:
-                for row in range( first_row, last_row + 1 ):
-                    yield self._model._get_object( row )
+                for obj in self._model._get_objects( first_row, 
+                                                     last_row,
+                                                     yield_per ):
+                    yield obj
     
     def get_collection( self, yield_per = None ):
         """
@@ -106,7 +107,7 @@ class ListActionModelContext( ApplicationActionModelContext ):
             should fetched from the database at the same time.
         :return: a generator over the objects in the list
         """
-        for obj in self._model.get_collection():
+        for obj in self._model._get_objects( 0, None, yield_per ):
             yield obj
             
     def get_object( self ):
@@ -417,159 +418,79 @@ class ToLastRow( ToNextRow ):
         item_view.selectRow( item_view.model().rowCount() - 1 )
 
 class ExportSpreadsheet( ListContextAction ):
-    """Export all rows in a table to a spreadsheet"""
+    """Export all rows in a table to a spreadsheet.  The rows are written to
+    disk while they are read from the collection, so the memory use does
+    not depend on the number of rows.
+    
+    .. attribute:: file_format
+    
+        either `'xlsx'` or `'csv'`
+        
+    .. attribute:: batch_size
+    
+        the number of rows read from the collection at once, progress is
+        reported after each batch
+    """
     
     icon = Icon('tango/16x16/mimetypes/x-office-spreadsheet.png')
     tooltip = _('Export to MS Excel')
     verbose_name = _('Export to MS Excel')
     font_name = 'Arial'
+    file_format = 'xlsx'
+    batch_size = 1000
+    
+    def create_writer( self, filename, title, field_attributes ):
+        """:return: a :class:`camelot.view.export.spreadsheet.SpreadsheetWriter`
+        for the file format of this action"""
+        from camelot.view.export.spreadsheet import XlsxWriter, CsvWriter
+        if self.file_format == 'csv':
+            return CsvWriter( filename, title, field_attributes )
+        return XlsxWriter( filename, title, field_attributes, 
+                           font_name = self.font_name )
     
     def model_run( self, model_context ):
-        from decimal import Decimal
-        from xlwt import Font, Borders, XFStyle, Pattern, Workbook
-        from camelot.view.utils import ( local_date_format, 
-                                         local_datetime_format,
-                                         local_time_format )
         from camelot.view import action_steps
         #
         # setup worksheet
         #
         yield action_steps.UpdateProgress( text = _('Create worksheet') )
         admin = model_context.admin
-        workbook = Workbook()
-        worksheet = workbook.add_sheet('Sheet1')
-        #
-        # keep a global cache of styles, since the number of styles that
-        # can be used is limited.
-        #
-        styles = dict()
-        freeze = lambda d:tuple(sorted(d.iteritems()))
+        columns = admin.get_columns()
+        field_names = [ name for name, _attributes in columns ]
+        field_attributes = [ dict( attributes, name = attributes.get( 'name', name ) ) for name, attributes in columns ]
+        getters = [ attributes['getter'] for attributes in field_attributes ]
+        filename = action_steps.OpenFile.create_temporary_file( '.' + self.file_format )
+        writer = self.create_writer( filename,
+                                     admin.get_verbose_name_plural(),
+                                     field_attributes )
         
-        def get_style( font_specs=dict(), 
-                       border_specs = dict(), 
-                       pattern = None,
-                       num_format_str = None, ):
-            
-            style_key = ( freeze(font_specs), 
-                          freeze(border_specs), 
-                          pattern, 
-                          num_format_str )
-            
-            try:
-                return styles[style_key]
-            except KeyError:
-                style = XFStyle()
-                style.font = Font()
-                for key, value in font_specs.items():
-                    setattr( style.font, key, value )
-                style.borders = Borders()
-                for key, value in border_specs.items():
-                    setattr( style.borders, key, value )
-                if pattern:
-                    style.pattern = pattern
-                if num_format_str:
-                    style.num_format_str = num_format_str
-                styles[ style_key ] = style
-                return style
+        def write_batch( objects ):
+            # the dynamic field attributes are merged into a copy of the
+            # static field attributes, to leave those of the admin untouched
+            batch = admin.get_dynamic_field_attributes_batch( objects, field_names )
+            for obj, dynamic_attributes in zip( objects, batch ):
+                row_attributes = [ dict( static, **dynamic ) for static, dynamic in zip( field_attributes, dynamic_attributes ) ]
+                writer.write_row( [ getter( obj ) for getter in getters ],
+                                  row_attributes )
         
         #
-        # write style
-        #
-        title_style = get_style( dict( font_name = self.font_name,
-                                       bold = True,
-                                       height = 240 ) )
-        worksheet.write( 0, 0, admin.get_verbose_name_plural(), title_style )
-        #
-        # create some patterns and formats
-        #
-        date_format = local_date_format()
-        datetime_format = local_datetime_format()
-        time_format = local_time_format()
-        header_pattern = Pattern()
-        header_pattern.pattern = Pattern.SOLID_PATTERN
-        header_pattern.pattern_fore_colour = 0x16
-        #
-        # write headers
-        #
-        columns = admin.get_columns()
-        field_names = []
-        for i, (name, field_attributes) in enumerate( columns ):
-            verbose_name = unicode( field_attributes.get( 'name', name ) )
-            field_names.append( name )
-            font_specs = dict( font_name = self.font_name, 
-                               bold = True, 
-                               height = 200 )
-            border_specs = dict( top = 0x01 )
-            name = unicode( name )
-            if i == 0:
-                border_specs[ 'left' ] = 0x01                
-            elif i == len( columns ) - 1:
-                border_specs[ 'right' ] = 0x01 
-            header_style = get_style( font_specs, border_specs, header_pattern )
-            worksheet.write( 2, i, verbose_name, header_style)
-                
-            if len( name ) < 8:
-                worksheet.col( i ).width = 8 *  375
-            else:
-                worksheet.col( i ).width = len( verbose_name ) *  375
-        #
         # write data
         #
-        offset = 3
-        for j, obj in enumerate( model_context.get_collection( yield_per = 100 ) ):
-            dynamic_attributes = admin.get_dynamic_field_attributes( obj, 
-                                                                     field_names )
-            row = offset + j
-            if j % 100 == 0:
-                yield action_steps.UpdateProgress( j, model_context.collection_count )
-            for i, ((_name, attributes), delta_attributes)  in enumerate( zip( columns, dynamic_attributes ) ):
-                attributes.update( delta_attributes )
-                value = attributes['getter']( obj )
-                format_string = '0'
-                if value != None:
-                    if isinstance( value, Decimal ):
-                        value = float( str( value ) )
-                    if isinstance( value, (unicode, str) ):
-                        if attributes.get( 'translate_content', False ) == True:
-                            value = ugettext( value )
-                    # handle fields of type code
-                    elif isinstance( value, list ):
-                        value = u'.'.join(value)
-                    elif isinstance( value, float ):
-                        precision = attributes.get( 'precision', 2 )
-                        format_string = '0.' + '0'*precision
-                    elif isinstance( value, datetime.date ):
-                        format_string = date_format
-                    elif isinstance( value, datetime.datetime ):
-                        format_string = datetime_format
-                    elif isinstance( value, datetime.time ):
-                        format_string = time_format
-                    else:
-                        value = unicode( value )
-                else:
-                    # empty cells should be filled as well, to get the
-                    # borders right
-                    value = ''
-                        
-                font_specs = dict( font_name = self.font_name, height = 200 )
-                border_specs = dict()
-                if i == 0:
-                    border_specs[ 'left' ] = 0x01                
-                elif i == len( columns ) - 1:
-                    border_specs[ 'right' ] = 0x01  
-                if (row - offset + 1) == model_context.collection_count:
-                    border_specs[ 'bottom' ] = 0x01
-                style = get_style( font_specs, 
-                                   border_specs, 
-                                   None, 
-                                   format_string )
-                worksheet.write( row, i, value, style )
-                min_width = len( unicode( value ) ) * 300
-                worksheet.col( i ).width = max( min_width, worksheet.col( i ).width )
-        
-        yield action_steps.UpdateProgress( text = _('Saving file') )
-        filename = action_steps.OpenFile.create_temporary_file( '.xls' )
-        workbook.save( filename )
+        try:
+            row, objects = 0, []
+            for obj in model_context.get_collection( yield_per = self.batch_size ):
+                objects.append( obj )
+                row += 1
+                if len( objects ) == self.batch_size:
+                    write_batch( objects )
+                    objects = []
+                    yield action_steps.UpdateProgress( row, model_context.collection_count )
+            write_batch( objects )
+            yield action_steps.UpdateProgress( text = _('Saving file') )
+            writer.close()
+        except:
+            writer.abort()
+            raise
         yield action_steps.UpdateProgress( text = _('Opening file') )
         yield action_steps.OpenFile( filename )
     
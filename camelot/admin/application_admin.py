@@ -625,11 +625,12 @@ shortcut confusion and reduce the number of status updates.
     def dump_state(self):
         """Dump the state of the application to the output, this method is
         triggered by pressing :kbd:`Ctrl-Alt-D` in the GUI"""
-        from camelot.view.model_thread import post
+        from camelot.view.model_thread import post, get_model_thread
         from camelot.view.register import dump_register
         from camelot.view.proxy.collection_proxy import CollectionProxy
 
         import gc
+        import json
         gc.collect()
 
             
@@ -649,6 +650,10 @@ shortcut confusion and reduce the number of status updates.
             print '====== end session =============='
 
         post( dump_session_state )
+        
+        print '======= begin model thread =============='
+        print json.dumps( get_model_thread().get_metrics(), indent = 2 )
+        print '======= end model thread =============='
 
         for o in gc.get_objects():
             if isinstance(o, CollectionProxy):
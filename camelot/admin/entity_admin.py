@@ -112,6 +112,62 @@ It has additional class attributes that customise its behaviour.
     A list of fields that will be searchable through the expanded search.  When set 
     to None, all the fields in list_display will be searchable.  Use this attribute
     to limit the number of search widgets.  Defaults to None.
+
+.. attribute:: list_search_index
+
+    The index used to search the text columns of the entity, instead of 
+    scanning all rows with `ILIKE`.  Defaults to None, meaning no index is
+    used.  Other possibilities are :
+
+      * 'fulltext' : a GIN index on a `tsvector` on PostgreSQL, or an FTS5
+        table on SQLite.  Words are matched with the start of the words in 
+        the text columns, instead of with any part of the text.
+        
+      * 'trigram' : a trigram index on each text column, on PostgreSQL.
+      
+    The index is not created while searching, since that locks the table.
+    It should be created when the schema is set up or migrated, with
+    :func:`camelot.view.search.create_search_index`.  When the index does 
+    not exist in the database, the default search is used.  See
+    :mod:`camelot.core.search_index`.
+
+**Performance**
+
+.. attribute:: list_pagination
+
+    The way the table view fetches the rows it displays from the database.
+    Defaults to 'offset', meaning each page of rows is fetched by skipping
+    all rows before it with an `OFFSET` clause.  Other possibilities are :
+
+      * 'keyset' : the sort key values of rows that were fetched before are
+        used to seek to the requested page with a `WHERE` clause, so the
+        database does not need to scan all the rows before it.  This is
+        useful for tables with a large number of rows.
+
+.. attribute:: list_count
+
+    The way the table view counts the number of rows it displays.  Defaults 
+    to 'exact', meaning the rows of the query are counted.  Counts are 
+    cached until rows are inserted in or deleted from the tables used by the 
+    query.  Other possibilities are :
+
+      * 'estimated' : the statistics of the database are used to estimate the
+        number of rows of unfiltered queries, while the rows are counted in 
+        the background.  When the count is finished, the number of rows in the 
+        table view is corrected.  Only PostgreSQL provides such estimates.
+
+.. attribute:: list_eager_load
+
+    The relations and deferred columns displayed in the table view are 
+    loaded together with the rows, instead of with a query for each row.
+    Fields that are not mapped, such as python properties, might use 
+    relations or deferred columns as well.  This is a list with the 
+    attribute paths those fields use, which are loaded together with the 
+    rows as well ::
+
+        list_eager_load = ['email', 'director.addresses']
+
+    Defaults to an empty list.
  
     """
 
@@ -121,6 +177,10 @@ It has additional class attributes that customise its behaviour.
     copy_deep = {}
     copy_exclude = []
     search_all_fields = True
+    list_search_index = None
+    list_pagination = 'offset'
+    list_count = 'exact'
+    list_eager_load = []
     validator = EntityValidator
 
     def __init__(self, app_admin, entity):
@@ -134,6 +194,7 @@ It has additional class attributes that customise its behaviour.
             logger.error(u'%s is not a mapped class, configured mappers include %s'%(self.entity, u','.join(mapped_entities)),
                          exc_info=exception)
             raise exception
+        self._loader_options = dict()
 
     @model_function
     def get_query(self):
@@ -359,6 +420,52 @@ It has additional class attributes that customise its behaviour.
                     attributes['editable'] = False
             yield attributes
             
+    @model_function
+    def get_loader_options(self, field_names):
+        """The loader plan for the fields displayed in a table view.  Many to
+        one relations are joined in the query of the rows, other relations 
+        are loaded with a query for all the rows at once, and deferred columns 
+        are undeferred.  The paths in :attr:`list_eager_load` are added to
+        the plan.
+
+        :param field_names: the names of the displayed fields
+        :return: a tuple of sqlalchemy query options
+        """
+        field_names = tuple(field_names)
+        try:
+            return self._loader_options[field_names]
+        except KeyError:
+            pass
+        from sqlalchemy.exc import InvalidRequestError
+        options = []
+        loaded_paths = set()
+        for path in itertools.chain(field_names, self.list_eager_load):
+            mapper = self.mapper
+            keys = path.split('.')
+            for i, key in enumerate(keys):
+                try:
+                    property = mapper.get_property(key)
+                except InvalidRequestError:
+                    break
+                loaded_path = '.'.join(keys[:i+1])
+                if isinstance(property, orm.properties.ColumnProperty):
+                    if property.deferred and loaded_path not in loaded_paths:
+                        options.append(orm.undefer(loaded_path))
+                        loaded_paths.add(loaded_path)
+                    break
+                if not isinstance(property, orm.properties.RelationshipProperty):
+                    break
+                if loaded_path not in loaded_paths:
+                    if property.uselist:
+                        options.append(orm.subqueryload(loaded_path))
+                    else:
+                        options.append(orm.joinedload(loaded_path))
+                    loaded_paths.add(loaded_path)
+                mapper = property.mapper
+        options = tuple(options)
+        self._loader_options[field_names] = options
+        return options
+
     @model_function
     def get_list_charts(self):
         return self.list_charts
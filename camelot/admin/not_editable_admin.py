@@ -97,6 +97,11 @@ def not_editable_admin( original_admin,
                     dynamic_fa = self._original_admin.get_dynamic_field_attributes(obj, fn1)
                     return [self._process_field_attributes(name, attributes) for name,attributes in zip(fn2, dynamic_fa)]
                     
+                def get_dynamic_field_attributes_batch(self, objects, field_names):
+                    field_names = list(field_names)
+                    batch = self._original_admin.get_dynamic_field_attributes_batch(objects, field_names)
+                    return [[self._process_field_attributes(name, attributes) for name,attributes in zip(field_names, dynamic_fa)] for dynamic_fa in batch]
+                    
                 def get_static_field_attributes(self, field_names):
                     fn1, fn2 = tee(field_names, 2)
                     static_fa = self._original_admin.get_static_field_attributes(fn1)
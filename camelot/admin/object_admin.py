@@ -274,6 +274,7 @@ be specified using the verbose_name attribute.
         # caches to prevent recalculation of things
         #
         self._field_attributes = dict()
+        self._dynamic_field_attribute_functions = dict()
         self._subclasses = None
 
     def __str__(self):
@@ -481,9 +482,61 @@ be specified using the verbose_name attribute.
                 yield field_attributes
                 
         """
+        for functions in self._get_dynamic_field_attribute_functions(field_names):
+            dynamic_field_attributes = {}
+            for name, function in functions:
+                return_value = None
+                try:
+                    return_value = function(obj)
+                except (ValueError, Exception, RuntimeError, TypeError, NameError), exc:
+                    logger.error(u'error in field_attribute function of %s'%name, exc_info=exc)
+                finally:
+                    dynamic_field_attributes[name] = return_value
+            yield dynamic_field_attributes
+
+    def get_dynamic_field_attributes_batch(self, objects, field_names):
+        """
+        Get the dynamic field attributes of a list of objects at once.  This
+        method is called once for each window of rows that is fetched in a 
+        table view.
+        
+        :param objects: a list of objects
+        :param field_names: a list of field names
+        :return: a list with for each object the list of dynamic field 
+            attributes, as returned by :meth:`get_dynamic_field_attributes`
+        
+        The default implementation calls :meth:`get_dynamic_field_attributes`
+        for each object.  Reimplement this method when the dynamic field
+        attributes of all objects can be evaluated at once, for example
+        with a single query::
+        
+            def get_dynamic_field_attributes_batch(self, objects, field_names):
+                field_names = list(field_names)
+                finished = set( query_finished_objects( objects ) )
+                batch = super( MyAdmin, self ).get_dynamic_field_attributes_batch(objects, field_names)
+                for obj, dynamic_field_attributes in zip( objects, batch ):
+                    for field_attributes in dynamic_field_attributes:
+                        field_attributes['editable'] = ( obj in finished )
+                return batch
+            
+        """
+        field_names = list(field_names)
+        return [list(self.get_dynamic_field_attributes(obj, field_names)) for obj in objects]
+
+    def _get_dynamic_field_attribute_functions(self, field_names):
+        """
+        :return: a list with for each field a list of `(name, function)`
+            tuples of the dynamic field attributes that are callable
+        """
+        field_names = tuple(field_names)
+        try:
+            return self._dynamic_field_attribute_functions[field_names]
+        except KeyError:
+            pass
+        functions = []
         for field_name in field_names:
             field_attributes = self.get_field_attributes(field_name)
-            dynamic_field_attributes = {}
+            field_functions = []
             for name, value in field_attributes.items():
                 if name not in DYNAMIC_FIELD_ATTRIBUTES:
                     continue
@@ -493,14 +546,10 @@ be specified using the verbose_name attribute.
                     # as it might be the max of a column
                     continue
                 if callable(value):
-                    return_value = None
-                    try:
-                        return_value = value(obj)
-                    except (ValueError, Exception, RuntimeError, TypeError, NameError), exc:
-                        logger.error(u'error in field_attribute function of %s'%name, exc_info=exc)
-                    finally:
-                        dynamic_field_attributes[name] = return_value
-            yield dynamic_field_attributes
+                    field_functions.append((name, value))
+            functions.append(field_functions)
+        self._dynamic_field_attribute_functions[field_names] = functions
+        return functions
 
     def get_field_attributes(self, field_name):
         """
@@ -29,7 +29,7 @@ logger = logging.getLogger('camelot.admin.validator.object_validator')
 from PyQt4 import QtCore
 
 from camelot.view.fifo import Fifo
-from camelot.view.model_thread import post
+from camelot.view.model_thread import post, BACKGROUND
 from camelot.core.utils import ugettext as _
 
 
@@ -58,7 +58,7 @@ class ObjectValidator(QtCore.QObject):
         self._invalid_rows = set()
 
         if initial_validation:
-            post(self.validate_all_rows)
+            post(self.validate_all_rows, priority = BACKGROUND)
 
     def validate_all_rows(self):
         """Force validation of all rows in the model"""
@@ -22,6 +22,7 @@
 #
 #  ============================================================================
 import logging
+import StringIO
 
 import sqlalchemy
 
@@ -40,8 +41,14 @@ class BackupMechanism(object):
     from the the database to backup.  When a restore is done, the schema of the
     database is not touched, but the tables are emptied and the data from the
     backup is copied into the existing schema.
+    
+    The data of a table is streamed in batches of `batch_size` rows, each
+    batch is written in its own transaction, so the memory needed does not
+    depend on the size of the tables.
     """
     
+    batch_size = 1000
+    
     def __init__(self, filename, storage=None):
         """Backup and restore to a file using it as an sqlite database.
         :param filename: the name of the file in which to store the backup, this
@@ -192,11 +199,17 @@ class BackupMechanism(object):
                 to_table.create(to_engine)
                 from_and_to_tables.append((from_table, to_table))
         
-        number_of_tables = len(from_and_to_tables)
-        for i,(from_table, to_table) in enumerate(from_and_to_tables):
-            yield (i, number_of_tables + 1, _('Copy data of table %s')%from_table.name)
-            self.copy_table_data(from_table, to_table)
-        yield (number_of_tables, number_of_tables + 1, _('Store backup at requested location') )
+        yield (0, 0, _('Counting rows'))
+        number_of_rows = sum( self.count_table_rows( from_table ) for from_table, _to_table in from_and_to_tables )
+        copied_rows = 0
+        for from_table, to_table in from_and_to_tables:
+            description = _('Copy data of table %s')%from_table.name
+            yield (copied_rows, number_of_rows, description)
+            rows = 0
+            for rows in self.copy_table_data_in_batches(from_table, to_table):
+                yield (copied_rows + rows, number_of_rows, description)
+            copied_rows = copied_rows + rows
+        yield (number_of_rows, number_of_rows, _('Store backup at requested location') )
         from_engine.dispose()
         to_engine.dispose()
         if not self._storage:
@@ -206,7 +219,7 @@ class BackupMechanism(object):
             logger.info(u'check backfup file in to storage with name %s'%self._filename)
             self._storage.checkin( temp_file_name, self._filename )
             os.remove( temp_file_name )
-        yield (number_of_tables + 1, number_of_tables + 1, _('Backup completed'))
+        yield (number_of_rows, number_of_rows, _('Backup completed'))
     
     def restore(self):
         """Generator function that yields tuples :
@@ -254,29 +267,40 @@ class BackupMechanism(object):
         to_meta_data.reflect()
         to_tables = list(table for table in to_meta_data.sorted_tables if self.restore_table_filter(table))
         number_of_tables = len(to_tables)
-        steps = number_of_tables * 2 + 2
         
+        yield (0, 0, _('Counting rows'))
+        from_and_to_tables = [ (from_meta_data.tables[to_table.name], to_table) for to_table in to_tables if to_table.name in from_meta_data.tables ]
+        number_of_rows = sum( self.count_table_rows( from_table ) for from_table, _to_table in from_and_to_tables )
+        #
+        # the progress is reported over the deleted tables and the copied
+        # rows together, deleting a table counts as a single step
+        #
+        total = number_of_tables + number_of_rows
         for i,to_table in enumerate(reversed(to_tables)):
-            yield (i, steps, _('Delete data from table %s')%to_table.name)
+            yield (i, total, _('Delete data from table %s')%to_table.name)
             self.delete_table_data(to_table)
 
-        for i,to_table in enumerate(to_tables):
-            if to_table.name in from_meta_data.tables:
-                yield (number_of_tables+i, steps, _('Copy data from table %s')%to_table.name)
-                self.copy_table_data(from_meta_data.tables[to_table.name], to_table)
+        copied_rows = 0
+        for from_table, to_table in from_and_to_tables:
+            description = _('Copy data from table %s')%to_table.name
+            yield (number_of_tables + copied_rows, total, description)
+            rows = 0
+            for rows in self.copy_table_data_in_batches(from_table, to_table):
+                yield (number_of_tables + copied_rows + rows, total, description)
+            copied_rows = copied_rows + rows
                 
-        yield (number_of_tables * 2 + 1, steps, _('Update schema after restore'))
+        yield (total, total, _('Update schema after restore'))
         self.update_schema_after_restore(from_engine, to_engine)
         
         from_engine.dispose()
         to_engine.dispose()
         
-        yield (number_of_tables * 2 + 2, steps, _('Load new data'))
+        yield (total, total, _('Load new data'))
         from sqlalchemy.orm.session import _sessions
         for session in _sessions.values():
             session.expunge_all()
         
-        yield (1, 1, _('Restore completed'))
+        yield (total, total, _('Restore completed'))
                           
     def delete_table_data(self, to_table):
         """This method might be subclassed to turn off/on foreign key checks"""
@@ -284,17 +308,141 @@ class BackupMechanism(object):
         to_connection.execute(to_table.delete())
         to_connection.close()
         
+    def count_table_rows(self, from_table):
+        """:return: the number of rows in a table"""
+        query = sqlalchemy.select( [sqlalchemy.func.count()] ).select_from( from_table )
+        return from_table.bind.execute( query ).scalar()
+        
     def copy_table_data(self, from_table, to_table):
+        """Copy all data from one table to another"""
+        for _rows in self.copy_table_data_in_batches(from_table, to_table):
+            pass
+        
+    def copy_table_data_in_batches(self, from_table, to_table):
+        """Generator that copies the data from one table to another in batches
+        of `batch_size` rows, and yields the number of rows copied after each
+        batch.
+        
+        The rows are read through a server side cursor if the database
+        supports it.  Each batch is written in its own transaction.
+        """
         from_connection = from_table.bind.connect()
-        query = sqlalchemy.select([from_table])
-        table_data = [row for row in from_connection.execute(query).fetchall()]
-        from_connection.close()
-        if len(table_data):
-            to_connection = to_table.bind.connect()
-            to_connection.execute(to_table.insert(), table_data)
-            if 'id' in [c.name for c in to_table.columns]:
-              if to_table.bind.url.get_dialect().name == 'postgresql':
-                table_name = to_table.name
-                seq_name = table_name + "_id_seq"
-                to_connection.execute("select setval('%s', max(id)) from %s" % (seq_name, table_name))
+        to_connection = to_table.bind.connect()
+        dialect = to_connection.dialect.name
+        if dialect == 'postgresql':
+            write_batch = self.copy_rows
+        else:
+            write_batch = self.insert_rows
+        if dialect == 'sqlite':
+            pragmas = self.begin_sqlite_bulk_load( to_connection )
+        try:
+            query = sqlalchemy.select([from_table])
+            result = from_connection.execution_options( stream_results = True ).execute( query )
+            rows = 0
+            while True:
+                batch = result.fetchmany( self.batch_size )
+                if not len( batch ):
+                    break
+                transaction = to_connection.begin()
+                try:
+                    write_batch( to_connection, to_table, batch )
+                    transaction.commit()
+                except:
+                    transaction.rollback()
+                    raise
+                rows += len( batch )
+                yield rows
+            result.close()
+            if rows and 'id' in [c.name for c in to_table.columns]:
+                if dialect == 'postgresql':
+                    table_name = to_table.name
+                    seq_name = table_name + "_id_seq"
+                    to_connection.execute("select setval('%s', max(id)) from %s" % (seq_name, table_name))
+        finally:
+            if dialect == 'sqlite':
+                self.end_sqlite_bulk_load( to_connection, pragmas )
+            from_connection.close()
             to_connection.close()
+            
+    def insert_rows(self, to_connection, to_table, rows):
+        """Write a batch of rows to a table with a single executemany insert
+        
+        :param to_connection: the connection in which the transaction is open
+        :param to_table: the table in which to insert the rows
+        :param rows: a list of rows fetched from the source table
+        """
+        to_connection.execute( to_table.insert(), rows )
+        
+    def copy_rows(self, to_connection, to_table, rows):
+        """Write a batch of rows to a PostgreSQL table with the COPY command,
+        which is much faster than inserts.  This requires the psycopg2 driver.
+        
+        :param to_connection: the connection in which the transaction is open
+        :param to_table: the table in which to insert the rows
+        :param rows: a list of rows fetched from the source table
+        """
+        if not len( rows ):
+            return
+        preparer = to_connection.dialect.identifier_preparer
+        row_keys = set( rows[0].keys() )
+        columns = [ column for column in to_table.columns if column.name in row_keys ]
+        converters = [ _copy_converter( column ) for column in columns ]
+        data = StringIO.StringIO()
+        for row in rows:
+            data.write( '\t'.join( converter( row[column.name] ) for column, converter in zip( columns, converters ) ) )
+            data.write( '\n' )
+        data.seek( 0 )
+        copy = 'COPY %s (%s) FROM STDIN'%( preparer.format_table( to_table ),
+                                           ', '.join( preparer.format_column( column ) for column in columns ) )
+        cursor = to_connection.connection.cursor()
+        try:
+            cursor.copy_expert( copy, data )
+        finally:
+            cursor.close()
+            
+    def begin_sqlite_bulk_load(self, to_connection):
+        """Tune an SQLite connection for loading large amounts of data, at
+        the expense of durability while the data is loaded.
+        
+        :return: the original values of the changed pragmas
+        """
+        pragmas = dict( synchronous = 'OFF', journal_mode = 'MEMORY' )
+        original_pragmas = dict()
+        for pragma, value in pragmas.items():
+            original_pragmas[pragma] = to_connection.execute( 'PRAGMA %s'%pragma ).scalar()
+            to_connection.execute( 'PRAGMA %s = %s'%( pragma, value ) )
+        return original_pragmas
+    
+    def end_sqlite_bulk_load(self, to_connection, original_pragmas):
+        """Restore the pragmas changed by `begin_sqlite_bulk_load`, since the
+        connection might be reused by the application"""
+        for pragma, value in original_pragmas.items():
+            to_connection.execute( 'PRAGMA %s = %s'%( pragma, value ) )
+
+def _copy_text(value):
+    """Convert a value to the text format of the PostgreSQL COPY command"""
+    if value is None:
+        return '\\N'
+    if isinstance( value, bool ):
+        return 't' if value else 'f'
+    if isinstance( value, float ):
+        value = repr( value )
+    elif isinstance( value, unicode ):
+        value = value.encode( 'utf-8' )
+    else:
+        value = str( value )
+    return value.replace( '\\', '\\\\' ).replace( '\t', '\\t' ).replace( '\n', '\\n' ).replace( '\r', '\\r' )
+
+def _copy_binary(value):
+    """Convert a binary value to the hex format of a PostgreSQL bytea in the
+    text format of the COPY command"""
+    if value is None:
+        return '\\N'
+    return '\\\\x' + str( value ).encode( 'hex' )
+
+def _copy_converter(column):
+    """:return: the function to convert the values of a column to the text
+    format of the PostgreSQL COPY command"""
+    if isinstance( column.type, sqlalchemy.types.LargeBinary ):
+        return _copy_binary
+    return _copy_text
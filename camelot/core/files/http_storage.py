@@ -0,0 +1,365 @@
+#  ============================================================================
+#
+#  Copyright (C) 2007-2012 Conceptive Engineering bvba. All rights reserved.
+#  www.conceptive.be / project-camelot@conceptive.be
+#
+#  This file is part of the Camelot Library.
+#
+#  This file may be used under the terms of the GNU General Public
+#  License version 2.0 as published by the Free Software Foundation
+#  and appearing in the file license.txt included in the packaging of
+#  this file.  Please review this information to ensure GNU
+#  General Public Licensing requirements will be met.
+#
+#  If you are unsure which license is appropriate for your use, please
+#  visit www.python-camelot.com or contact project-camelot@conceptive.be
+#
+#  This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+#  WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  For use of this library in commercial applications, please contact
+#  project-camelot@conceptive.be
+#
+#  ============================================================================
+
+"""A storage that keeps files on an HTTP server, through the object
+operations of the Amazon S3 REST API : PUT, GET, HEAD and DELETE of an object,
+and GET of a bucket to list its objects.  Only unauthenticated access is
+supported, so this storage is meant for an S3 compatible server in a trusted
+network.
+
+The :class:`ObjectServer` is a minimal local stand-in for such a server, to
+be used in tests ::
+
+    server = ObjectServer( '/tmp/objects' )
+    server.start()
+    storage = HttpStorage( 'documents', url = server.url + 'bucket' )
+    
+Within a column definition, the url can be passed with 
+:func:`functools.partial` ::
+
+    class Movie( Entity ):
+        script = Column( camelot.types.File( upload_to = 'script',
+                                             storage = functools.partial( HttpStorage, url = 'http://files:8080/camelot' ) ) )
+                                             
+Like the :class:`camelot.core.files.storage.ContentAddressedStorage`, files
+are named after the SHA-256 hash of their content, so identical files are
+uploaded only once.  Files are streamed to and from the server in chunks,
+and checked out files are kept in a local folder.
+"""
+
+import BaseHTTPServer
+import httplib
+import logging
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+import urllib
+import urlparse
+from xml.etree import ElementTree
+
+from camelot.core.conf import settings
+from camelot.core.files.storage import StoredFile, copy_and_hash, content_name
+
+LOGGER = logging.getLogger( 'camelot.core.files.http_storage' )
+
+class HttpStorage( object ):
+    """Helper class that opens and saves StoredFile objects on an S3 
+    compatible HTTP server.  
+    
+    :param upload_to: the prefix of the keys of the files in the bucket
+    :param stored_file_implementation: the subclass of StoredFile to be used
+        when checking out files from the storage
+    :param url: the url of the bucket on the server, if None is given the 
+        settings.CAMELOT_STORAGE_URL will be used
+    :param cache: the local folder in which checked out files are kept, if
+        None is given, a folder in the temporary directory will be used
+    """
+    
+    def __init__( self, upload_to = '', 
+                  stored_file_implementation = StoredFile,
+                  url = None,
+                  cache = None ):
+        self._url = url
+        self.upload_to = upload_to
+        self.stored_file_implementation = stored_file_implementation
+        self._cache = cache or os.path.join( tempfile.gettempdir(), 
+                                             'camelot-http-storage' )
+        
+    def _connection( self ):
+        """:return: a connection to the server and the path of the bucket"""
+        url = urlparse.urlparse( self._url or settings.CAMELOT_STORAGE_URL )
+        if url.scheme == 'https':
+            connection = httplib.HTTPSConnection( url.hostname, url.port )
+        else:
+            connection = httplib.HTTPConnection( url.hostname, url.port )
+        return connection, url.path.rstrip( '/' )
+    
+    def _key( self, name ):
+        return u'/'.join( part for part in ( self.upload_to, name ) if part )
+    
+    def _request( self, method, name, body = None, headers = {} ):
+        """Send a request for an object to the server
+        :return: the response, which should be closed after its body has
+            been read
+        """
+        connection, bucket = self._connection()
+        path = bucket + '/' + urllib.quote( self._key( name ).encode( 'utf-8' ) )
+        connection.request( method, path, body, headers )
+        return connection.getresponse()
+    
+    def available( self ):
+        """Verify if the storage is available
+
+        :return: True if the storage is available, False otherwise
+        """
+        try:
+            connection, bucket = self._connection()
+            connection.request( 'HEAD', bucket + '/' )
+            status = connection.getresponse().status
+            connection.close()
+            return status < 500
+        except EnvironmentError, e:
+            LOGGER.warn( u'Could not access %s, files will be unreachable'%self._url,
+                         exc_info = e )
+            return False
+        
+    def writeable( self ):
+        return self.available()
+    
+    def exists( self, name ):
+        """True if a file exists given some name"""
+        response = self._request( 'HEAD', name )
+        response.read()
+        return response.status == httplib.OK
+    
+    def list( self, prefix = '*', suffix = '*' ):
+        """Lists all files with a given prefix and or suffix available in 
+        this storage
+
+        :return: a iterator of StoredFile objects
+        """
+        import fnmatch
+        connection, bucket = self._connection()
+        key_prefix = self._key( '' )
+        if key_prefix:
+            key_prefix = key_prefix + '/'
+        connection.request( 'GET', bucket + '/?' + urllib.urlencode( dict( prefix = key_prefix.encode( 'utf-8' ) ) ) )
+        response = connection.getresponse()
+        if response.status != httplib.OK:
+            raise Exception( 'Could not list %s : %s'%( self._url, response.reason ) )
+        pattern = u'%s*%s'%( prefix, suffix )
+        tree = ElementTree.parse( response )
+        for key in tree.getroot().iter( '{http://s3.amazonaws.com/doc/2006-03-01/}Key' ):
+            name = key.text[len( key_prefix ):]
+            if fnmatch.fnmatch( name.split( '/' )[-1], pattern ):
+                yield self.stored_file_implementation( self, name )
+        
+    def checkin( self, local_path, filename = None ):
+        """Check the file pointed to by local_path into the storage, and
+        return a StoredFile.  The file is read twice, once to calculate its
+        hash, and once to upload it, if needed.
+        """
+        extension = os.path.splitext( filename or local_path )[1]
+        with open( local_path, 'rb' ) as stream:
+            digest = copy_and_hash( stream, None )
+            name = content_name( digest, extension )
+            if not self.exists( name ):
+                stream.seek( 0 )
+                headers = { 'Content-Length': str( os.path.getsize( local_path ) ) }
+                # httplib sends a file body in blocks
+                response = self._request( 'PUT', name, stream, headers )
+                response.read()
+                if response.status not in ( httplib.OK, httplib.CREATED ):
+                    raise Exception( 'Could not store %s : %s'%( name, response.reason ) )
+        return self.stored_file_implementation( self, name )
+    
+    def checkin_stream( self, prefix, suffix, stream ):
+        """Check the datastream in as a file into the storage, the stream is
+        first written to a local temporary file, to calculate its hash"""
+        handle, temp_path = tempfile.mkstemp( suffix = suffix, prefix = prefix )
+        try:
+            with os.fdopen( handle, 'wb' ) as temp_file:
+                shutil.copyfileobj( stream, temp_file )
+            return self.checkin( temp_path )
+        finally:
+            os.remove( temp_path )
+    
+    def checkout( self, stored_file ):
+        """Download the file to the local cache, if it is not yet there, and
+        return the local path where it can be opened.  Since files are
+        named after their content, a cached file is never out of date."""
+        path = os.path.join( self._cache, *self._key( stored_file.name ).split( '/' ) )
+        if not os.path.exists( path ):
+            folder = os.path.dirname( path )
+            if not os.path.exists( folder ):
+                os.makedirs( folder )
+            response = self.checkout_stream( stored_file )
+            handle, temp_path = tempfile.mkstemp( dir = folder )
+            with os.fdopen( handle, 'wb' ) as temp_file:
+                shutil.copyfileobj( response, temp_file )
+            response.close()
+            if os.path.exists( path ):
+                os.remove( temp_path )
+            else:
+                os.rename( temp_path, path )
+        return path
+    
+    def checkout_stream( self, stored_file ):
+        """Check the file stored_file out of the storage as a datastream
+
+        :return: a file like object, that should be closed after use
+        """
+        response = self._request( 'GET', stored_file.name )
+        if response.status != httplib.OK:
+            response.read()
+            raise Exception( 'Could not retrieve %s : %s'%( stored_file.name, response.reason ) )
+        return response
+    
+    def path( self, name ):
+        """The local filesystem path where the file can be opened, this will
+        download the file if needed"""
+        return self.checkout( StoredFile( self, name ) )
+        
+    def delete( self, name ):
+        pass
+    
+class ObjectRequestHandler( BaseHTTPServer.BaseHTTPRequestHandler ):
+    """Handle the object requests of an :class:`ObjectServer`"""
+    
+    chunk_size = 64*1024
+    
+    def _path( self ):
+        """:return: the bucket, the key and the local path of the requested
+        object, the path is None if the key is not valid"""
+        url = urlparse.urlparse( self.path )
+        parts = urllib.unquote( url.path ).lstrip( '/' ).split( '/', 1 )
+        bucket = parts[0]
+        key = parts[1] if len( parts ) > 1 else ''
+        root = os.path.abspath( self.server.root )
+        path = os.path.abspath( os.path.join( root, bucket, *key.split( '/' ) ) )
+        if not path.startswith( os.path.join( root, bucket ) + os.sep ):
+            path = None
+        return bucket, key, path
+    
+    def _send_file( self, path, body ):
+        if path == None or not os.path.isfile( path ):
+            self.send_error( httplib.NOT_FOUND )
+            return
+        self.send_response( httplib.OK )
+        self.send_header( 'Content-Length', str( os.path.getsize( path ) ) )
+        self.send_header( 'Content-Type', 'application/octet-stream' )
+        self.end_headers()
+        if body:
+            with open( path, 'rb' ) as stream:
+                shutil.copyfileobj( stream, self.wfile, self.chunk_size )
+    
+    def do_HEAD( self ):
+        bucket, key, path = self._path()
+        if not key:
+            self.send_response( httplib.OK )
+            self.end_headers()
+            return
+        self._send_file( path, False )
+        
+    def do_GET( self ):
+        bucket, key, path = self._path()
+        if not key:
+            self._send_list( bucket )
+            return
+        self._send_file( path, True )
+        
+    def _send_list( self, bucket ):
+        query = urlparse.parse_qs( urlparse.urlparse( self.path ).query )
+        prefix = query.get( 'prefix', [''] )[0]
+        folder = os.path.join( self.server.root, bucket )
+        result = ElementTree.Element( 'ListBucketResult', xmlns = 'http://s3.amazonaws.com/doc/2006-03-01/' )
+        for path, _folders, filenames in os.walk( folder ):
+            relative_folder = os.path.relpath( path, folder )
+            for filename in filenames:
+                if relative_folder == '.':
+                    key = filename
+                else:
+                    key = '/'.join( relative_folder.split( os.sep ) + [ filename ] )
+                if key.startswith( prefix ) and not filename.startswith( '.' ):
+                    contents = ElementTree.SubElement( result, 'Contents' )
+                    ElementTree.SubElement( contents, 'Key' ).text = key.decode( 'utf-8' )
+        data = ElementTree.tostring( result, encoding = 'utf-8' )
+        self.send_response( httplib.OK )
+        self.send_header( 'Content-Length', str( len( data ) ) )
+        self.send_header( 'Content-Type', 'application/xml' )
+        self.end_headers()
+        self.wfile.write( data )
+        
+    def do_PUT( self ):
+        bucket, key, path = self._path()
+        if path == None or not key:
+            self.send_error( httplib.BAD_REQUEST )
+            return
+        folder = os.path.dirname( path )
+        if not os.path.exists( folder ):
+            os.makedirs( folder )
+        remaining = int( self.headers.get( 'Content-Length', 0 ) )
+        # write to a hidden temporary file, to never expose partial objects
+        handle, temp_path = tempfile.mkstemp( dir = folder, prefix = '.' )
+        with os.fdopen( handle, 'wb' ) as temp_file:
+            while remaining > 0:
+                chunk = self.rfile.read( min( remaining, self.chunk_size ) )
+                if not chunk:
+                    break
+                temp_file.write( chunk )
+                remaining -= len( chunk )
+        if remaining > 0:
+            os.remove( temp_path )
+            self.send_error( httplib.BAD_REQUEST )
+            return
+        if os.path.exists( path ):
+            os.remove( path )
+        os.rename( temp_path, path )
+        self.send_response( httplib.OK )
+        self.send_header( 'Content-Length', '0' )
+        self.end_headers()
+        
+    def do_DELETE( self ):
+        bucket, key, path = self._path()
+        if path != None and os.path.isfile( path ):
+            os.remove( path )
+        self.send_response( httplib.NO_CONTENT )
+        self.end_headers()
+        
+    def log_message( self, format, *args ):
+        LOGGER.debug( format%args )
+        
+class ObjectServer( SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer ):
+    """A local stand-in for an S3 compatible server, that stores objects
+    in a folder.  This server is meant to be used in tests only.
+    
+    :param root: the folder in which to store the objects, each bucket is a
+        sub folder.
+    :param port: the port on which to listen, by default a free port is
+        chosen
+    """
+    
+    daemon_threads = True
+    
+    def __init__( self, root, port = 0 ):
+        BaseHTTPServer.HTTPServer.__init__( self, ( '127.0.0.1', port ), 
+                                            ObjectRequestHandler )
+        self.root = root
+        self._thread = None
+        
+    @property
+    def url( self ):
+        return 'http://%s:%s/'%self.server_address
+    
+    def start( self ):
+        """Serve requests in a background thread"""
+        self._thread = threading.Thread( target = self.serve_forever )
+        self._thread.daemon = True
+        self._thread.start()
+        
+    def stop( self ):
+        self.shutdown()
+        self.server_close()
@@ -73,6 +73,9 @@ class StoredImage( StoredFile ):
         
         :return: a QImage
         """
+        return self._load_image()
+    
+    def _load_image( self ):
         from PyQt4.QtGui import QImage
         p = self.storage.checkout( self )
         image = QImage(p)
@@ -81,6 +84,54 @@ class StoredImage( StoredFile ):
             return QImage(':/image_not_found.png')
         else:
             return image
+        
+    def _thumbnail_cache_key( self, width, height ):
+        """:return: the thumbnail cache of the storage and the key of the
+        thumbnail in it, or None, None if the storage has no thumbnail cache.
+        The key is derived from the name only, so the storage is not 
+        accessed."""
+        thumbnail_cache = getattr( self.storage, 'thumbnail_cache', None )
+        if thumbnail_cache == None:
+            return None, None
+        return thumbnail_cache, thumbnail_cache.key( self.name, width, height )
+        
+    def create_thumbnail( self, width, height ):
+        """Create a thumbnail from the original image and store it in the
+        thumbnail cache of the storage.  This method does not use the model,
+        so it can be called in any thread.
+        
+        :return: a QImage
+        """
+        from PyQt4.QtCore import Qt
+        original_image = self._load_image()
+        thumbnail_image = original_image.scaled( width, height, Qt.KeepAspectRatio )
+        thumbnail_cache, key = self._thumbnail_cache_key( width, height )
+        if thumbnail_cache != None:
+            thumbnail_cache.put( key, thumbnail_image )
+        self._thumbnails[(width, height)] = thumbnail_image
+        return thumbnail_image
+    
+    def thumbnail_cached( self, width, height ):
+        """:return: True if the thumbnail is in the memory cache of this 
+        object or in the thumbnail cache of the storage"""
+        if (width, height) in self._thumbnails:
+            return True
+        thumbnail_cache, key = self._thumbnail_cache_key( width, height )
+        return thumbnail_cache != None and key in thumbnail_cache
+    
+    def _get_cached_thumbnail( self, width, height ):
+        """:return: the thumbnail from the memory or the disk cache, or None
+        if it is in neither of them"""
+        try:
+            return self._thumbnails[(width, height)]
+        except KeyError:
+            pass
+        thumbnail_cache, key = self._thumbnail_cache_key( width, height )
+        if thumbnail_cache != None:
+            thumbnail_image = thumbnail_cache.get( key )
+            if thumbnail_image != None:
+                self._thumbnails[(width, height)] = thumbnail_image
+            return thumbnail_image
 
     @model_function
     def checkout_thumbnail( self, width, height ):
@@ -91,16 +142,27 @@ class StoredImage( StoredFile ):
         
         :return: a QImage
         """
-        key = (width, height)
-        try:
-            thumbnail_image = self._thumbnails[key]
-            return thumbnail_image
-        except KeyError:
-            pass
-        from PyQt4.QtCore import Qt
-        original_image = self.checkout_image()
-        thumbnail_image = original_image.scaled( width, height, Qt.KeepAspectRatio )
-        self._thumbnails[key] = thumbnail_image
+        thumbnail_image = self._get_cached_thumbnail( width, height )
+        if thumbnail_image == None:
+            thumbnail_image = self.create_thumbnail( width, height )
+        return thumbnail_image
+    
+    @model_function
+    def checkout_thumbnail_in_background( self, width, height, ready = None ):
+        """Checkout a thumbnail for this image if it is in the memory cache
+        or the thumbnail cache, otherwise have it generated in a background 
+        thread.  The original image is never checked out in the model thread,
+        since this might involve a download.
+        
+        :param ready: a function without arguments that will be called in the
+            background thread once the thumbnail is available
+        :return: a QImage, or None if the thumbnail is being generated, in
+            which case a placeholder can be displayed
+        """
+        thumbnail_image = self._get_cached_thumbnail( width, height )
+        if thumbnail_image == None:
+            from thumbnails import get_thumbnail_generator
+            get_thumbnail_generator().generate( self, width, height, ready )
         return thumbnail_image
 
 class Storage( object ):
@@ -132,6 +194,7 @@ class Storage( object ):
         self._subfolder = upload_to
         self._upload_to = None
         self.stored_file_implementation = stored_file_implementation
+        self._thumbnail_cache = None
         #
         # don't do anything here that might reduce the startup time, like verifying the
         # availability of the storage, since the path might be on a slow network share
@@ -147,6 +210,17 @@ class Storage( object ):
                 root = self._root
             self._upload_to = os.path.join( root, self._subfolder )
         return self._upload_to
+    
+    @property
+    def thumbnail_cache(self):
+        """The :class:`camelot.core.files.thumbnails.ThumbnailCache` with the
+        thumbnails of the images in this storage"""
+        if self._thumbnail_cache == None:
+            import os
+            from thumbnails import ThumbnailCache
+            self._thumbnail_cache = ThumbnailCache( os.path.join( self.upload_to,
+                                                                  '.thumbnails' ) )
+        return self._thumbnail_cache
         
     def available(self):
         """Verify if the storage is available
@@ -184,7 +258,7 @@ class Storage( object ):
         """
         import glob
         import os
-        return (StoredFile(self, os.path.basename(name) ) for name in glob.glob( os.path.join( self.upload_to, u'%s*%s'%(prefix, suffix) ) ) )
+        return (self.stored_file_implementation(self, os.path.basename(name) ) for name in glob.glob( os.path.join( self.upload_to, u'%s*%s'%(prefix, suffix) ) ) )
 
     def path( self, name ):
         """The local filesystem path where the file can be opened using Python standard open"""
@@ -258,10 +332,11 @@ class Storage( object ):
         """
         self.available()
         import os
+        import shutil
         ( handle, to_path ) = self._create_tempfile( suffix, prefix )
         logger.debug(u'checkin stream to %s'%to_path)
         file = os.fdopen( handle, 'wb' )
-        file.write( stream.read() )
+        shutil.copyfileobj( stream, file )
         file.flush()
         file.close()
         return self.stored_file_implementation( self, os.path.basename( to_path ) )
@@ -285,6 +360,103 @@ class Storage( object ):
     def delete( self, name ):
         pass
 
+def copy_and_hash( source, destination, chunk_size = 64*1024 ):
+    """Copy the data from one file object to another, in chunks, while
+    calculating the SHA-256 hash of the data.
+    
+    :param source: a file object to read from
+    :param destination: a file object to write to, or None if the data should
+        only be hashed
+    :return: the hexadecimal SHA-256 digest of the data
+    """
+    import hashlib
+    digest = hashlib.sha256()
+    while True:
+        chunk = source.read( chunk_size )
+        if not chunk:
+            break
+        digest.update( chunk )
+        if destination != None:
+            destination.write( chunk )
+    return digest.hexdigest()
+
+def content_name( digest, extension ):
+    """:return: the name of a file in a content addressed storage, with the
+    first 4 characters of the digest as 2 levels of sub directories"""
+    return u'/'.join( [ digest[:2], digest[2:4], digest + extension.lower() ] )
+
+class ContentAddressedStorage( Storage ):
+    """A storage that names files after the SHA-256 hash of their content, 
+    identical files are thus stored only once.  The files are spread over a
+    tree of sub directories named after the first characters of the hash,
+    to avoid directories with a huge number of files::
+    
+        upload_to/9f/86/9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08.png
+        
+    The extension of the checked in file is kept, so the file can be opened
+    with the right application.
+    
+    Use this storage in a column definition ::
+    
+        class Movie( Entity ):
+            script = Column( camelot.types.File( upload_to = 'script',
+                                                 storage = ContentAddressedStorage ) )
+                                                 
+    Since a file might be referred to by multiple objects, files are never 
+    deleted.
+    """
+    
+    def _checkin( self, stream, extension ):
+        """Write the stream to a temporary file while hashing it, and move it
+        to its content addressed name, unless that file already exists"""
+        import os
+        self.available()
+        ( handle, temp_path ) = self._create_tempfile( extension, 'checkin' )
+        temp_file = os.fdopen( handle, 'wb' )
+        try:
+            digest = copy_and_hash( stream, temp_file )
+        finally:
+            temp_file.close()
+        name = content_name( digest, extension )
+        to_path = self.path( name )
+        if not os.path.exists( to_path ):
+            folder = os.path.dirname( to_path )
+            if not os.path.exists( folder ):
+                os.makedirs( folder )
+            try:
+                os.rename( temp_path, to_path )
+            except EnvironmentError:
+                # another process might have stored the same content
+                if not os.path.exists( to_path ):
+                    raise
+        if os.path.exists( temp_path ):
+            os.remove( temp_path )
+        logger.debug( u'checked in %s'%name )
+        return self.stored_file_implementation( self, name )
+    
+    def checkin( self, local_path, filename = None ):
+        import os
+        extension = os.path.splitext( filename or local_path )[1]
+        with open( local_path, 'rb' ) as stream:
+            return self._checkin( stream, extension )
+        
+    def checkin_stream( self, prefix, suffix, stream ):
+        return self._checkin( stream, suffix )
+    
+    def list( self, prefix = '*', suffix = '*' ):
+        import fnmatch
+        import os
+        pattern = u'%s*%s'%( prefix, suffix )
+        for folder, _folders, filenames in os.walk( self.upload_to ):
+            relative_folder = os.path.relpath( folder, self.upload_to )
+            # skip the top folder with temporary files, and hidden folders
+            # such as the thumbnail cache
+            if relative_folder.startswith( '.' ):
+                continue
+            for filename in fnmatch.filter( filenames, pattern ):
+                name = u'/'.join( relative_folder.split( os.sep ) + [ filename ] )
+                yield self.stored_file_implementation( self, name )
+
 class S3Storage( object ):
     """Helper class that opens and saves StoredFile objects into Amazon S3.
 
@@ -0,0 +1,251 @@
+#  ============================================================================
+#
+#  Copyright (C) 2007-2012 Conceptive Engineering bvba. All rights reserved.
+#  www.conceptive.be / project-camelot@conceptive.be
+#
+#  This file is part of the Camelot Library.
+#
+#  This file may be used under the terms of the GNU General Public
+#  License version 2.0 as published by the Free Software Foundation
+#  and appearing in the file license.txt included in the packaging of
+#  this file.  Please review this information to ensure GNU
+#  General Public Licensing requirements will be met.
+#
+#  If you are unsure which license is appropriate for your use, please
+#  visit www.python-camelot.com or contact project-camelot@conceptive.be
+#
+#  This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+#  WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  For use of this library in commercial applications, please contact
+#  project-camelot@conceptive.be
+#
+#  ============================================================================
+
+"""Thumbnails of the images in a :class:`camelot.core.files.storage.Storage`
+are kept in a cache on disk, in the `.thumbnails` folder of the storage.  This
+way they survive the reloading of objects and restarts of the application.
+
+A thumbnail is stored under a key derived from the name of the original 
+image and the size of the thumbnail, so the original image need not be checked
+out to look up its thumbnail.  A storage never stores another file under the
+name of a checked in file.  When the total size of the cache grows beyond its
+maximum size, the least recently used thumbnails are removed.
+
+Thumbnails that are not in the cache are generated by the 
+:class:`ThumbnailGenerator` in a background thread, to avoid blocking the
+model thread while the original images are checked out, read and decoded.
+"""
+
+import hashlib
+import logging
+import os
+import Queue
+import tempfile
+
+from PyQt4 import QtCore, QtGui
+
+from camelot.core.threading import synchronized
+
+LOGGER = logging.getLogger( 'camelot.core.files.thumbnails' )
+
+class ThumbnailCache( object ):
+    """A cache of thumbnails in a folder on disk, this object can be used
+    from multiple threads"""
+    
+    # the maximum total size of the thumbnails in the cache, in bytes
+    max_size = 50 * 1024 * 1024
+    
+    def __init__( self, root ):
+        """:param root: the folder in which to store the thumbnails"""
+        self._mutex = QtCore.QMutex()
+        self.root = root
+        # the total size of the thumbnails, None if not yet known
+        self._size = None
+        
+    def key( self, name, width, height ):
+        """
+        :param name: the name of the original image in the storage
+        :param width: the width of the thumbnail
+        :param height: the height of the thumbnail
+        :return: the key under which the thumbnail is cached
+        """
+        description = u'%s|%s|%s'%( name, width, height )
+        return hashlib.sha1( description.encode( 'utf-8' ) ).hexdigest()
+        
+    def _path( self, key ):
+        return os.path.join( self.root, key[:2], key + '.png' )
+    
+    def __contains__( self, key ):
+        return os.path.exists( self._path( key ) )
+    
+    def get( self, key ):
+        """:return: the thumbnail as a QImage, or None if it is not in the
+        cache"""
+        path = self._path( key )
+        if not os.path.exists( path ):
+            return None
+        image = QtGui.QImage( path )
+        if image.isNull():
+            return None
+        try:
+            # mark the thumbnail as recently used
+            os.utime( path, None )
+        except EnvironmentError:
+            pass
+        return image
+    
+    def put( self, key, image ):
+        """Store a thumbnail in the cache
+        :param image: a QImage
+        """
+        path = self._path( key )
+        folder = os.path.dirname( path )
+        try:
+            if not os.path.exists( folder ):
+                os.makedirs( folder )
+            # the thumbnail is written to a temporary file first, so other
+            # threads or processes never read a partially written thumbnail
+            handle, temp_path = tempfile.mkstemp( suffix = '.tmp', dir = folder )
+            os.close( handle )
+            try:
+                if not image.save( temp_path, 'PNG' ):
+                    return
+                size = os.path.getsize( temp_path )
+                try:
+                    os.rename( temp_path, path )
+                except EnvironmentError:
+                    # on Windows, renaming fails when the thumbnail was
+                    # stored by another thread in the mean time
+                    if not os.path.exists( path ):
+                        raise
+                    return
+            finally:
+                if os.path.exists( temp_path ):
+                    os.remove( temp_path )
+            self._added( size )
+        except EnvironmentError, e:
+            LOGGER.warn( u'could not store thumbnail in %s'%folder, exc_info = e )
+            
+    def _thumbnails( self ):
+        """:return: a list of (last use, size, path) tuples of the thumbnails
+        in the cache"""
+        thumbnails = []
+        for folder, _folders, filenames in os.walk( self.root ):
+            for filename in filenames:
+                if not filename.endswith( '.png' ):
+                    continue
+                path = os.path.join( folder, filename )
+                try:
+                    stat = os.stat( path )
+                except EnvironmentError:
+                    continue
+                thumbnails.append( ( stat.st_mtime, stat.st_size, path ) )
+        return thumbnails
+            
+    @synchronized
+    def _added( self, size ):
+        if self._size == None:
+            self._size = sum( t[1] for t in self._thumbnails() )
+        else:
+            self._size += size
+        if self._size > self.max_size:
+            self._evict()
+            
+    def _evict( self ):
+        """Remove the least recently used thumbnails, until the cache is
+        filled for three quarters, to avoid evicting after every addition"""
+        thumbnails = self._thumbnails()
+        thumbnails.sort()
+        self._size = sum( t[1] for t in thumbnails )
+        for _last_use, size, path in thumbnails:
+            if self._size <= self.max_size * 3 / 4:
+                break
+            try:
+                os.remove( path )
+                self._size -= size
+            except EnvironmentError:
+                pass
+
+class ThumbnailGenerator( QtCore.QThread ):
+    """Thread that generates thumbnails in the background.  Requests for
+    a thumbnail that is already being generated are ignored."""
+    
+    def __init__( self ):
+        super( ThumbnailGenerator, self ).__init__()
+        self._mutex = QtCore.QMutex()
+        self._queue = Queue.Queue()
+        self._pending = set()
+        
+    @synchronized
+    def generate( self, stored_image, width, height, ready = None ):
+        """Generate a thumbnail of a stored image, keep it with the stored 
+        image and store it in the thumbnail cache of its storage, if the 
+        storage has one.
+        
+        :param ready: a function that will be called without arguments, 
+            within the generator thread, when the thumbnail is available.
+        """
+        key = ( id( stored_image ), width, height )
+        if key in self._pending:
+            return
+        self._pending.add( key )
+        self._queue.put( ( key, stored_image, width, height, ready ) )
+        if not self.isRunning():
+            self.start()
+            
+    @synchronized
+    def _done( self, key ):
+        self._pending.discard( key )
+        
+    def stop( self ):
+        """Stop the thread once the thumbnails that were requested before
+        are generated, and wait until it has finished"""
+        if self.isRunning():
+            self._queue.put( None )
+            self.wait()
+        
+    def run( self ):
+        while True:
+            request = self._queue.get()
+            if request == None:
+                break
+            key, stored_image, width, height, ready = request
+            try:
+                # another stored image with the same name might have stored
+                # the thumbnail in the meantime
+                if stored_image._get_cached_thumbnail( width, height ) == None:
+                    stored_image.create_thumbnail( width, height )
+                if ready != None and stored_image.thumbnail_cached( width, height ):
+                    ready()
+            except Exception, e:
+                LOGGER.warn( u'could not generate thumbnail of %s'%stored_image.name,
+                             exc_info = e )
+            finally:
+                self._done( key )
+
+_thumbnail_generator_ = []
+
+def get_thumbnail_generator():
+    """Get the singleton thumbnail generator"""
+    if not _thumbnail_generator_:
+        _thumbnail_generator_.append( ThumbnailGenerator() )
+    return _thumbnail_generator_[0]
+
+def stop_thumbnail_generator():
+    """Stop the singleton thumbnail generator, if it was constructed"""
+    for generator in _thumbnail_generator_:
+        generator.stop()
+
+_placeholder_ = []
+
+def placeholder_thumbnail():
+    """:return: a QImage to display while the thumbnail is generated"""
+    if not _placeholder_:
+        import camelot
+        from camelot.core.resources import resource_string
+        image = QtGui.QImage()
+        image.loadFromData( resource_string( camelot.__name__, 
+                                             'art/tango/32x32/mimetypes/image-x-generic.png' ) )
+        _placeholder_.append( image )
+    return _placeholder_[0]
@@ -0,0 +1,117 @@
+#  ============================================================================
+#
+#  Copyright (C) 2007-2012 Conceptive Engineering bvba. All rights reserved.
+#  www.conceptive.be / project-camelot@conceptive.be
+#
+#  This file is part of the Camelot Library.
+#
+#  This file may be used under the terms of the GNU General Public
+#  License version 2.0 as published by the Free Software Foundation
+#  and appearing in the file license.txt included in the packaging of
+#  this file.  Please review this information to ensure GNU
+#  General Public Licensing requirements will be met.
+#
+#  If you are unsure which license is appropriate for your use, please
+#  visit www.python-camelot.com or contact project-camelot@conceptive.be
+#
+#  This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+#  WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  For use of this library in commercial applications, please contact
+#  project-camelot@conceptive.be
+#
+#  ============================================================================
+
+
+"""Reload the objects in a session from the database in bulk, with a query
+for each chunk of objects of the same mapper, instead of a query for each
+object.
+"""
+
+import collections
+import logging
+
+from sqlalchemy import orm, sql
+
+LOGGER = logging.getLogger('camelot.core.orm.refresh')
+
+class SessionRefresh(object):
+    """Reloads all objects in the identity map of a session.
+    
+    The objects are grouped by mapper, and each chunk of objects is reloaded
+    with a single query on their primary keys.  Objects that are no longer 
+    returned by this query were deleted outside the session, and are
+    expunged from the session.
+    
+    When a mapper has a version column, only the primary keys and versions 
+    are queried first, and only the objects with a different version, or
+    with pending changes, are reloaded.
+    
+    After the refresh, the `refreshed` attribute contains the list of
+    objects that were reloaded, and the `expunged` attribute the list of
+    objects that were expunged.
+    
+    :param session: the session to refresh
+    """
+    
+    chunk_size = 500
+    
+    def __init__(self, session):
+        self.session = session
+        self.refreshed = []
+        self.expunged = []
+        
+    def refresh(self):
+        """Generator that refreshes the session, yielding `(completed, total)`
+        tuples with the number of objects that were handled after each
+        chunk"""
+        objects_by_mapper = collections.OrderedDict()
+        for obj in list(self.session.identity_map.values()):
+            mapper = orm.object_mapper(obj)
+            objects_by_mapper.setdefault(mapper, []).append(obj)
+        total = sum(len(objects) for objects in objects_by_mapper.values())
+        completed = 0
+        for mapper, objects in objects_by_mapper.items():
+            for i in range(0, len(objects), self.chunk_size):
+                chunk = objects[i:i+self.chunk_size]
+                self._refresh_chunk(mapper, chunk)
+                completed += len(chunk)
+                yield completed, total
+                
+    @staticmethod
+    def _primary_key_condition(mapper, primary_keys):
+        """:return: a clause selecting the rows of the primary keys"""
+        columns = mapper.primary_key
+        if len(columns) == 1:
+            return columns[0].in_([primary_key[0] for primary_key in primary_keys])
+        return sql.or_(*[sql.and_(*[column == value for column, value in zip(columns, primary_key)]) for primary_key in primary_keys])
+        
+    def _refresh_chunk(self, mapper, objects):
+        objects_by_key = dict((tuple(orm.attributes.instance_state(obj).key[1]), obj) for obj in objects)
+        version_column = mapper.version_id_col
+        if version_column is not None:
+            version_key = mapper.get_property_by_column(version_column).key
+            query = self.session.query(*(list(mapper.primary_key) + [version_column]))
+            query = query.filter(self._primary_key_condition(mapper, objects_by_key.keys()))
+            versions = dict((tuple(row[:-1]), row[-1]) for row in query)
+            found_keys = set(versions.keys())
+            keys_to_reload = []
+            for key in found_keys:
+                state = orm.attributes.instance_state(objects_by_key[key])
+                if state.modified or state.dict.get(version_key) != versions[key]:
+                    keys_to_reload.append(key)
+        else:
+            found_keys = None
+            keys_to_reload = objects_by_key.keys()
+        if keys_to_reload:
+            query = self.session.query(mapper).populate_existing()
+            query = query.filter(self._primary_key_condition(mapper, keys_to_reload))
+            reloaded_objects = query.all()
+            self.refreshed.extend(reloaded_objects)
+            if found_keys is None:
+                found_keys = set(tuple(orm.attributes.instance_state(obj).key[1]) for obj in reloaded_objects)
+        for key, obj in objects_by_key.iteritems():
+            if key not in found_keys:
+                # this object was deleted outside the scope of this session
+                self.session.expunge(obj)
+                self.expunged.append(obj)
@@ -0,0 +1,320 @@
+#  ============================================================================
+#
+#  Copyright (C) 2007-2012 Conceptive Engineering bvba. All rights reserved.
+#  www.conceptive.be / project-camelot@conceptive.be
+#
+#  This file is part of the Camelot Library.
+#
+#  This file may be used under the terms of the GNU General Public
+#  License version 2.0 as published by the Free Software Foundation
+#  and appearing in the file license.txt included in the packaging of
+#  this file.  Please review this information to ensure GNU
+#  General Public Licensing requirements will be met.
+#
+#  If you are unsure which license is appropriate for your use, please
+#  visit www.python-camelot.com or contact project-camelot@conceptive.be
+#
+#  This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+#  WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  For use of this library in commercial applications, please contact
+#  project-camelot@conceptive.be
+#
+#  ============================================================================
+
+"""Indexes to search the text columns of a table without scanning all its
+rows.  Such an index is used by 
+:func:`camelot.view.search.create_entity_search_query_decorator` when the
+:attr:`camelot.admin.entity_admin.EntityAdmin.list_search_index` attribute
+of the admin is set.
+
+Which index is used depends on the database :
+
+  * 'fulltext' on PostgreSQL : a GIN index on the `tsvector` of the text
+    columns, words are matched by prefix.
+    
+  * 'fulltext' on SQLite : an external content FTS5 table on the text 
+    columns, kept in sync with the table by triggers in the database.  Words
+    are matched by prefix.  This requires a single integer primary key.
+    
+  * 'trigram' on PostgreSQL : a trigram GIN index on each text column, 
+    which speeds up the `ILIKE` matching of the default search.
+    
+Creating an index locks the table and can take a long time, so the index is
+never created while searching.  It should be created when the schema is set
+up or migrated, with :func:`create_search_index`.  When the index does not 
+exist in the database, the default search is used.
+"""
+
+import logging
+
+from PyQt4 import QtCore
+
+import sqlalchemy.types
+from sqlalchemy import sql
+
+import camelot.types
+from camelot.core.threading import synchronized
+
+LOGGER = logging.getLogger( 'camelot.core.search_index' )
+
+def is_text_column( column ):
+    """:return: True if the column is searched by matching text"""
+    column_type = column.type
+    if isinstance( column_type, ( camelot.types.Color,
+                                  camelot.types.File,
+                                  camelot.types.Code,
+                                  camelot.types.VirtualAddress,
+                                  camelot.types.Image ) ):
+        return False
+    if isinstance( column_type, sqlalchemy.types.String ):
+        return True
+    impl = getattr( column_type, 'impl', None )
+    return isinstance( impl, sqlalchemy.types.String )
+
+class SearchIndex( object ):
+    """Base class for an index on the text columns of a table
+    
+    :param mapper: the mapper of the objects in the table
+    :param columns: the text columns of the table to index
+    """
+    
+    #: the name of the database dialect for which the index can be used
+    dialect = None
+    
+    def __init__( self, mapper, columns ):
+        self._mutex = QtCore.QMutex()
+        self.mapper = mapper
+        self.table = mapper.local_table
+        self.columns = columns
+        self._covered = frozenset( columns )
+        # the engines on which the index is available
+        self._available = dict()
+        
+    def covers( self, column ):
+        """:return: True if matching text in column is handled by
+        :meth:`match`"""
+        return False
+    
+    def match( self, word ):
+        """:return: a clause that filters the rows with a word in one of
+        the indexed columns, or None if the default clauses should be used
+        """
+        return None
+    
+    @synchronized
+    def available( self, connectable ):
+        """Check if the index exists in a database, without creating it
+        
+        :param connectable: an engine or connection to the database
+        :return: True if the index can be used
+        """
+        engine = connectable.engine
+        if engine not in self._available:
+            available = False
+            try:
+                available = self.exists( connectable )
+            except Exception, e:
+                LOGGER.warn( 'could not verify search index on %s'%self.table.name, exc_info = e )
+            self._available[engine] = available
+        return self._available[engine]
+    
+    def exists( self, connectable ):
+        """:return: True if the index exists in a database"""
+        raise NotImplementedError
+    
+    def create( self, connectable ):
+        """Create the index in a database if it does not exist yet"""
+        raise NotImplementedError
+    
+    def _exists( self, connectable, query, name ):
+        return connectable.execute( sql.text( query ), name = name ).first() is not None
+    
+class PostgresqlFullTextIndex( SearchIndex ):
+    """A GIN index on the tsvector of the text columns"""
+    
+    dialect = 'postgresql'
+    configuration = sql.literal_column( "'simple'" )
+    
+    def _vector( self, columns ):
+        document = None
+        for column in columns:
+            value = sql.func.coalesce( column, sql.literal_column( "''", type_ = column.type ) )
+            if document is None:
+                document = value
+            else:
+                document = document + sql.literal_column( "' '", type_ = column.type ) + value
+        return sql.func.to_tsvector( self.configuration, document )
+        
+    def covers( self, column ):
+        return column in self._covered
+    
+    def match( self, word ):
+        if not word:
+            return None
+        query = u"'%s':*"%word.replace( '\\', '\\\\' ).replace( "'", "''" )
+        return self._vector( self.columns ).op( '@@' )( sql.func.to_tsquery( self.configuration, query ) )
+    
+    def exists( self, connectable ):
+        return self._exists( connectable, 'SELECT 1 FROM pg_class WHERE relname = :name', 'ix_%s_search'%self.table.name )
+    
+    def create( self, connectable ):
+        name = 'ix_%s_search'%self.table.name
+        if self.exists( connectable ):
+            return
+        dialect = connectable.engine.dialect
+        preparer = dialect.identifier_preparer
+        # the index is defined on the unqualified column names
+        columns = [ sql.literal_column( preparer.quote( column.name, column.quote ), type_ = column.type ) for column in self.columns ]
+        vector = unicode( self._vector( columns ).compile( dialect = dialect ) )
+        connectable.execute( sql.text( u'CREATE INDEX %s ON %s USING gin (%s)'%( preparer.quote( name, None ),
+                                                                                  preparer.format_table( self.table ),
+                                                                                  vector ) ) )
+    
+class PostgresqlTrigramIndex( SearchIndex ):
+    """A trigram GIN index on each text column, the default search clauses
+    make use of these indexes"""
+    
+    dialect = 'postgresql'
+    
+    def _name( self, column ):
+        return 'ix_%s_%s_trgm'%( self.table.name, column.name )
+    
+    def exists( self, connectable ):
+        for column in self.columns:
+            if not self._exists( connectable, 'SELECT 1 FROM pg_class WHERE relname = :name', self._name( column ) ):
+                return False
+        return True
+    
+    def create( self, connectable ):
+        preparer = connectable.engine.dialect.identifier_preparer
+        connectable.execute( sql.text( 'CREATE EXTENSION IF NOT EXISTS pg_trgm' ) )
+        for column in self.columns:
+            name = self._name( column )
+            if self._exists( connectable, 'SELECT 1 FROM pg_class WHERE relname = :name', name ):
+                continue
+            connectable.execute( sql.text( u'CREATE INDEX %s ON %s USING gin (%s gin_trgm_ops)'%( preparer.quote( name, None ),
+                                                                                                   preparer.format_table( self.table ),
+                                                                                                   preparer.format_column( column ) ) ) )
+    
+class SqliteFullTextIndex( SearchIndex ):
+    """An external content FTS5 table on the text columns, the rowid of the
+    FTS5 table is the primary key of the table.  Triggers on the table keep
+    the FTS5 table in sync, whatever process writes to the table."""
+    
+    dialect = 'sqlite'
+    
+    def __init__( self, mapper, columns ):
+        super( SqliteFullTextIndex, self ).__init__( mapper, columns )
+        self.name = '%s_search'%self.table.name
+        self.primary_key = list( self.table.primary_key.columns )[0]
+        
+    @classmethod
+    def supports( cls, table ):
+        """:return: True if the table has a primary key that can be used as
+        the rowid of the FTS5 table"""
+        primary_key = list( table.primary_key.columns )
+        return len( primary_key ) == 1 and isinstance( primary_key[0].type, sqlalchemy.types.Integer )
+        
+    def covers( self, column ):
+        return column in self._covered
+    
+    def match( self, word ):
+        if not word:
+            return None
+        search_table = sql.table( self.name, sql.column( 'rowid' ) )
+        query = u'"%s"*'%word.replace( '"', '""' )
+        return self.primary_key.in_( sql.select( [ search_table.c.rowid ],
+                                                 sql.literal_column( self.name ).op( 'MATCH' )( query ) ) )
+    
+    def exists( self, connectable ):
+        # the trigger is created last
+        return self._exists( connectable, "SELECT 1 FROM sqlite_master WHERE type='trigger' AND name = :name", '%s_au'%self.name )
+    
+    def create( self, connectable ):
+        if self.exists( connectable ):
+            return
+        preparer = connectable.engine.dialect.identifier_preparer
+        name = preparer.quote( self.name, None )
+        table = preparer.format_table( self.table )
+        primary_key = preparer.format_column( self.primary_key )
+        column_names = u', '.join( preparer.format_column( column ) for column in self.columns )
+        
+        def values( prefix ):
+            return u', '.join( [ u'%s.%s'%( prefix, primary_key ) ] + [ u'%s.%s'%( prefix, preparer.format_column( column ) ) for column in self.columns ] )
+        
+        insert = u'INSERT INTO %s(rowid, %s) VALUES (%s);'%( name, column_names, values( 'new' ) )
+        delete = u"INSERT INTO %s(%s, rowid, %s) VALUES ('delete', %s);"%( name, name, column_names, values( 'old' ) )
+        statements = [ u'CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, content=%s, content_rowid=%s)'%( name, column_names, table, primary_key ),
+                       # index the rows that are already in the table
+                       u"INSERT INTO %s(%s) VALUES ('rebuild')"%( name, name ),
+                       u'CREATE TRIGGER IF NOT EXISTS %s AFTER INSERT ON %s BEGIN %s END'%( preparer.quote( '%s_ai'%self.name, None ), table, insert ),
+                       u'CREATE TRIGGER IF NOT EXISTS %s AFTER DELETE ON %s BEGIN %s END'%( preparer.quote( '%s_ad'%self.name, None ), table, delete ),
+                       u'CREATE TRIGGER IF NOT EXISTS %s AFTER UPDATE ON %s BEGIN %s %s END'%( preparer.quote( '%s_au'%self.name, None ), table, delete, insert ), ]
+        for statement in statements:
+            connectable.execute( sql.text( statement ) )
+    
+search_indexes = {
+    'fulltext' : [ PostgresqlFullTextIndex, SqliteFullTextIndex ],
+    'trigram' : [ PostgresqlTrigramIndex ],
+}
+
+_indexes = dict()
+
+def _search_indexes( mapper, columns, kind, bind ):
+    """:return: an iterator over the search indexes of a kind that can be
+        used on a table in a database"""
+    table = mapper.local_table
+    columns = tuple( column for column in columns if is_text_column( column ) and getattr( column, 'table', None ) is table )
+    if not columns:
+        return
+    dialect = bind.dialect.name
+    for index_class in search_indexes.get( kind, [] ):
+        if index_class.dialect != dialect:
+            continue
+        if index_class == SqliteFullTextIndex and not SqliteFullTextIndex.supports( table ):
+            continue
+        key = ( mapper, columns, index_class )
+        index = _indexes.get( key )
+        if index == None:
+            index = _indexes.setdefault( key, index_class( mapper, list( columns ) ) )
+        yield index
+
+def get_search_index( mapper, columns, kind ):
+    """Get the search index of a table, the index is not created if it does
+    not exist
+    
+    :param mapper: the mapper of the objects to search
+    :param columns: the columns that are searched, only the text columns of
+        the local table of the mapper are indexed
+    :param kind: the kind of index, a key of `search_indexes`
+    :return: a :class:`SearchIndex` that is available in the database, or
+        None if no such index is available
+    """
+    bind = getattr( mapper.local_table, 'bind', None )
+    if bind == None:
+        return None
+    for index in _search_indexes( mapper, columns, kind, bind ):
+        if index.available( bind ):
+            return index
+    return None
+
+def create_search_index( mapper, columns, kind, connectable = None ):
+    """Create the search index of a table, if it does not exist yet.  This
+    should be done when the schema is set up or migrated.
+    
+    :param mapper: the mapper of the objects to search
+    :param columns: the columns that are searched
+    :param kind: the kind of index, a key of `search_indexes`
+    :param connectable: the engine or connection on which to create the
+        index, by default the bind of the table
+    :return: the created :class:`SearchIndex` or None if no such index can be
+        used for the database
+    """
+    if connectable == None:
+        connectable = mapper.local_table.bind
+    for index in _search_indexes( mapper, columns, kind, connectable ):
+        index.create( connectable )
+        index._available[connectable.engine] = True
+        return index
+    return None
@@ -445,6 +445,9 @@ class Party( Entity ):
         verbose_name = _('Party')
         verbose_name_plural = _('Parties')
         list_display = ['name', 'contact_mechanisms_email', 'contact_mechanisms_phone'] # don't use full name, since it might be None for new objects
+        # the contact mechanisms in the list are read from the deferred email
+        # and phone columns
+        list_eager_load = ['email', 'phone']
         list_search = ['full_name']
         list_filter = ['categories.name']
         form_display = ['addresses', 'contact_mechanisms', 'shares', 'directed_organizations']
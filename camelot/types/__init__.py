@@ -359,7 +359,11 @@ class File(types.TypeDecorator):
   :param upload_to: a subdirectory in the Storage, in which the the file
   should be stored.
 
-  :param storage: an alternative storage to use for this field.
+  :param storage: an alternative storage to use for this field, such as the
+  :class:`camelot.core.files.storage.ContentAddressedStorage` or the
+  :class:`camelot.core.files.http_storage.HttpStorage`.  This should be a
+  callable that takes `upload_to` and the `stored_file_implementation` as
+  arguments.
 
     """
     
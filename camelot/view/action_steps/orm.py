@@ -28,7 +28,7 @@ in the model.
 """
 
 from camelot.admin.action.base import ActionStep
-from camelot.view.remote_signals import get_signal_handler
+from camelot.view.remote_signals import get_signal_handler, EntityChangeset
 
 class FlushSession( ActionStep ):
     """Flushes the session and informs the GUI about the
@@ -45,12 +45,12 @@ class FlushSession( ActionStep ):
         #
         # @todo : deleting of objects should be moved from the collection_proxy
         #         to here, once deleting rows is reimplemented as an action
-        #
-        # @todo : handle the creation of new objects
-        #
         signal_handler = get_signal_handler()
+        # all changes are sent at once, grouped by entity type
+        changeset = EntityChangeset()
         # list of objects that need to receive an update signal
         dirty_objects = set( session.dirty )
+        new_objects = set( session.new )
         
         #for dirty_object in session.dirty:
         #    obj_admin = admin.get_related_admin( type( dirty_object ) )
@@ -61,7 +61,7 @@ class FlushSession( ActionStep ):
         #    obj_admin = admin.get_related_admin( type( obj_to_delete ) )
         #    if obj_admin:
         #        dirty_objects.update( obj_admin.get_depending_objects( obj_to_delete ) )
-            signal_handler.sendEntityDelete( self, obj_to_delete )
+            changeset.add_delete( obj_to_delete )
         #
         # Only now is the full list of dirty objects available, so the deleted
         # can be removed from them
@@ -74,7 +74,11 @@ class FlushSession( ActionStep ):
         
         session.flush()
         for obj in dirty_objects:
-            signal_handler.sendEntityUpdate( self, obj )
+            changeset.add_update( obj )
+        for obj in new_objects:
+            changeset.add_create( obj )
+        # the flush itself publishes the changes to other clients
+        signal_handler.send_entity_changes( self, changeset )
     
     def gui_run( self, gui_context ):
         pass
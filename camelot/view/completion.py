@@ -0,0 +1,274 @@
+#  ============================================================================
+#
+#  Copyright (C) 2007-2012 Conceptive Engineering bvba. All rights reserved.
+#  www.conceptive.be / project-camelot@conceptive.be
+#
+#  This file is part of the Camelot Library.
+#
+#  This file may be used under the terms of the GNU General Public
+#  License version 2.0 as published by the Free Software Foundation
+#  and appearing in the file license.txt included in the packaging of
+#  this file.  Please review this information to ensure GNU
+#  General Public Licensing requirements will be met.
+#
+#  If you are unsure which license is appropriate for your use, please
+#  visit www.python-camelot.com or contact project-camelot@conceptive.be
+#
+#  This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+#  WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  For use of this library in commercial applications, please contact
+#  project-camelot@conceptive.be
+#
+#  ============================================================================
+
+"""Completion of text typed in an editor with the representation of the
+objects that match the text, as used by the 
+:class:`camelot.view.controls.editors.many2oneeditor.Many2OneEditor`.
+
+Only the primary key, the representation and the searched columns of the
+matching objects are queried.  The object itself is only loaded when a
+completion is selected.
+
+The completions of the texts searched before are kept in a cache.  When the
+completions of a text were complete, the completions of a longer text 
+starting with that text are found in the cache, without a query.
+"""
+
+import collections
+import functools
+import itertools
+import logging
+
+from PyQt4 import QtCore
+
+from sqlalchemy import event, orm, schema
+
+from camelot.core.threading import synchronized
+from camelot.view.model_thread import model_function
+from camelot.view.model_thread.model_thread_pool import in_worker_session
+from camelot.view.search import create_entity_search_query_decorator
+
+LOGGER = logging.getLogger( 'camelot.view.completion' )
+
+def _get_object( entity, primary_key ):
+    from camelot.core.orm import Session
+    return Session().query( entity ).get( primary_key )
+
+def _searchable_text( value ):
+    """:return: the lower case text to match a search word with in memory"""
+    if value is None:
+        return None
+    if isinstance( value, ( list, tuple ) ):
+        value = u'.'.join( value )
+    return unicode( value ).lower()
+
+class Completion( object ):
+    """A completion of a text, it contains the representation of an object,
+    a function to get the object, and the values of the object that are
+    searched."""
+    
+    __slots__ = ( 'representation', 'object_getter', 'values' )
+    
+    def __init__( self, representation, object_getter, values ):
+        self.representation = representation
+        self.object_getter = object_getter
+        self.values = values
+        
+    def matches( self, words ):
+        """:return: True if each word is part of one of the values"""
+        for word in words:
+            for value in self.values:
+                if value is not None and word in value:
+                    break
+            else:
+                return False
+        return True
+
+class CompletionService( object ):
+    """Search the objects of an admin that match a text
+    
+    :param admin: the admin of the objects to complete
+    
+    The representation of a completion is the value of the first field in
+    the `list_display` of the admin that is a column of the object.  When
+    there is no such field, the objects are loaded to use their unicode 
+    representation.
+    """
+    
+    #: the maximum number of completions of a text
+    limit = 20
+    #: the maximum number of texts for which completions are cached
+    max_entries = 50
+    
+    def __init__( self, admin ):
+        self._mutex = QtCore.QMutex()
+        self.admin = admin
+        self.mapper = orm.class_mapper( admin.entity )
+        self.tables = frozenset( self.mapper.tables )
+        # lower case text -> ( complete, completions ), the least recently 
+        # used text first
+        self._cache = collections.OrderedDict()
+        self.keys = []
+        self.columns = []
+        self.representation_columns = []
+        for field_name in admin.list_display:
+            if isinstance( field_name, basestring ) and self.mapper.has_property( field_name ):
+                property = self.mapper.get_property( field_name )
+                if isinstance( property, orm.properties.ColumnProperty ):
+                    self.representation_columns.append( property.columns[0] )
+                    break
+        # searched columns of related objects might return an object more
+        # than once
+        self.joined = any( '.' in field_name for field_name in admin.list_search )
+        # the completions can only be narrowed in memory, if all searched
+        # columns are in the table of the object, and if they are matched
+        # as substrings, which is not the case when a search index is used.
+        self.narrowable = not self.joined
+        if getattr( admin, 'list_search_index', None ) != None:
+            self.narrowable = False
+        if admin.search_all_fields:
+            for property in self.mapper.iterate_properties:
+                if isinstance( property, orm.properties.ColumnProperty ):
+                    for column in property.columns:
+                        if isinstance( column, schema.Column ):
+                            self.keys.append( property.key )
+                            self.columns.append( column )
+        for field_name in admin.list_search:
+            if '.' not in field_name:
+                property = self.mapper.get_property( field_name )
+                self.keys.append( property.key )
+                self.columns.append( property.columns[0] )
+        
+    @staticmethod
+    def _words( text ):
+        return [ word for word in text.lower().split( ' ' ) if word ]
+        
+    @synchronized
+    def cached_completions( self, text ):
+        """Narrow the completions of a text searched before to the completions
+        of text.  This is only possible if the completions of the text 
+        searched before were complete, and if text can only match objects that
+        match the text searched before.  The latter is not the case for text 
+        with digits, which might match numbers or dates.
+        
+        :return: a list of :class:`Completion` objects or `None` if the 
+            completions are not in the cache
+        """
+        key = text.lower()
+        if key in self._cache:
+            complete, completions = self._cache.pop( key )
+            self._cache[key] = ( complete, completions )
+            return completions
+        if not self.narrowable or any( c.isdigit() for c in key ):
+            return None
+        previous_keys = [ k for k, ( complete, _c ) in self._cache.iteritems() if complete and key.startswith( k ) ]
+        if not previous_keys:
+            return None
+        previous_key = max( previous_keys, key = len )
+        words = self._words( key )
+        completions = [ c for c in self._cache[previous_key][1] if c.matches( words ) ]
+        self._set( key, True, completions )
+        return completions
+    
+    def _set( self, key, complete, completions ):
+        self._cache.pop( key, None )
+        self._cache[key] = ( complete, completions )
+        while len( self._cache ) > self.max_entries:
+            self._cache.popitem( last = False )
+            
+    @synchronized
+    def clear( self ):
+        """Remove all completions from the cache"""
+        self._cache.clear()
+        
+    @model_function
+    def search( self, text ):
+        """Search for objects that match text
+        
+        :return: a list of :class:`Completion` objects
+        """
+        completions = self.cached_completions( text )
+        if completions != None:
+            return completions
+        search_decorator = create_entity_search_query_decorator( self.admin, 
+                                                                 text )
+        if search_decorator == None:
+            return []
+        query = search_decorator( in_worker_session( self.admin.entity.query ) )
+        if self.representation_columns:
+            completions = list( self._completions_from_columns( query ) )
+        else:
+            completions = list( self._completions_from_objects( query ) )
+        complete = ( len( completions ) <= self.limit )
+        completions = completions[:self.limit]
+        locker = QtCore.QMutexLocker( self._mutex )
+        self._set( text.lower(), complete, completions )
+        locker.unlock()
+        return completions
+    
+    def _completions_from_columns( self, query ):
+        """Generate completions from a query of the primary key, the 
+        representation and the searched columns only"""
+        primary_key_columns = list( self.mapper.primary_key )
+        columns = primary_key_columns + self.representation_columns + self.columns
+        query = query.with_entities( *columns )
+        if self.joined:
+            query = query.distinct()
+        query = query.limit( self.limit + 1 )
+        representation_index = len( primary_key_columns )
+        values_index = representation_index + len( self.representation_columns )
+        for row in query:
+            object_getter = functools.partial( _get_object,
+                                               self.admin.entity,
+                                               tuple( row[:representation_index] ) )
+            representation = row[representation_index]
+            if representation is None:
+                representation = u''
+            values = tuple( _searchable_text( value ) for value in row[values_index:] )
+            yield Completion( unicode( representation ), object_getter, values )
+            
+    def _completions_from_objects( self, query ):
+        """Generate completions from a query of the objects, for objects
+        without a representation column"""
+        # undefer the searched columns, since their values are kept to 
+        # narrow the completions
+        query = query.options( *[ orm.undefer( key ) for key in self.keys ] )
+        query = query.limit( self.limit + 1 )
+        for obj in query:
+            object_getter = functools.partial( _get_object,
+                                               self.admin.entity,
+                                               self.mapper.primary_key_from_instance( obj ) )
+            values = tuple( _searchable_text( getattr( obj, key ) ) for key in self.keys )
+            yield Completion( unicode( obj ), object_getter, values )
+    
+_services = dict()
+
+def get_completion_service( admin ):
+    """:return: the :class:`CompletionService` shared by all editors of an
+    admin"""
+    service = _services.get( admin )
+    if service == None:
+        service = _services.setdefault( admin, CompletionService( admin ) )
+    return service
+
+def clear_completion_cache( tables = None ):
+    """Remove the cached completions of the objects in tables.
+    
+    :param tables: a set of tables in which rows were changed, `None` to
+        remove all cached completions, when it is unknown which tables were
+        changed, such as after changes by other clients.
+    """
+    for service in _services.values():
+        if tables == None or not tables.isdisjoint( service.tables ):
+            service.clear()
+
+@event.listens_for( orm.Session, 'after_flush' )
+def clear_completions( session, flush_context ):
+    """Remove the cached completions of the objects in tables in which rows
+    were inserted, updated or deleted by a flush."""
+    tables = set()
+    for obj in itertools.chain( session.new, session.deleted, session.dirty ):
+        tables.update( orm.object_mapper( obj ).tables )
+    if tables:
+        clear_completion_cache( tables )
@@ -29,13 +29,13 @@ from PyQt4 import QtCore
 from PyQt4.QtCore import Qt
 
 from camelot.view.art import Icon
-from camelot.view.model_thread import post, object_thread, model_function
-from camelot.view.search import create_entity_search_query_decorator
+from camelot.view.completion import get_completion_service
+from camelot.view.model_thread import ( post, object_thread, model_function,
+                                        get_model_thread, INTERACTIVE )
 from camelot.view.controls.decorated_line_edit import DecoratedLineEdit
 
 from camelot.core.utils import ugettext as _
 from camelot.core.utils import variant_to_pyobject
-from camelot.core.utils import create_constant_function
 
 from customeditor import CustomEditor, set_background_color_palette
 
@@ -44,10 +44,15 @@ logger = logging.getLogger('camelot.view.controls.editors.many2oneeditor')
 
 
 class Many2OneEditor( CustomEditor ):
-    """Widget for editing many 2 one relations"""
+    """Widget for editing many 2 one relations
+    
+    The completions of the typed text are searched when no key was pressed
+    for `completion_delay` milliseconds.
+    """
 
     new_icon = Icon('tango/16x16/actions/document-new.png')
     search_icon = Icon('tango/16x16/actions/system-search.png')
+    completion_delay = 250
 
     arrow_down_key_pressed = QtCore.pyqtSignal()
 
@@ -92,6 +97,14 @@ class Many2OneEditor( CustomEditor ):
         self._entity_representation = ''
         self.entity_instance_getter = None
         self._last_highlighted_entity_getter = None
+        self._completion_text = None
+        self._completion_service = None
+        if admin != None:
+            self._completion_service = get_completion_service( admin )
+        self._completion_timer = QtCore.QTimer( self )
+        self._completion_timer.setSingleShot( True )
+        self._completion_timer.setInterval( self.completion_delay )
+        self._completion_timer.timeout.connect( self.post_search_completions )
 
         self.layout = QtGui.QHBoxLayout()
         self.layout.setSpacing(0)
@@ -164,38 +177,47 @@ class Many2OneEditor( CustomEditor ):
 
     def textEdited(self, text):
         self._last_highlighted_entity_getter = None
-        text = self.search_input.user_input()
-
-        def create_search_completion(text):
-            return lambda: self.search_completions(text)
+        self._completion_text = unicode( self.search_input.user_input() )
+        self._completion_timer.stop()
+        # requests for the previous text are no longer needed
+        get_model_thread().cancel( self )
+        completions = None
+        if self._completion_service != None:
+            completions = self._completion_service.cached_completions( self._completion_text )
+        if completions != None:
+            self.display_search_completions( ( self._completion_text, completions ) )
+        else:
+            self._completion_timer.start()
 
+    @QtCore.pyqtSlot()
+    def post_search_completions(self):
+        if self._completion_text == None or self._completion_service == None:
+            return
         post(
-            create_search_completion(unicode(text)),
-            self.display_search_completions
+            update_wrapper( partial( self.search_completions, self._completion_text ),
+                            self.search_completions ),
+            self.display_search_completions,
+            read_only = True,
+            priority = INTERACTIVE,
+            owner = self
         )
-        self.completer.complete()
 
     @model_function
     def search_completions(self, text):
         """Search for object that match text, to fill the list of completions
 
-        :return: a list of tuples of (object_representation, object_getter)
+        :return: a tuple with the text and a list of 
+            :class:`camelot.view.completion.Completion` objects
         """
-        search_decorator = create_entity_search_query_decorator(
-            self.admin, text
-        )
-        if search_decorator:
-            sresult = [
-                (unicode(e), create_constant_function(e))
-                for e in search_decorator(self.admin.entity.query).limit(20)
-            ]
-            return text, sresult
-        return text, []
+        return text, self._completion_service.search( text )
 
     def display_search_completions(self, prefix_and_completions):
         assert object_thread( self )
         prefix, completions = prefix_and_completions
-        self.completions_model.setCompletions(completions)
+        if prefix != self._completion_text:
+            # the text was changed since the completions were requested
+            return
+        self.completions_model.setCompletions( [ ( c.representation, c.object_getter ) for c in completions ] )
         self.completer.setCompletionPrefix(prefix)
         self.completer.complete()
 
@@ -762,6 +762,9 @@ class TableView( AbstractView  ):
         self.table = self.AdminTableWidget( self.admin, splitter )
         self.table.setObjectName('AdminTableWidget')
         new_model = self.create_table_model( admin )
+        # the model is deleted together with the table, so requests posted
+        # on behalf of the model are dropped once the table is closed
+        new_model.setParent( self.table )
         self.table.setModel( new_model )
         self.table.verticalHeader().sectionClicked.connect( self.sectionClicked )
         self.table.keyboard_selection_signal.connect(self.on_keyboard_selection_signal)
@@ -0,0 +1,400 @@
+#  ============================================================================
+#
+#  Copyright (C) 2007-2012 Conceptive Engineering bvba. All rights reserved.
+#  www.conceptive.be / project-camelot@conceptive.be
+#
+#  This file is part of the Camelot Library.
+#
+#  This file may be used under the terms of the GNU General Public
+#  License version 2.0 as published by the Free Software Foundation
+#  and appearing in the file license.txt included in the packaging of
+#  this file.  Please review this information to ensure GNU
+#  General Public Licensing requirements will be met.
+#
+#  If you are unsure which license is appropriate for your use, please
+#  visit www.python-camelot.com or contact project-camelot@conceptive.be
+#
+#  This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+#  WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  For use of this library in commercial applications, please contact
+#  project-camelot@conceptive.be
+#
+#  ============================================================================
+
+"""Writers that stream rows to a spreadsheet file on disk, with a memory use
+that does not depend on the number of rows.
+
+Each writer is constructed with the field attributes of the columns, after
+which rows of values can be written one at a time ::
+
+    writer = XlsxWriter( filename, u'Persons', field_attributes )
+    for person in persons:
+        writer.write_row( [ person.first_name, person.last_name ] )
+    writer.close()
+    
+The way a value is written depends on its type and on the field attributes of
+its column, for each column the function to write a type of value is created 
+only once.  When the field attributes of a cell differ from those of its 
+column, such as dynamic field attributes, they are passed together with the 
+row, and a function is created for each combination of the 
+`format_attributes` that is used.
+"""
+
+import csv
+import datetime
+import decimal
+import os
+import re
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+from camelot.core.utils import ugettext
+
+# characters that are not allowed in an xml document
+_invalid_xml_characters = re.compile( u'[\x00-\x08\x0b\x0c\x0e-\x1f]' )
+
+_epoch = datetime.datetime( 1899, 12, 30 )
+
+def _excel_format( qt_format ):
+    """Convert a Qt date or time format to an Excel number format"""
+    return qt_format.lower().replace( 'ap', 'AM/PM' )
+
+def _excel_datetime( value ):
+    """:return: the number of days since the Excel epoch of a datetime, 
+    Excel has no time zones, so the time of an aware datetime is used as it
+    is in its own time zone"""
+    if value.tzinfo != None:
+        value = value.replace( tzinfo = None )
+    return ( value - _epoch ).total_seconds() / 86400
+
+def _column_letters( column ):
+    """:return: the letters of a column in a cell reference, 0 being 'A'"""
+    letters = ''
+    column = column + 1
+    while column:
+        column, remainder = divmod( column - 1, 26 )
+        letters = chr( ord( 'A' ) + remainder ) + letters
+    return letters
+
+class SpreadsheetWriter( object ):
+    """Base class for writers that stream rows to a spreadsheet file.
+    
+    :param filename: the name of the file to write to
+    :param title: the title of the spreadsheet
+    :param field_attributes: a list with the field attributes of each column
+    """
+    
+    #: the field attributes that change the way a value is written
+    format_attributes = ( 'precision', 'translate_content' )
+    
+    def __init__( self, filename, title, field_attributes ):
+        self.filename = filename
+        self.title = title
+        self.field_attributes = field_attributes
+        self.headers = [ unicode( attributes.get( 'name', '' ) ) for attributes in field_attributes ]
+        # for each column, a dictionary mapping the type of a value to the
+        # function that converts the value
+        self._formatters = [ dict() for _attributes in field_attributes ]
+        
+    def write_row( self, values, field_attributes = None ):
+        """Write a list of values as the next row
+        
+        :param field_attributes: `None` or a list with the field attributes
+            of each cell in the row, if they differ from those of the columns
+        """
+        raise NotImplementedError
+    
+    def close( self ):
+        """Finish writing the file"""
+        raise NotImplementedError
+    
+    def abort( self ):
+        """Stop writing and remove the file and all temporary files"""
+        raise NotImplementedError
+    
+    def _format( self, column, value, field_attributes = None ):
+        formatters = self._formatters[column]
+        if field_attributes == None:
+            key = type( value )
+            field_attributes = self.field_attributes[column]
+        else:
+            key = ( type( value ), ) + tuple( field_attributes.get( name ) for name in self.format_attributes )
+        try:
+            formatter = formatters[key]
+        except KeyError:
+            formatter = self.create_formatter( column, field_attributes, value )
+            formatters[key] = formatter
+        return formatter( value )
+    
+    def create_formatter( self, column, field_attributes, value ):
+        """:return: a function that converts values of the same type as value
+        in a column with field_attributes"""
+        raise NotImplementedError
+    
+class CsvWriter( SpreadsheetWriter ):
+    """Write rows to a comma separated values file, encoded in UTF-8, with
+    the column names as the first row.  Dates and times are written in ISO
+    format."""
+    
+    def __init__( self, filename, title, field_attributes, dialect = 'excel' ):
+        super( CsvWriter, self ).__init__( filename, title, field_attributes )
+        self._file = open( filename, 'wb' )
+        self._writer = csv.writer( self._file, dialect = dialect )
+        self._writer.writerow( [ header.encode( 'utf-8' ) for header in self.headers ] )
+        
+    def write_row( self, values, field_attributes = None ):
+        if field_attributes == None:
+            field_attributes = [ None ] * len( values )
+        self._writer.writerow( [ self._format( i, value, attributes ) for i, ( value, attributes ) in enumerate( zip( values, field_attributes ) ) ] )
+        
+    def close( self ):
+        self._file.close()
+        
+    def abort( self ):
+        self._file.close()
+        os.remove( self.filename )
+        
+    def create_formatter( self, column, field_attributes, value ):
+        if value is None:
+            return lambda value:''
+        if isinstance( value, basestring ):
+            if field_attributes.get( 'translate_content', False ):
+                return lambda value:ugettext( value ).encode( 'utf-8' )
+            return lambda value:unicode( value ).encode( 'utf-8' )
+        if isinstance( value, ( datetime.date, datetime.time ) ):
+            return lambda value:value.isoformat()
+        if isinstance( value, float ):
+            return repr
+        if isinstance( value, list ):
+            return lambda value:u'.'.join( value ).encode( 'utf-8' )
+        return lambda value:unicode( value ).encode( 'utf-8' )
+    
+class XlsxWriter( SpreadsheetWriter ):
+    """Write rows to an Office Open XML spreadsheet.  The rows of a sheet are
+    written to a temporary file, which is compressed into the spreadsheet 
+    when the writer is closed.  Strings are written inline, to avoid keeping
+    a table of shared strings in memory.  When the maximum number of rows of a
+    sheet is reached, a new sheet is started.
+    
+    The first `sample_rows` rows are kept in memory to determine the width
+    of the columns.
+    """
+    
+    max_rows = 1048576
+    sample_rows = 100
+    max_column_width = 50
+    
+    def __init__( self, filename, title, field_attributes, font_name = 'Arial' ):
+        from camelot.view.utils import ( local_date_format, 
+                                         local_datetime_format,
+                                         local_time_format )
+        super( XlsxWriter, self ).__init__( filename, title, field_attributes )
+        self.font_name = font_name
+        self._sheets = []
+        self._sheet = None
+        self._row = 0
+        self._sample = []
+        self._column_letters = [ _column_letters( i ) for i in range( len( field_attributes ) ) ]
+        # number formats and the index of their cell style, the first 3 cell
+        # styles are the default, title and header style
+        self._number_formats = []
+        self._date_style = self._number_style( _excel_format( local_date_format() ) )
+        self._datetime_style = self._number_style( _excel_format( local_datetime_format() ) )
+        self._time_style = self._number_style( _excel_format( local_time_format() ) )
+        
+    def _number_style( self, number_format ):
+        """:return: the index of the cell style with a number format"""
+        if number_format not in self._number_formats:
+            self._number_formats.append( number_format )
+        return self._number_formats.index( number_format ) + 3
+        
+    def write_row( self, values, field_attributes = None ):
+        if self._sheet == None:
+            if len( self._sample ) < self.sample_rows:
+                self._sample.append( ( values, field_attributes ) )
+                return
+            self._open_sheet()
+        if self._row >= self.max_rows:
+            self._close_sheet()
+            self._open_sheet()
+        self._write_row( values, field_attributes = field_attributes )
+        
+    def _write_row( self, values, style = None, field_attributes = None ):
+        self._row += 1
+        cells = []
+        if field_attributes == None:
+            field_attributes = [ None ] * len( values )
+        for i, ( value, attributes ) in enumerate( zip( values, field_attributes ) ):
+            if value is None:
+                continue
+            cells.append( u'<c r="%s%i"'%( self._column_letters[i], self._row ) )
+            if style == None:
+                cells.append( self._format( i, value, attributes ) )
+            else:
+                cells.append( u' s="%i" t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>'%( style, self._escape( value ) ) )
+        self._sheet.write( ( u'<row r="%i">%s</row>'%( self._row, u''.join( cells ) ) ).encode( 'utf-8' ) )
+        
+    @staticmethod
+    def _escape( value ):
+        return escape( _invalid_xml_characters.sub( u'', unicode( value ) ) )
+        
+    def _column_widths( self ):
+        """:return: the widths of the columns, based on the header and
+        the sample of rows"""
+        widths = [ max( 8, len( header ) ) for header in self.headers ]
+        for values, _field_attributes in self._sample:
+            for i, value in enumerate( values ):
+                if value is not None:
+                    widths[i] = max( widths[i], len( unicode( value ) ) )
+        return [ min( width, self.max_column_width ) + 2 for width in widths ]
+        
+    def _open_sheet( self ):
+        handle, path = tempfile.mkstemp( suffix = '.xml' )
+        self._sheets.append( path )
+        self._sheet = os.fdopen( handle, 'wb' )
+        self._sheet.write( '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                           '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                           '<sheetViews><sheetView workbookViewId="0">'
+                           '<pane ySplit="3" topLeftCell="A4" activePane="bottomLeft" state="frozen"/>'
+                           '</sheetView></sheetViews><cols>' )
+        for i, width in enumerate( self._column_widths() ):
+            self._sheet.write( '<col min="%i" max="%i" width="%i" customWidth="1"/>'%( i + 1, i + 1, width ) )
+        self._sheet.write( '</cols><sheetData>' )
+        self._row = 0
+        self._write_row( [ self.title ], style = 1 )
+        self._row += 1
+        self._write_row( self.headers, style = 2 )
+        sample, self._sample = self._sample, []
+        for values, field_attributes in sample:
+            self._write_row( values, field_attributes = field_attributes )
+        
+    def _close_sheet( self ):
+        self._sheet.write( '</sheetData></worksheet>' )
+        self._sheet.close()
+        
+    def create_formatter( self, column, field_attributes, value ):
+        # the formatters return the cell element, without its opening tag
+        # and reference, which depend on the position of the cell
+        
+        def number_formatter( style, convert = float ):
+            template = u' s="%i"><v>%%s</v></c>'%style
+            if convert == int:
+                return lambda value:template%int( value )
+            return lambda value:template%repr( convert( value ) )
+        
+        string_template = u' t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>'
+        if isinstance( value, bool ):
+            return lambda value:u' t="b"><v>%i</v></c>'%value
+        if isinstance( value, ( int, long ) ):
+            return number_formatter( self._number_style( '0' ), int )
+        if isinstance( value, ( float, decimal.Decimal ) ):
+            precision = field_attributes.get( 'precision', 2 )
+            style = self._number_style( '0.' + '0' * precision if precision else '0' )
+            return number_formatter( style )
+        if isinstance( value, datetime.datetime ):
+            return number_formatter( self._datetime_style, _excel_datetime )
+        if isinstance( value, datetime.date ):
+            return number_formatter( self._date_style, 
+                                     lambda value:float( ( value - _epoch.date() ).days ) )
+        if isinstance( value, datetime.time ):
+            return number_formatter( self._time_style, 
+                                     lambda value:( value.hour * 3600 + value.minute * 60 + value.second ) / 86400.0 )
+        if isinstance( value, list ):
+            convert = lambda value:u'.'.join( value )
+        elif isinstance( value, basestring ) and field_attributes.get( 'translate_content', False ):
+            convert = ugettext
+        else:
+            convert = unicode
+        escape_value = self._escape
+        return lambda value:string_template%escape_value( convert( value ) )
+    
+    def close( self ):
+        if self._sheet == None:
+            self._open_sheet()
+        self._close_sheet()
+        archive = zipfile.ZipFile( self.filename, 'w', zipfile.ZIP_DEFLATED )
+        try:
+            archive.writestr( '[Content_Types].xml', self._content_types() )
+            archive.writestr( '_rels/.rels', 
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+                '</Relationships>' )
+            archive.writestr( 'xl/workbook.xml', self._workbook() )
+            archive.writestr( 'xl/_rels/workbook.xml.rels', self._workbook_relations() )
+            archive.writestr( 'xl/styles.xml', self._styles() )
+            for i, path in enumerate( self._sheets ):
+                archive.write( path, 'xl/worksheets/sheet%i.xml'%( i + 1 ) )
+        finally:
+            archive.close()
+            self._remove_sheets()
+            
+    def abort( self ):
+        if self._sheet != None:
+            self._sheet.close()
+        self._remove_sheets()
+        if os.path.exists( self.filename ):
+            os.remove( self.filename )
+            
+    def _remove_sheets( self ):
+        for path in self._sheets:
+            os.remove( path )
+        self._sheets = []
+            
+    def _content_types( self ):
+        overrides = [ '<Override PartName="/xl/worksheets/sheet%i.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'%( i + 1 ) for i in range( len( self._sheets ) ) ]
+        return ( '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                 '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                 '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                 '<Default Extension="xml" ContentType="application/xml"/>'
+                 '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                 '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+                 '%s</Types>' )%''.join( overrides )
+    
+    def _workbook( self ):
+        sheets = [ '<sheet name="Sheet%i" sheetId="%i" r:id="rId%i"/>'%( i + 1, i + 1, i + 1 ) for i in range( len( self._sheets ) ) ]
+        return ( '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                 '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                 'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                 '<sheets>%s</sheets></workbook>' )%''.join( sheets )
+    
+    def _workbook_relations( self ):
+        relations = [ '<Relationship Id="rId%i" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet%i.xml"/>'%( i + 1, i + 1 ) for i in range( len( self._sheets ) ) ]
+        relations.append( '<Relationship Id="rId%i" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'%( len( self._sheets ) + 1 ) )
+        return ( '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                 '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                 '%s</Relationships>' )%''.join( relations )
+    
+    def _styles( self ):
+        font_name = quoteattr( self.font_name ).encode( 'utf-8' )
+        number_formats = [ '<numFmt numFmtId="%i" formatCode=%s/>'%( 164 + i, quoteattr( number_format ).encode( 'utf-8' ) ) for i, number_format in enumerate( self._number_formats ) ]
+        number_styles = [ '<xf numFmtId="%i" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'%( 164 + i ) for i in range( len( self._number_formats ) ) ]
+        return ( '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                 '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                 '<numFmts count="%i">%s</numFmts>'
+                 '<fonts count="3">'
+                 '<font><sz val="10"/><name val=%s/></font>'
+                 '<font><b/><sz val="12"/><name val=%s/></font>'
+                 '<font><b/><sz val="10"/><name val=%s/></font>'
+                 '</fonts>'
+                 '<fills count="3">'
+                 '<fill><patternFill patternType="none"/></fill>'
+                 '<fill><patternFill patternType="gray125"/></fill>'
+                 '<fill><patternFill patternType="solid"><fgColor rgb="FFC0C0C0"/></patternFill></fill>'
+                 '</fills>'
+                 '<borders count="2">'
+                 '<border><left/><right/><top/><bottom/><diagonal/></border>'
+                 '<border><left/><right/><top style="thin"/><bottom style="thin"/><diagonal/></border>'
+                 '</borders>'
+                 '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+                 '<cellXfs count="%i">'
+                 '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+                 '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+                 '<xf numFmtId="0" fontId="2" fillId="2" borderId="1" xfId="0" applyFont="1" applyFill="1" applyBorder="1"/>'
+                 '%s</cellXfs>'
+                 '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+                 '</styleSheet>' )%( len( number_formats ), ''.join( number_formats ),
+                                     font_name, font_name, font_name,
+                                     len( number_styles ) + 3, ''.join( number_styles ) )
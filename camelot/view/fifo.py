@@ -25,7 +25,8 @@
 """Module containing the FIFO cache used in the collection proxy to store
 the data that is passed between the model and the gui thread"""
 
-from copy import copy
+import bisect
+from collections import OrderedDict
 
 class Fifo(object):
     """Fifo, is the actual cache containing a limited set of copies of row data
@@ -35,24 +36,39 @@ class Fifo(object):
     
     the cache can be queried either by the row number or by object represented 
     by the row data.
+    
+    Despite its name, the cache evicts the least recently used row when it
+    is full : adding data to a row, or reading the data of a row moves that
+    row to the end of the eviction queue.  All operations on the cache are
+    O(1), so the cost of filling a row does not grow with the size of the
+    cache.
     """
+    
     def __init__(self, max_entries):
         """:param max_entries: the maximum entries that will be stored in the
-        cache, if more data is added, the oldest data gets removed"""
+        cache, if more data is added, the least recently used data gets 
+        removed"""
         self.max_entries = max_entries
-        self.entities = []
         self.data_by_rows = dict()
-        self.rows_by_entity = dict()
+        # the ordering of the keys in this dict is the eviction order, the
+        # least recently used entity is the first key
+        self.rows_by_entity = OrderedDict()
         
     def __unicode__(self):
         return u','.join(unicode(e) for e in self.entities)
     
     def __str__(self):
-        return 'Fifo cache of %s rows'%(len(self.entities))
+        return 'Fifo cache of %s rows'%(len(self.rows_by_entity))
     
     def __len__(self):
         """The number of rows in the cache"""
-        return len( self.entities )
+        return len( self.rows_by_entity )
+    
+    @property
+    def entities(self):
+        """:return: a list of the entities in the cache, from the least
+        recently used to the most recently used"""
+        return self.rows_by_entity.keys()
     
     def rows(self):
         """
@@ -65,27 +81,36 @@ class Fifo(object):
         """Copy the cache without the actual data but with the references
         to which object is stored in which row"""
         new_fifo = Fifo(max_entries)
-        new_fifo.entities = copy( self.entities )
         # None is to distinguish between a list of data and no data
-        new_fifo.data_by_rows = dict( (row, (entity,None)) for (row, (entity, value)) in self.data_by_rows.items() )
-        new_fifo.rows_by_entity = copy( self.rows_by_entity )
+        new_fifo.data_by_rows = dict( (row, (entity, None)) for (row, (entity, _value)) in self.data_by_rows.iteritems() )
+        new_fifo.rows_by_entity = OrderedDict( self.rows_by_entity )
+        new_fifo._evict()
         return new_fifo
+    
+    def _touch(self, entity, row):
+        """Mark the entity as the most recently used one"""
+        del self.rows_by_entity[entity]
+        self.rows_by_entity[entity] = row
+        
+    def _evict(self):
+        """Remove the least recently used entities until the cache is no
+        longer larger than its maximum size"""
+        while len(self.rows_by_entity) > self.max_entries:
+            _entity, row = self.rows_by_entity.popitem(last=False)
+            del self.data_by_rows[row]
         
     def add_data(self, row, entity, value):
         """The entity might already be on another row, and this row
         might already contain an entity"""
-#        try:
-#            previous_entity = self.get_entity_at_row(row)
-#            self.delete_by_entity(previous_entity)
-#        except KeyError:
-#            pass
         self.delete_by_entity(entity)
+        try:
+            previous_entity, _value = self.data_by_rows[row]
+            del self.rows_by_entity[previous_entity]
+        except KeyError:
+            pass
         self.data_by_rows[row] = (entity, value)
         self.rows_by_entity[entity] = row
-        self.entities.append(entity)
-        if len(self.entities)>self.max_entries:
-            entity = self.entities.pop(0)
-            self.delete_by_entity(entity)
+        self._evict()
       
     def delete_by_row(self, row):
         """Remove the data and the reference to the object at row"""
@@ -98,24 +123,36 @@ class Fifo(object):
         """Remove everything in the cache related to an entity instance
         returns the row at which the data was stored if the data was in the
         cache, return None otherwise"""
-        row = None
-        try:
-            row = self.rows_by_entity[entity]
+        row = self.rows_by_entity.pop(entity, None)
+        if row is not None:
             del self.data_by_rows[row]
-            del self.rows_by_entity[entity]      
-        except KeyError:
-            pass
-        try:
-            self.entities.remove(entity)
-        except ValueError:
-            pass
         return row    
     
+    def remove_rows(self, rows):
+        """Remove rows from the cache, the rows after a removed row move up,
+        while the data of those rows is kept.
+        
+        :param rows: the numbers of the rows that are removed
+        """
+        rows = sorted(set(rows))
+        for row in rows:
+            entity, _value = self.data_by_rows.pop(row, (None, None))
+            if entity is not None:
+                del self.rows_by_entity[entity]
+        
+        def shift(row):
+            return row - bisect.bisect_left(rows, row)
+        
+        self.data_by_rows = dict( (shift(row), data) for row, data in self.data_by_rows.iteritems() )
+        # assigning to existing keys keeps the eviction order
+        for entity, row in self.rows_by_entity.items():
+            self.rows_by_entity[entity] = shift(row)
+        
     def has_data_at_row(self, row):
         """:return: True if there is data in the cache for the row, False if 
-        there isn't"""
+        there isn't.  This does not mark the row as recently used."""
         try:
-            data = self.get_data_at_row( row )
+            data = self.data_by_rows[row][1]
             if data != None:
                 return True
         except KeyError:
@@ -124,7 +161,9 @@ class Fifo(object):
     
     def get_data_at_row(self, row):
         """:return: the data at row"""
-        return self.data_by_rows[row][1]
+        entity, value = self.data_by_rows[row]
+        self._touch(entity, row)
+        return value
     
     def get_row_by_entity(self, entity):
         """:return: the row at which an entity is stored"""
@@ -133,4 +172,3 @@ class Fifo(object):
     def get_entity_at_row(self, row):
         """:return: the entity that is stored at a row"""
         return self.data_by_rows[row][0]
-
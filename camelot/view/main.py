@@ -108,8 +108,9 @@ class Application( QtCore.QObject ):
         from camelot.core.conf import settings
         from camelot.core.sql import metadata
         metadata.bind = settings.ENGINE()
-        construct_model_thread()
-        construct_signal_handler()
+        construct_model_thread( workers = settings.get( 'CAMELOT_MODEL_THREAD_WORKERS', 0 ) )
+        message_bus = settings.get( 'CAMELOT_MESSAGE_BUS', None )
+        construct_signal_handler( message_bus = message_bus() if message_bus else None )
         mt = get_model_thread()
         mt.setup_exception_signal.connect( self.initialization_exception )
         mt.start()
@@ -273,12 +273,14 @@ class MainWindow(QtGui.QMainWindow):
             self.navpane = None
 
     def closeEvent( self, event ):
+        from camelot.core.files.thumbnails import stop_thumbnail_generator
         from camelot.view.model_thread import get_model_thread
         model_thread = get_model_thread()
         self.workspace.close_all_views()
         self.write_settings()
         logger.info( 'closing mainwindow' )
         model_thread.stop()
+        stop_thumbnail_generator()
         super( MainWindow, self ).closeEvent( event )
         QtCore.QCoreApplication.exit(0)
 
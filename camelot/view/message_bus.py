@@ -0,0 +1,235 @@
+#  ============================================================================
+#
+#  Copyright (C) 2007-2012 Conceptive Engineering bvba. All rights reserved.
+#  www.conceptive.be / project-camelot@conceptive.be
+#
+#  This file is part of the Camelot Library.
+#
+#  This file may be used under the terms of the GNU General Public
+#  License version 2.0 as published by the Free Software Foundation
+#  and appearing in the file license.txt included in the packaging of
+#  this file.  Please review this information to ensure GNU
+#  General Public Licensing requirements will be met.
+#
+#  If you are unsure which license is appropriate for your use, please
+#  visit www.python-camelot.com or contact project-camelot@conceptive.be
+#
+#  This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+#  WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  For use of this library in commercial applications, please contact
+#  project-camelot@conceptive.be
+#
+#  ============================================================================
+
+
+"""Message buses to broadcast the changes made to entities by one client
+to the other clients of the same database.
+
+A message is a compact `(entity, primary_key, change_type)` tuple, where
+entity is the dotted name of the entity class, primary_key a list with the
+values of the primary key and change_type either `'update'`, `'delete'` or
+`'create'`.
+
+The :class:`SocketMessageBus` exchanges messages through a 
+:class:`MessageBroker`, which relays the messages of each connected client
+to all other clients.  The broker can listen on a TCP port or on a local
+socket.  Other transports, such as a STOMP message server, can be used by
+subclassing :class:`MessageBus`.
+"""
+
+import datetime
+import decimal
+import json
+import logging
+import uuid
+
+from PyQt4 import QtCore, QtNetwork
+
+LOGGER = logging.getLogger('camelot.view.message_bus')
+
+def _socket_address(address):
+    """:return: a `(host, port)` tuple if address is a TCP address of the
+        form `'host:port'`, None if address is the name of a local socket"""
+    host, _sep, port = address.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return None
+
+# the types of primary key values that are not supported by json, with the
+# functions to convert them to and from text
+_key_types = {
+    'decimal': (decimal.Decimal, unicode, decimal.Decimal),
+    'uuid': (uuid.UUID, lambda value:value.hex, uuid.UUID),
+    'datetime': (datetime.datetime, 
+                 lambda value:value.strftime('%Y-%m-%dT%H:%M:%S.%f'),
+                 lambda text:datetime.datetime.strptime(text, '%Y-%m-%dT%H:%M:%S.%f')),
+    'date': (datetime.date, 
+             lambda value:value.strftime('%Y-%m-%d'),
+             lambda text:datetime.datetime.strptime(text, '%Y-%m-%d').date()),
+}
+
+def _encode_key_value(value):
+    """Convert a primary key value that is not supported by json to a
+    dictionary with its type and text"""
+    # datetime is a subclass of date, so it is checked first
+    for name in ('decimal', 'uuid', 'datetime', 'date'):
+        key_type, to_text, _from_text = _key_types[name]
+        if isinstance(value, key_type):
+            if isinstance(value, datetime.datetime) and value.tzinfo != None:
+                break
+            return {'__type__': name, 'value': to_text(value)}
+    raise TypeError('%r cannot be published'%(value,))
+
+def _decode_key_value(data):
+    """Convert a dictionary created by :func:`_encode_key_value` back to the
+    primary key value"""
+    name = data.get('__type__')
+    if name in _key_types:
+        _key_type, _to_text, from_text = _key_types[name]
+        return from_text(data['value'])
+    return data
+
+class MessageBus(QtCore.QObject):
+    """Base class for the transport of change messages between clients.
+    
+    A message bus lives in the GUI thread, but messages can be published
+    from any thread.  Subclasses implement :meth:`_publish`, and emit the
+    `messages_received_signal` with the list of messages received from
+    other clients.
+    """
+    
+    messages_received_signal = QtCore.pyqtSignal(object)
+    _publish_signal = QtCore.pyqtSignal(object)
+    
+    def __init__(self):
+        super(MessageBus, self).__init__()
+        # identifies the messages published by this bus
+        self.origin = uuid.uuid4().hex
+        self._publish_signal.connect(self._publish)
+        
+    def publish(self, messages):
+        """Publish a list of messages to the other clients
+        
+        :param messages: a list of `(entity, primary_key, change_type)` tuples
+        """
+        if messages:
+            self._publish_signal.emit(list(messages))
+            
+    @QtCore.pyqtSlot(object)
+    def _publish(self, messages):
+        raise NotImplementedError()
+    
+    def encode(self, messages):
+        """:return: a line of text with the messages, or None if the messages
+            could not be encoded.  An error is logged instead of raised, since
+            the messages are published while a session is committed."""
+        try:
+            return json.dumps({'origin': self.origin, 'messages': messages},
+                              default=_encode_key_value) + '\n'
+        except (TypeError, ValueError), e:
+            LOGGER.error('could not encode messages', exc_info=e)
+            return None
+    
+    def decode(self, line):
+        """:return: the list of messages in a line of text, the messages that
+            were published by this bus itself are ignored"""
+        try:
+            data = json.loads(line, object_hook=_decode_key_value)
+        except ValueError:
+            LOGGER.warn('could not decode message %s'%line[:100])
+            return []
+        if data.get('origin') == self.origin:
+            return []
+        return [(entity, tuple(primary_key), change_type) for entity, primary_key, change_type in data.get('messages', [])]
+    
+    def close(self):
+        pass
+
+class SocketMessageBus(MessageBus):
+    """Message bus that connects to a :class:`MessageBroker`
+    
+    :param address: `'host:port'` to connect to a broker listening on a TCP
+        port, or the name of the local socket of the broker.
+    """
+    
+    def __init__(self, address):
+        super(SocketMessageBus, self).__init__()
+        tcp_address = _socket_address(address)
+        if tcp_address != None:
+            self._socket = QtNetwork.QTcpSocket(self)
+            self._socket.connectToHost(*tcp_address)
+        else:
+            self._socket = QtNetwork.QLocalSocket(self)
+            self._socket.connectToServer(address)
+        self._socket.readyRead.connect(self._read)
+        
+    @QtCore.pyqtSlot(object)
+    def _publish(self, messages):
+        line = self.encode(messages)
+        if line != None:
+            self._socket.write(line)
+        
+    @QtCore.pyqtSlot()
+    def _read(self):
+        messages = []
+        while self._socket.canReadLine():
+            messages.extend(self.decode(str(self._socket.readLine())))
+        if messages:
+            self.messages_received_signal.emit(messages)
+            
+    def close(self):
+        self._socket.close()
+        
+class MessageBroker(QtCore.QObject):
+    """A minimal broker, relaying the lines of messages written by each 
+    connected :class:`SocketMessageBus` to all the other connected buses.
+    
+    :param address: `'host:port'` to listen on a TCP port, or the name of a
+        local socket.
+    """
+    
+    def __init__(self, address):
+        super(MessageBroker, self).__init__()
+        self._connections = []
+        tcp_address = _socket_address(address)
+        if tcp_address != None:
+            self._server = QtNetwork.QTcpServer(self)
+            listening = self._server.listen(QtNetwork.QHostAddress(tcp_address[0]), tcp_address[1])
+        else:
+            self._server = QtNetwork.QLocalServer(self)
+            QtNetwork.QLocalServer.removeServer(address)
+            listening = self._server.listen(address)
+        if not listening:
+            raise Exception('message broker could not listen on %s : %s'%(address, self._server.errorString()))
+        self._server.newConnection.connect(self._new_connection)
+        
+    @QtCore.pyqtSlot()
+    def _new_connection(self):
+        while self._server.hasPendingConnections():
+            connection = self._server.nextPendingConnection()
+            connection.readyRead.connect(self._relay)
+            connection.disconnected.connect(self._disconnected)
+            self._connections.append(connection)
+            
+    @QtCore.pyqtSlot()
+    def _relay(self):
+        sender = self.sender()
+        while sender.canReadLine():
+            line = sender.readLine()
+            for connection in self._connections:
+                if connection is not sender:
+                    connection.write(line)
+                    
+    @QtCore.pyqtSlot()
+    def _disconnected(self):
+        sender = self.sender()
+        if sender in self._connections:
+            self._connections.remove(sender)
+        sender.deleteLater()
+        
+    def close(self):
+        self._server.close()
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
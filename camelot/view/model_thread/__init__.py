@@ -34,6 +34,21 @@ _model_thread_ = []
 # this might be set to False, for unittesting purpose
 verify_threads = True
 
+#
+# The priorities of requests, requests with a higher priority are handled
+# before requests with a lower priority, even when they were posted later.
+#
+# INTERACTIVE : requests the user is waiting for, such as filling the visible
+#               rows of a table or completions
+# NORMAL : the default priority
+# BACKGROUND : requests whose results are not immediately needed, such as
+#              exports, validation or counting rows
+#
+INTERACTIVE = 0
+NORMAL = 1
+BACKGROUND = 2
+priorities = ( INTERACTIVE, NORMAL, BACKGROUND )
+
 class ModelThreadException(Exception):
     pass
 
@@ -63,12 +78,8 @@ def model_function(original_function):
 
     def in_model_thread():
         """return wether current thread is model thread"""
-        from no_thread_model_thread import NoThreadModelThread
         current_thread = QtCore.QThread.currentThread()
-        model_thread = get_model_thread()
-        return (current_thread==model_thread) or isinstance(
-            model_thread, (NoThreadModelThread,)
-        )
+        return get_model_thread().owns_thread( current_thread )
 
     @wraps(original_function)
     def wrapper(*args, **kwargs):
@@ -111,7 +122,9 @@ class AbstractModelThread(QtCore.QThread):
         """:param setup_thread: function to be called at startup of the thread
         to initialize everything, by default this will setup the model. Set to
         None if nothing should be done."""
+        from metrics import TaskMetrics
         super(AbstractModelThread, self).__init__()
+        self.metrics = TaskMetrics()
         self.logger = logging.getLogger(logger.name + '.%s' % id(self))
         self._setup_thread = setup_thread
         self._exit = False
@@ -131,7 +144,8 @@ class AbstractModelThread(QtCore.QThread):
     all work is done"""
         pass
 
-    def post(self, request, response=None, exception=None, args=()):
+    def post(self, request, response=None, exception=None, args=(), key=None,
+             read_only=False, priority=NORMAL, owner=None):
         """Post a request to the model thread, request should be a function
         that takes no arguments. The request function will be called within the
         model thread. When the request is finished, on first occasion, the
@@ -144,9 +158,55 @@ class AbstractModelThread(QtCore.QThread):
         :param exception: a slot that will be called in case request throws an
         exception
         :param args: arguments with which the request function will be called        
+        :param key: a hashable object to coalesce requests, if a request with
+        the same key is still waiting in the queue, this request is merged 
+        into the waiting one, and will not be called.  Requests posted with a
+        key should thus take their input from the state of the poster at the
+        time they are called, rather than from their arguments.
+        :param read_only: `True` if the request does not modify the model and
+        returns no objects, such requests might be handled in parallel by a
+        :class:`camelot.view.model_thread.model_thread_pool.ModelThreadPool`.
+        :param priority: one of `INTERACTIVE`, `NORMAL` or `BACKGROUND`
+        :param owner: a :class:`QtCore.QObject` on behalf of which the request
+        is posted.  When the owner is deleted, or the requests of the owner
+        are cancelled, before the request is handled, the request is dropped.
+        Requests that modify the model should thus not have an owner.
         """
         raise NotImplemented
 
+    def cancel(self, owner):
+        """Drop all requests of owner that are waiting in the queue"""
+        pass
+
+    def queue_wait_times(self):
+        """:return: a dictionary with for each priority a tuple with the
+        number of requests handled, the total and the maximum time in seconds
+        those requests waited in the queue"""
+        return dict()
+
+    def queue_depth(self):
+        """:return: the number of requests waiting in the queue"""
+        return 0
+
+    def get_metrics(self):
+        """:return: a dictionary with the metrics of the handled requests,
+        the queue depth, the busy ratio and the queue wait times per priority,
+        as documented in :mod:`camelot.view.model_thread.metrics`.  The 
+        dictionary can be serialized to JSON."""
+        queue_wait_times = dict()
+        for priority, (number, total, maximum) in self.queue_wait_times().iteritems():
+            queue_wait_times[priority] = dict( number = number,
+                                               total_wait = total,
+                                               max_wait = maximum )
+        return dict( tasks = self.metrics.tasks(),
+                     queue_depth = self.queue_depth(),
+                     busy_ratio = self.metrics.busy_ratio(),
+                     queue_wait_times = queue_wait_times )
+
+    def owns_thread(self, thread):
+        """:return: `True` if requests are handled within thread"""
+        return thread == self
+
     def busy(self):
         """Return True or False indicating wether either the model or the gui
         thread is doing something"""
@@ -158,8 +218,24 @@ class AbstractModelThread(QtCore.QThread):
         return True
 
 def construct_model_thread(*args, **kwargs):
-    from signal_slot_model_thread import SignalSlotModelThread
-    _model_thread_.insert(0, SignalSlotModelThread(*args, **kwargs))
+    """Construct the default model thread.
+    
+    :param workers: the number of worker threads that handle read only
+        requests.  If 0, the default, all requests are handled by a single
+        :class:`camelot.view.model_thread.signal_slot_model_thread.SignalSlotModelThread`,
+        otherwise a :class:`camelot.view.model_thread.model_thread_pool.ModelThreadPool`
+        is constructed.
+        
+    All other arguments are passed to the constructor of the model thread.
+    """
+    workers = kwargs.pop('workers', 0)
+    if workers:
+        from model_thread_pool import ModelThreadPool
+        model_thread = ModelThreadPool(*args, workers=workers, **kwargs)
+    else:
+        from signal_slot_model_thread import SignalSlotModelThread
+        model_thread = SignalSlotModelThread(*args, **kwargs)
+    _model_thread_.insert(0, model_thread)
 
 def has_model_thread():
     return len(_model_thread_) > 0
@@ -167,8 +243,10 @@ def has_model_thread():
 def get_model_thread():
     return _model_thread_[0]
 
-def post(request, response=None, exception=None, args=()):
+def post(request, response=None, exception=None, args=(), key=None,
+         read_only=False, priority=NORMAL, owner=None):
     """Post a request and a response to the default model thread"""
     mt = get_model_thread()
-    mt.post(request, response, exception, args)
+    mt.post(request, response, exception, args, key, read_only, priority,
+            owner)
 
@@ -0,0 +1,179 @@
+#  ============================================================================
+#
+#  Copyright (C) 2007-2012 Conceptive Engineering bvba. All rights reserved.
+#  www.conceptive.be / project-camelot@conceptive.be
+#
+#  This file is part of the Camelot Library.
+#
+#  This file may be used under the terms of the GNU General Public
+#  License version 2.0 as published by the Free Software Foundation
+#  and appearing in the file license.txt included in the packaging of
+#  this file.  Please review this information to ensure GNU
+#  General Public Licensing requirements will be met.
+#
+#  If you are unsure which license is appropriate for your use, please
+#  visit www.python-camelot.com or contact project-camelot@conceptive.be
+#
+#  This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+#  WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  For use of this library in commercial applications, please contact
+#  project-camelot@conceptive.be
+#
+#  ============================================================================
+
+"""Metrics of the tasks handled by a model thread, to find out why the
+application feels sluggish.
+
+Each model thread has a :class:`TaskMetrics` object as its `metrics`
+attribute, which records for each task, by name, how long it waited in the
+queue and how long it took to execute::
+
+    from camelot.view.model_thread import get_model_thread
+    
+    model_thread = get_model_thread()
+    model_thread.metrics.slow_task_threshold = 0.5
+    print model_thread.get_metrics()
+    
+When a slow task threshold is set, the stack at the moment a task was posted
+is kept, and logged when the task takes longer than the threshold to execute.
+
+The metrics can be written periodically to a rolling file of JSON records 
+with a :class:`MetricsExporter`::
+
+    exporter = MetricsExporter( model_thread, 'metrics.json' )
+"""
+
+import collections
+import json
+import logging
+from logging import handlers
+import time
+import traceback
+
+from PyQt4 import QtCore
+
+from camelot.core.threading import synchronized
+
+LOGGER = logging.getLogger('camelot.view.model_thread.metrics')
+
+class TaskMetrics(object):
+    """Thread safe collection of the waiting and execution times of tasks"""
+    
+    def __init__(self, window=60.0):
+        """
+        :param window: the number of seconds over which the busy ratio is
+            calculated
+        """
+        self._mutex = QtCore.QMutex()
+        self._window = window
+        # maximum number of seconds a task should take before its posting
+        # stack is logged, None to disable
+        self.slow_task_threshold = None
+        self.reset()
+        
+    @synchronized
+    def reset(self):
+        """Forget all recorded tasks"""
+        # for each task name, the number of tasks, the total and maximum
+        # wait time and the total and maximum execution time
+        self._tasks = dict()
+        # the end time and duration of the tasks executed within the window
+        self._executions = collections.deque()
+        
+    def posting_stack(self):
+        """:return: the stack of the caller of the post method, to be stored
+        with the task, or None if no slow task threshold is set"""
+        if self.slow_task_threshold == None:
+            return None
+        return traceback.format_stack()[:-2]
+    
+    def record(self, name, waited, executed, stack=None):
+        """Record a task that was executed
+        
+        :param name: the name of the task
+        :param waited: the number of seconds the task waited in the queue
+        :param executed: the number of seconds it took to execute the task
+        :param stack: the stack when the task was posted
+        """
+        self._record(name, waited, executed)
+        threshold = self.slow_task_threshold
+        if threshold != None and executed > threshold:
+            LOGGER.warning( u'slow task %s took %.3f seconds, posted from :\n%s'%( name,
+                                                                                  executed,
+                                                                                  u''.join( stack or [] ) ) )
+            
+    @synchronized
+    def _record(self, name, waited, executed):
+        number, total_wait, max_wait, total_execution, max_execution = self._tasks.get( name, (0, 0.0, 0.0, 0.0, 0.0) )
+        self._tasks[name] = ( number + 1, 
+                              total_wait + waited, 
+                              max( max_wait, waited ),
+                              total_execution + executed,
+                              max( max_execution, executed ) )
+        now = time.time()
+        self._executions.append( (now, executed) )
+        self._trim( now )
+        
+    def _trim(self, now):
+        start = now - self._window
+        while self._executions and self._executions[0][0] < start:
+            self._executions.popleft()
+        
+    @synchronized
+    def busy_ratio(self):
+        """:return: the fraction of the window during which tasks were
+        executed, in a pool of threads this might be larger than 1"""
+        now = time.time()
+        self._trim( now )
+        start = now - self._window
+        busy = sum( min( executed, end - start ) for end, executed in self._executions )
+        return busy / self._window
+    
+    @synchronized
+    def tasks(self):
+        """:return: a dictionary with for each task name a dictionary with
+        the number of times the task was executed and the total and maximum
+        wait and execution time"""
+        tasks = dict()
+        for name, values in self._tasks.iteritems():
+            number, total_wait, max_wait, total_execution, max_execution = values
+            tasks[name] = dict( number = number,
+                                total_wait = total_wait,
+                                max_wait = max_wait,
+                                total_execution = total_execution,
+                                max_execution = max_execution )
+        return tasks
+    
+class MetricsExporter(QtCore.QObject):
+    """Periodically append the metrics of a model thread as a JSON record to
+    a file.  When the file grows too large, it is rolled over, as with a 
+    :class:`logging.handlers.RotatingFileHandler`.
+    """
+    
+    def __init__(self, model_thread, filename, interval=60000, 
+                 max_bytes=1024*1024, backup_count=5, parent=None):
+        """
+        :param model_thread: the model thread of which to export the metrics
+        :param filename: the name of the file to which the metrics are written
+        :param interval: the number of milliseconds between two exports
+        :param max_bytes: the maximum size of the file before it is rolled over
+        :param backup_count: the number of rolled over files to keep
+        """
+        super(MetricsExporter, self).__init__(parent)
+        self._model_thread = model_thread
+        self._handler = handlers.RotatingFileHandler( filename, 
+                                                      maxBytes = max_bytes,
+                                                      backupCount = backup_count )
+        timer = QtCore.QTimer( self )
+        timer.timeout.connect( self.export )
+        timer.start( interval )
+        
+    @QtCore.pyqtSlot()
+    def export(self):
+        """Write the current metrics to the file"""
+        metrics = self._model_thread.get_metrics()
+        metrics['time'] = time.time()
+        record = logging.LogRecord( LOGGER.name, logging.INFO, __file__, 0,
+                                    json.dumps( metrics ), None, None )
+        self._handler.emit( record )
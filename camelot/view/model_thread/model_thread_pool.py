@@ -0,0 +1,187 @@
+#  ============================================================================
+#
+#  Copyright (C) 2007-2012 Conceptive Engineering bvba. All rights reserved.
+#  www.conceptive.be / project-camelot@conceptive.be
+#
+#  This file is part of the Camelot Library.
+#
+#  This file may be used under the terms of the GNU General Public
+#  License version 2.0 as published by the Free Software Foundation
+#  and appearing in the file license.txt included in the packaging of
+#  this file.  Please review this information to ensure GNU
+#  General Public Licensing requirements will be met.
+#
+#  If you are unsure which license is appropriate for your use, please
+#  visit www.python-camelot.com or contact project-camelot@conceptive.be
+#
+#  This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+#  WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  For use of this library in commercial applications, please contact
+#  project-camelot@conceptive.be
+#
+#  ============================================================================
+
+"""A model thread that distributes read only requests over a pool of
+worker threads.
+
+Each worker thread has its own SQLAlchemy session, since the
+:data:`camelot.core.orm.Session` is scoped to the current thread.  Requests
+that modify the model, or that return or keep objects that are used by other
+requests, are handled by the primary thread, exactly as by the 
+:class:`camelot.view.model_thread.signal_slot_model_thread.SignalSlotModelThread`.
+
+Only requests posted with `read_only=True` are handled by the workers.  Such
+requests should query the database through :func:`in_worker_session` and
+should return plain data instead of objects.  After each read only request,
+the session of the worker is removed, so no transaction is kept open and the
+next request sees the changes made by the primary thread.
+
+A pool needs a database that can be used through multiple connections at the
+same time, an in memory SQLite database is private to a single connection.
+"""
+
+import functools
+import logging
+
+from PyQt4 import QtCore
+
+from camelot.view.model_thread import setup_model, NORMAL
+from camelot.view.model_thread.signal_slot_model_thread import SignalSlotModelThread
+
+logger = logging.getLogger('camelot.view.model_thread.model_thread_pool')
+
+def in_worker_session(query):
+    """
+    :param query: a query bound to the session of the primary thread, such
+        as the `query` attribute of an `Entity` class.
+    :return: a copy of the query bound to the session of the current worker,
+        or the query itself when not called within a worker.
+    """
+    from camelot.core.orm import Session
+    if not isinstance(QtCore.QThread.currentThread(), Worker):
+        return query
+    session = Session()
+    if query.session is session:
+        return query
+    query = query._clone()
+    query.session = session
+    return query
+
+def _setup_worker():
+    """Workers use the model that was set up by the primary thread"""
+    pass
+
+def _in_worker_session(request):
+    """Wrap a request, to remove the session of the worker after the
+    request has been handled"""
+    
+    @functools.wraps(request)
+    def wrapper(*args):
+        from camelot.core.orm import Session
+        try:
+            return request(*args)
+        finally:
+            Session.remove()
+            
+    return wrapper
+
+class Worker(SignalSlotModelThread):
+    """A secondary thread of a :class:`ModelThreadPool`, that handles read
+    only requests"""
+    
+    collect_garbage = False
+    
+    def __init__(self):
+        super(Worker, self).__init__(setup_thread=_setup_worker)
+        
+    def post(self, request, response=None, exception=None, args=(), key=None,
+             read_only=True, priority=NORMAL, owner=None):
+        super(Worker, self).post(_in_worker_session(request), response,
+                                 exception, args, key, read_only, priority,
+                                 owner)
+        
+    def load(self):
+        """:return: the number of tasks queued or being handled"""
+        busy = self._task_handler != None and self._task_handler.busy()
+        return len(self._request_queue) + int(busy)
+        
+class ModelThreadPool(SignalSlotModelThread):
+    """A model thread that handles requests that modify the model in its own
+    thread, the primary thread, and read only requests in a number of worker
+    threads.  The workers are started once the primary thread has set up the
+    model.
+    """
+    
+    def __init__(self, setup_thread=setup_model, workers=2):
+        """
+        :param setup_thread: function to be called at startup of the primary
+            thread
+        :param workers: the number of worker threads that handle read only
+            requests
+        """
+        super(ModelThreadPool, self).__init__(setup_thread=self._setup_pool)
+        self._setup_model = setup_thread
+        self._workers = [Worker() for _i in range(workers)]
+        for worker in self._workers:
+            worker.thread_busy_signal.connect(self._thread_busy)
+            # all tasks of the pool are recorded together
+            worker.metrics = self.metrics
+        
+    def _setup_pool(self):
+        try:
+            self._setup_model()
+        finally:
+            for worker in self._workers:
+                worker.start()
+            
+    def owns_thread(self, thread):
+        return (thread == self) or (thread in self._workers)
+    
+    def post(self, request, response=None, exception=None, args=(), key=None,
+             read_only=False, priority=NORMAL, owner=None):
+        if read_only == False or not self._workers:
+            return super(ModelThreadPool, self).post(request, response,
+                                                     exception, args, key,
+                                                     read_only, priority,
+                                                     owner)
+        if key != None:
+            # requests with the same key go to the same worker, so they can
+            # be coalesced
+            worker = self._workers[hash(key) % len(self._workers)]
+        else:
+            worker = min(self._workers, key=lambda worker:worker.load())
+        worker.post(request, response, exception, args, key, read_only,
+                    priority, owner)
+        
+    def cancel(self, owner):
+        super(ModelThreadPool, self).cancel(owner)
+        for worker in self._workers:
+            worker.cancel(owner)
+            
+    def queue_depth(self):
+        depth = super(ModelThreadPool, self).queue_depth()
+        return depth + sum(worker.queue_depth() for worker in self._workers)
+            
+    def queue_wait_times(self):
+        wait_times = super(ModelThreadPool, self).queue_wait_times()
+        for worker in self._workers:
+            for priority, (number, total, maximum) in worker.queue_wait_times().iteritems():
+                pool_number, pool_total, pool_maximum = wait_times[priority]
+                wait_times[priority] = (pool_number + number,
+                                        pool_total + total,
+                                        max(pool_maximum, maximum))
+        return wait_times
+        
+    def busy(self):
+        if super(ModelThreadPool, self).busy():
+            return True
+        for worker in self._workers:
+            if worker.isRunning() and worker.busy():
+                return True
+        return False
+    
+    def stop(self):
+        for worker in self._workers:
+            worker.stop()
+        return super(ModelThreadPool, self).stop()
@@ -32,6 +32,7 @@ logger = logging.getLogger('camelot.view.model_thread.no_thread_model_thread')
 
 from PyQt4 import QtCore
 from signal_slot_model_thread import AbstractModelThread, setup_model
+from camelot.view.model_thread import NORMAL
 from camelot.view.controls.exception import register_exception
 
 class NoThreadModelThread( AbstractModelThread ):
@@ -48,7 +49,7 @@ class NoThreadModelThread( AbstractModelThread ):
             exc_info = register_exception(logger, 'Exception when setting up the NoThreadModelThread', e)
             self.setup_exception_signal.emit(exc_info)
 
-    def post( self, request, response = None, exception = None, args=() ):
+    def post( self, request, response = None, exception = None, args=(), key = None, read_only = False, priority = NORMAL, owner = None ):
         try:
             result = request(*args)
             response( result )
@@ -57,6 +58,9 @@ class NoThreadModelThread( AbstractModelThread ):
                 exception_info = register_exception(logger, 'Exception caught in model thread while executing %s'%request.__name__, e )
                 exception(exception_info)
 
+    def owns_thread(self, thread):
+        return True
+
     def wait_on_work(self):
         app = QtCore.QCoreApplication.instance()
         i = 0
@@ -26,16 +26,18 @@ Created on Sep 9, 2009
 
 @author: tw55413
 '''
+import collections
 import logging
 import sys
+import time
 logger = logging.getLogger('camelot.view.model_thread.signal_slot_model_thread')
 
 from PyQt4 import QtCore
 
-from camelot.core.utils import pyqt
+from camelot.core.utils import pyqt, is_deleted
 from camelot.core.threading import synchronized
 from camelot.view.model_thread import ( AbstractModelThread, object_thread, 
-                                        setup_model )
+                                        setup_model, priorities, NORMAL )
 from camelot.view.controls.exception import register_exception
 
 #
@@ -78,17 +80,31 @@ class Task(QtCore.QObject):
     finished = QtCore.pyqtSignal(object)
     exception = QtCore.pyqtSignal(object)
 
-    def __init__(self, request, name='', args=()):
+    def __init__(self, request, name='', args=(), key=None, priority=NORMAL, owner=None):
         QtCore.QObject.__init__(self)
         self._request = request
         self._name = name
         self._args = args
+        self._key = key
+        self.priority = priority
+        self.owner = owner
+        self.posted = time.time()
+        # the number of seconds waited in the queue
+        self.waited = 0.0
+        # the stack at the moment the task was posted, if needed
+        self.stack = None
 
     def clear(self):
         """clear this tasks references to other objects"""
         self._request = None
         self._name = None
         self._args = None
+        self.owner = None
+        self.stack = None
+
+    def cancelled(self):
+        """:return: `True` if the owner of this task was deleted"""
+        return self.owner is not None and is_deleted( self.owner )
 
     def execute(self):
         logger.debug('executing %s' % (self._name))
@@ -117,6 +133,38 @@ class Task(QtCore.QObject):
             self.exception.emit( exc_info )
             sys.exc_clear()
 
+class TaskQueue(object):
+    """A queue of tasks, with a lane for each priority.  Tasks are taken from
+    the lane with the highest priority first, and within a lane in the order
+    they were added."""
+    
+    def __init__(self):
+        self._lanes = tuple( collections.deque() for _priority in priorities )
+        
+    def __len__(self):
+        return sum( len( lane ) for lane in self._lanes )
+    
+    def append(self, task):
+        self._lanes[task.priority].append( task )
+        
+    def pop(self):
+        """:return: the next task, raises IndexError if the queue is empty"""
+        for lane in self._lanes:
+            if lane:
+                return lane.popleft()
+        raise IndexError( 'pop from an empty queue' )
+    
+    def remove_owned_by(self, owner):
+        """Remove all tasks of an owner from the queue
+        :return: a list with the removed tasks"""
+        removed = []
+        for lane in self._lanes:
+            owned = [ task for task in lane if task.owner is owner ]
+            for task in owned:
+                lane.remove( task )
+            removed.extend( owned )
+        return removed
+
 class TaskHandler(QtCore.QObject):
     """A task handler is an object that handles tasks that appear in a queue,
     when its handle_task method is called, it will sequentially handle all tasks
@@ -146,7 +194,10 @@ class TaskHandler(QtCore.QObject):
         self.task_handler_busy_signal.emit( True )
         task = self._queue.pop()
         while task:
+            started = time.time()
             task.execute()
+            self._queue.metrics.record( task._name, task.waited, 
+                                        time.time() - started, task.stack )
             # we keep track of the tasks done to prevent them being garbage collected
             # apparently when they are garbage collected, they are recycled, but their
             # signal slot connections seem to survive this recycling.
@@ -172,6 +223,8 @@ class SignalSlotModelThread( AbstractModelThread ):
     """
 
     task_available = QtCore.pyqtSignal()
+    # only a single thread should replace the garbage collector
+    collect_garbage = True
 
     def __init__( self, setup_thread = setup_model ):
         """
@@ -183,10 +236,16 @@ class SignalSlotModelThread( AbstractModelThread ):
         super(SignalSlotModelThread, self).__init__( setup_thread )
         self._task_handler = None
         self._mutex = QtCore.QMutex()
-        self._request_queue = []
+        self._request_queue = TaskQueue()
+        # the keys of the tasks waiting in the queue
+        self._request_keys = set()
+        # for each priority, the number of tasks handled and their total and
+        # maximum waiting time in the queue
+        self._wait_times = dict( ( priority, (0, 0.0, 0.0) ) for priority in priorities )
         self._connected = False
         self._setup_busy = True
-        GarbageCollector( self )
+        if self.collect_garbage:
+            GarbageCollector( self )
 
     def run( self ):
         self.logger.debug( 'model thread started' )
@@ -212,7 +271,11 @@ class SignalSlotModelThread( AbstractModelThread ):
         self.thread_busy_signal.emit( busy_state )
 
     @synchronized
-    def post( self, request, response = None, exception = None, args = () ):
+    def post( self, request, response = None, exception = None, args = (), key = None, read_only = False, priority = NORMAL, owner = None ):
+        if key != None:
+            if key in self._request_keys:
+                return
+            self._request_keys.add( key )
         if not self._connected and self._task_handler:
             # creating this connection in the model thread throws QT exceptions
             self.task_available.connect( self._task_handler.handle_task, QtCore.Qt.QueuedConnection )
@@ -222,7 +285,9 @@ class SignalSlotModelThread( AbstractModelThread ):
             name = '%s -> %s.%s'%(request.__name__, response.im_self.__class__.__name__, response.__name__)
         else:
             name = request.__name__
-        task = Task( wrap_none( request ), name = name, args = args )
+        task = Task( wrap_none( request ), name = name, args = args, key = key,
+                     priority = priority, owner = owner )
+        task.stack = self.metrics.posting_stack()
         # QObject::connect is a thread safe function
         if response:
             assert response.im_self != None
@@ -244,13 +309,40 @@ class SignalSlotModelThread( AbstractModelThread ):
         self.quit()
         return True
     
+    @synchronized
+    def cancel( self, owner ):
+        for task in self._request_queue.remove_owned_by( owner ):
+            self._request_keys.discard( task._key )
+            task.clear()
+
     @synchronized
     def pop( self ):
-        """Pop a task from the queue, return None if the queue is empty"""
-        if len(self._request_queue):
-            task = self._request_queue.pop(0)
+        """Pop a task from the queue, return None if the queue is empty.  Tasks
+        of which the owner has been deleted are dropped."""
+        while len(self._request_queue):
+            task = self._request_queue.pop()
+            # from now on, requests with the same key should be queued again
+            self._request_keys.discard( task._key )
+            if task.cancelled():
+                logger.debug( 'drop cancelled task %s'%task._name )
+                task.clear()
+                continue
+            waited = time.time() - task.posted
+            task.waited = waited
+            number, total, maximum = self._wait_times[task.priority]
+            self._wait_times[task.priority] = ( number + 1, 
+                                                total + waited, 
+                                                max( maximum, waited ) )
             return task
 
+    @synchronized
+    def queue_depth( self ):
+        return len( self._request_queue )
+
+    @synchronized
+    def queue_wait_times( self ):
+        return dict( self._wait_times )
+
     @synchronized
     def busy( self ):
         """Return True or False indicating wether either the model or the
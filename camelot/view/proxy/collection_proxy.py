@@ -29,27 +29,31 @@ with zero delay.  If the data is not yet present in the proxy, dummy data is
 returned and an update signal is emitted when the correct data is available.
 """
 
+import bisect
 import collections
 import datetime
+import functools
 import itertools
 import logging
 
 logger = logging.getLogger( 'camelot.view.proxy.collection_proxy' )
 
-from PyQt4.QtCore import Qt, QThread
+from PyQt4.QtCore import Qt
 from PyQt4 import QtGui, QtCore
 
 from camelot.core.exception import log_programming_error
 from camelot.core.utils import is_deleted, variant_to_pyobject
 from camelot.view.art import Icon
 from camelot.view.fifo import Fifo
+from camelot.view.proxy.read_ahead import ReadAhead
 from camelot.view.controls import delegates
 from camelot.view.controls.exception import register_exception
-from camelot.view.remote_signals import get_signal_handler
+from camelot.view.remote_signals import get_signal_handler, EntityChangeset
 from camelot.view.model_thread import object_thread, \
-                                      model_function, post
+                                      model_function, post, INTERACTIVE
 
 from camelot.core.files.storage import StoredImage
+from camelot.core.files.thumbnails import placeholder_thumbnail
 
 class ProxyDict(dict):
     """Subclass of dictionary to fool the QVariant object and prevent
@@ -57,6 +61,53 @@ class ProxyDict(dict):
     everything python"""
     pass
 
+class RelationshipCollectionGetter( object ):
+    """Collection getter for the objects related to an object through a one
+    to many relation.  As long as the collection of a persistent object has
+    not been loaded, the related objects can be counted and read in pages 
+    with a query, without loading the whole collection.  Once the collection
+    is loaded, eg because objects are added or removed, it is handled in 
+    memory.
+    
+    :param obj: the object of which to get the collection
+    :param attribute: the name of the attribute of the collection
+    """
+    
+    def __init__( self, obj, attribute ):
+        self.obj = obj
+        self.attribute = attribute
+        
+    def __call__( self ):
+        return getattr( self.obj, self.attribute )
+    
+    def get_query( self ):
+        """:return: a query for the objects in the collection, or None if the
+            collection should be handled in memory"""
+        from sqlalchemy import orm
+        from sqlalchemy.exc import InvalidRequestError
+        from sqlalchemy.orm.exc import UnmappedInstanceError
+        if self.attribute in self.obj.__dict__:
+            return None
+        try:
+            mapper = orm.object_mapper( self.obj )
+            property = mapper.get_property( self.attribute )
+        except ( UnmappedInstanceError, InvalidRequestError ):
+            return None
+        if not isinstance( property, orm.properties.RelationshipProperty ) or \
+           not property.uselist or property.lazy not in ( True, 'select' ):
+            return None
+        session = orm.object_session( self.obj )
+        if session == None or orm.attributes.instance_state( self.obj ).key == None:
+            return None
+        query = session.query( property.mapper ).with_parent( self.obj, self.attribute )
+        # the query should not flush pending changes, that were not made
+        # to the collection
+        query = query.autoflush( False )
+        if property.order_by:
+            query = query.order_by( *property.order_by )
+        # the primary key enforces a unique order of the rows in the pages
+        return query.order_by( *property.mapper.primary_key )
+
 class DelayedProxy( object ):
     """A proxy object needs to be constructed within the GUI thread. Construct
     a delayed proxy when the construction of a proxy is needed within the Model
@@ -76,7 +127,12 @@ class DelayedProxy( object ):
                                 self._columns_getter )
 
     def __unicode__(self):
-        collection = self._collection_getter()
+        get_query = getattr( self._collection_getter, 'get_query', None )
+        query = get_query() if get_query != None else None
+        if query != None:
+            collection = query.limit( 3 ).all()
+        else:
+            collection = self._collection_getter()
         if collection:
             try:
                return u','.join(list(unicode(o) or '' for o,_i in zip(collection,
@@ -95,9 +151,6 @@ def strip_data_from_object( obj, columns ):
     """
     row_data = []
 
-    def create_collection_getter( o, attr ):
-        return lambda: getattr( o, attr )
-
     for _i, col in enumerate( columns ):
         field_attributes = col[1]
         field_value = None
@@ -105,7 +158,7 @@ def strip_data_from_object( obj, columns ):
             getter = field_attributes['getter']
             if field_attributes['python_type'] == list:
                 field_value = DelayedProxy( field_attributes['admin'],
-                                            create_collection_getter( obj, col[0] ),
+                                            RelationshipCollectionGetter( obj, col[0] ),
                                             field_attributes['admin'].get_columns )
             else:
                 field_value = getter( obj )
@@ -148,7 +201,13 @@ def stripped_data_to_unicode( stripped_data, obj, static_field_attributes, dynam
                 if field_data.year >= 1900:
                     unicode_data = field_data.strftime( '%d/%m/%Y' )
             elif isinstance( field_data, StoredImage):
-                unicode_data = field_data.checkout_thumbnail(100, 100)
+                # when the thumbnail is ready, the row is updated
+                thumbnail_ready = functools.partial( get_signal_handler().sendEntityUpdate,
+                                                     None, obj )
+                unicode_data = field_data.checkout_thumbnail_in_background( 100, 100,
+                                                                            thumbnail_ready )
+                if unicode_data == None:
+                    unicode_data = placeholder_thumbnail()
             elif field_data != None:
                 unicode_data = unicode( field_data )
         except (Exception, RuntimeError, TypeError, NameError), e:
@@ -161,13 +220,215 @@ def stripped_data_to_unicode( stripped_data, obj, static_field_attributes, dynam
 
     return row_data
 
+class RowExtractor( object ):
+    """Get the data of a row from an object for a list of columns, as
+    :func:`strip_data_from_object` and :func:`stripped_data_to_unicode` do,
+    but with functions for each column that are specialized once for
+    the field attributes of the column, instead of inspecting the field
+    attributes for each row.
+    
+    :param columns: a list of `(field_name, field_attributes)` tuples
+    :param static_field_attributes: a list with the static field attributes
+        of each column
+    """
+    
+    #: the maximum number of formatted dates cached for each column
+    max_cached_dates = 1000
+    
+    def __init__( self, columns, static_field_attributes ):
+        self.columns = columns
+        self.static_field_attributes = static_field_attributes
+        self._getters = tuple( self._create_getter( field_name, field_attributes ) for field_name, field_attributes in columns )
+        self._formatters = tuple( self._create_formatter( field_attributes, static_attributes ) for ( _field_name, field_attributes ), static_attributes in zip( columns, static_field_attributes ) )
+        self._columns = range( len( columns ) )
+        
+    @staticmethod
+    def _create_getter( field_name, field_attributes ):
+        if field_attributes.get( 'python_type' ) == list:
+            admin = field_attributes['admin']
+            return lambda obj:DelayedProxy( admin,
+                                            RelationshipCollectionGetter( obj, field_name ),
+                                            admin.get_columns )
+        return field_attributes['getter']
+    
+    def _create_formatter( self, field_attributes, static_attributes ):
+        """:return: a function that returns the unicode representation of the
+        value of a field, given the value, the object and the dynamic
+        field attributes"""
+        if 'unicode_format' in static_attributes:
+            unicode_format = static_attributes['unicode_format']
+            return lambda value, obj, dynamic_attributes:u'' if value == None else unicode_format( value )
+        type_formatter = self._create_type_formatter()
+        if callable( field_attributes.get( 'choices' ) ):
+            
+            def dynamic_choices_formatter( value, obj, dynamic_attributes ):
+                choices = dynamic_attributes.get( 'choices' )
+                if choices:
+                    return self._choice( choices, value )
+                return type_formatter( value, obj, dynamic_attributes )
+            
+            return dynamic_choices_formatter
+        choices = static_attributes.get( 'choices' )
+        if choices:
+            try:
+                choices = dict( choices )
+            except TypeError:
+                return lambda value, obj, dynamic_attributes:self._choice( choices, value )
+            return lambda value, obj, dynamic_attributes:choices.get( value, value )
+        return type_formatter
+    
+    @staticmethod
+    def _choice( choices, value ):
+        """:return: the verbose name of value in a list of choices"""
+        try:
+            return dict( choices ).get( value, value )
+        except TypeError:
+            verbose_value = value
+            for key, verbose_name in choices:
+                if key == value:
+                    verbose_value = verbose_name
+            return verbose_value
+            
+    def _create_type_formatter( self ):
+        """:return: a function that formats a value depending on its type,
+        the formatting function for each type is looked up only once"""
+        formatters = dict()
+        
+        def type_formatter( value, obj, dynamic_attributes ):
+            value_type = type( value )
+            try:
+                formatter = formatters[value_type]
+            except KeyError:
+                formatter = self._formatter_for_type( value_type )
+                formatters[value_type] = formatter
+            return formatter( value, obj )
+        
+        return type_formatter
+    
+    def _formatter_for_type( self, value_type ):
+        if value_type == type( None ):
+            return lambda value, obj:u''
+        if issubclass( value_type, list ):
+            return lambda value, obj:u'.'.join( [ unicode( e ) for e in value ] )
+        if issubclass( value_type, datetime.date ):
+            # datetime should come before date since datetime is a subtype of date
+            if issubclass( value_type, datetime.datetime ):
+                date_format = '%d/%m/%Y %H:%M'
+            else:
+                date_format = '%d/%m/%Y'
+            formatted_dates = dict()
+            max_cached_dates = self.max_cached_dates
+            
+            def date_formatter( value, obj ):
+                try:
+                    return formatted_dates[value]
+                except KeyError:
+                    pass
+                formatted_date = u''
+                if value.year >= 1900:
+                    formatted_date = value.strftime( date_format )
+                if len( formatted_dates ) >= max_cached_dates:
+                    formatted_dates.clear()
+                formatted_dates[value] = formatted_date
+                return formatted_date
+            
+            return date_formatter
+        if issubclass( value_type, StoredImage ):
+            
+            def image_formatter( value, obj ):
+                # when the thumbnail is ready, the row is updated
+                thumbnail_ready = functools.partial( get_signal_handler().sendEntityUpdate,
+                                                     None, obj )
+                thumbnail = value.checkout_thumbnail_in_background( 100, 100,
+                                                                    thumbnail_ready )
+                if thumbnail == None:
+                    thumbnail = placeholder_thumbnail()
+                return thumbnail
+            
+            return image_formatter
+        return lambda value, obj:unicode( value )
+        
+    def strip( self, obj ):
+        """:return: a list with the value of each column for obj"""
+        try:
+            return [ getter( obj ) for getter in self._getters ]
+        except (Exception, RuntimeError, TypeError, NameError):
+            pass
+        # find out which column failed
+        row_data = []
+        for ( field_name, _field_attributes ), getter in zip( self.columns, self._getters ):
+            field_value = None
+            try:
+                field_value = getter( obj )
+            except (Exception, RuntimeError, TypeError, NameError), e:
+                message = "could not get field '%s' of object of type %s"%(field_name, obj.__class__.__name__)
+                log_programming_error( logger, 
+                                       message,
+                                       exc_info = e )
+            finally:
+                row_data.append( field_value )
+        return row_data
+    
+    def to_unicode( self, row_data, obj, dynamic_field_attributes ):
+        """:return: a list with the unicode representation of each value in
+        row_data"""
+        formatters = self._formatters
+        try:
+            return [ formatters[i]( row_data[i], obj, dynamic_field_attributes[i] ) for i in self._columns ]
+        except (Exception, RuntimeError, TypeError, NameError):
+            pass
+        # find out which column failed
+        unicode_row_data = []
+        for i in self._columns:
+            unicode_data = u''
+            try:
+                unicode_data = formatters[i]( row_data[i], obj, dynamic_field_attributes[i] )
+            except (Exception, RuntimeError, TypeError, NameError), e:
+                log_programming_error( logger,
+                                       "Could not get view data for field '%s' with of object of type %s"%( self.static_field_attributes[i]['name'],
+                                                                                                            obj.__class__.__name__),
+                                       exc_info = e )
+            finally:
+                unicode_row_data.append( unicode_data )
+        return unicode_row_data
+
 from camelot.view.proxy import ValueLoading
 
 class EmptyRowData( object ):
     def __getitem__( self, column ):
         return ValueLoading
 
-empty_row_data = EmptyRowData()
+class RowData( object ):
+    """The data of a single row in the cache of a collection proxy, this
+    holds the values used for editing, the values used for display and the
+    dynamic field attributes of each column in the row.
+    """
+    
+    __slots__ = ( 'edit', 'display', 'attributes' )
+    
+    def __init__( self, edit, display, attributes ):
+        self.edit = edit
+        self.display = display
+        self.attributes = attributes
+
+empty_column_data = EmptyRowData()
+empty_row_data = RowData( empty_column_data,
+                          empty_column_data,
+                          empty_column_data )
+
+def _sort_key_getter( field_name ):
+    """:return: a function that returns the key to sort an object by the
+    value of one of its fields, None values are sorted before other values"""
+    
+    def sort_key( obj ):
+        try:
+            value = getattr( obj, field_name )
+        except Exception, e:
+            logger.error( 'could not get attribute %s from object'%field_name, exc_info = e )
+            value = None
+        return ( value is not None, value )
+        
+    return sort_key
 
 class SortingRowMapper( dict ):
     """Class mapping rows of a collection 1:1 without sorting
@@ -205,6 +466,7 @@ class CollectionProxy( QtGui.QProxyModel ):
     # thread signals
     _rows_about_to_be_inserted_signal = QtCore.pyqtSignal( int, int )
     _rows_inserted_signal = QtCore.pyqtSignal( int, int )
+    _rows_removed_signal = QtCore.pyqtSignal( object )
 
     def __init__( self, 
                   admin, 
@@ -268,27 +530,31 @@ position in the query.
         self._rows = 0
         self._columns = []
         self._static_field_attributes = []
+        # the functions to get the data of a row for the columns, compiled
+        # when the columns are set
+        self._row_extractor = None
         self._max_number_of_rows = max_number_of_rows
         max_cache = 10 * self.max_number_of_rows
+        # The cache contains a RowData object for each row that was fetched
         if cache_collection_proxy:
-            cached_entries = len( cache_collection_proxy.display_cache )
+            cached_entries = len( cache_collection_proxy.cache )
             max_cache = max( cached_entries, max_cache )
-            self.display_cache = cache_collection_proxy.display_cache.shallow_copy( max_cache )
-            self.edit_cache = cache_collection_proxy.edit_cache.shallow_copy( max_cache )
-            self.attributes_cache = cache_collection_proxy.attributes_cache.shallow_copy( max_cache )
+            self.cache = cache_collection_proxy.cache.shallow_copy( max_cache )
         else:        
-            self.display_cache = Fifo( max_cache )
-            self.edit_cache = Fifo( max_cache )
-            self.attributes_cache = Fifo( max_cache )
+            self.cache = Fifo( max_cache )
         # The rows in the table for which a cache refill is under request
         self.rows_under_request = set()
+        self._read_ahead = ReadAhead( self.max_number_of_rows )
         self._update_requests = list()
         # The rows that have unflushed changes
         self.unflushed_rows = set()
         self._sort_and_filter = SortingRowMapper()
+        # the (column, order) tuples of the columns sorted by
+        self._sort_columns = []
         self.row_changed_signal.connect( self._emit_changes )
         self._rows_about_to_be_inserted_signal.connect( self._rows_about_to_be_inserted, Qt.QueuedConnection )
         self._rows_inserted_signal.connect( self._rows_inserted, Qt.QueuedConnection )
+        self._rows_removed_signal.connect( self._rows_removed, Qt.QueuedConnection )
         self.rsh = get_signal_handler()
         self.rsh.connect_signals( self )
 
@@ -304,7 +570,7 @@ position in the query.
         if cache_collection_proxy:
             self.setRowCount( cache_collection_proxy.rowCount() )
         else:
-            post( self.getRowCount, self.setRowCount )
+            post( self.getRowCount, self.setRowCount, owner = self )
         self.logger.debug( 'initialization finished' )
 
     #
@@ -379,6 +645,10 @@ position in the query.
     def _update_unflushed_rows( self ):
         """Verify all rows to see if some of them should be added to the
         unflushed rows"""
+        if self._get_collection_query() != None:
+            # the collection has not been loaded, so it only contains
+            # flushed rows
+            return
         for i, e in enumerate( self.get_collection() ):
             if hasattr(e, 'id') and not e.id:
                 self.unflushed_rows.add( i )
@@ -393,6 +663,9 @@ position in the query.
 
     @model_function
     def getRowCount( self ):
+        query = self._get_collection_query()
+        if query != None:
+            return query.count()
         # make sure we don't count an object twice if it is twice
         # in the list, since this will drive the cache nuts
         rows = len( set( self.get_collection() ) )
@@ -400,15 +673,13 @@ position in the query.
 
     def refresh( self ):
         assert object_thread( self )
-        post( self.getRowCount, self._refresh_content )
+        post( self.getRowCount, self._refresh_content, owner = self )
 
     @QtCore.pyqtSlot(int)
     def _refresh_content(self, rows ):
         assert object_thread( self )
         locker = QtCore.QMutexLocker(self._mutex)
-        self.display_cache = Fifo( 10 * self.max_number_of_rows )
-        self.edit_cache = Fifo( 10 * self.max_number_of_rows )
-        self.attributes_cache = Fifo( 10 * self.max_number_of_rows )
+        self.cache = Fifo( 10 * self.max_number_of_rows )
         self.rows_under_request = set()
         self.unflushed_rows = set()
         # once the cache has been cleared, no updates ought to be accepted
@@ -424,13 +695,23 @@ position in the query.
     @model_function
     def get_collection( self ):
         return self._collection_getter()
+    
+    @model_function
+    def _get_collection_query( self ):
+        """:return: a query to count and read the objects in the collection
+            in pages, or None if the collection is handled in memory.  A 
+            query is only available from a collection getter with a 
+            `get_query` method, such as a :class:`RelationshipCollectionGetter`, 
+            as long as the rows are not sorted in memory."""
+        get_query = getattr( self._collection_getter, 'get_query', None )
+        if get_query == None or len( self._sort_and_filter ):
+            return None
+        return get_query()
 
     def handleRowUpdate( self, row ):
         """Handles the update of a row when this row might be out of date"""
         assert object_thread( self )
-        self.display_cache.delete_by_row( row )
-        self.edit_cache.delete_by_row( row )
-        self.attributes_cache.delete_by_row( row )
+        self.cache.delete_by_row( row )
         self.dataChanged.emit( self.index( row, 0 ),
                                self.index( row, self.columnCount() - 1 ) )
 
@@ -443,7 +724,7 @@ position in the query.
                      ( self.__class__.__name__, self.admin.get_verbose_name() ) )
         if sender != self:
             try:
-                row = self.display_cache.get_row_by_entity( entity )
+                row = self.cache.get_row_by_entity( entity )
             except KeyError:
                 self.logger.debug( 'entity not in cache' )
                 return
@@ -465,6 +746,45 @@ position in the query.
         else:
             self.logger.debug( 'duplicate update' )
 
+    @QtCore.pyqtSlot( object, object )
+    def handle_entity_changes( self, sender, changeset ):
+        """Handles an :class:`camelot.view.remote_signals.EntityChangeset`, 
+        the cached rows of the changed entities are reloaded at once, and the
+        rows of the deleted entities are removed at once."""
+        assert object_thread( self )
+        if sender == self:
+            self.logger.debug( 'duplicate changes' )
+            return
+        updated_rows, deleted_rows = [], []
+        for entities, rows in ( ( changeset.updated_entities(), updated_rows ),
+                                ( changeset.deleted_entities(), deleted_rows ) ):
+            for entity in entities:
+                try:
+                    rows.append( ( self.cache.get_row_by_entity( entity ), entity ) )
+                except KeyError:
+                    pass
+        self.logger.debug( '%s %s received changes of %i cached rows' % \
+                           ( self.__class__.__name__, self.admin.get_verbose_name(),
+                             len( updated_rows ) + len( deleted_rows ) ) )
+        if updated_rows:
+            updated_rows.sort()
+            #
+            # Because the entities are updated, they might no longer be in our
+            # collection, therefore, make sure we don't access the collection
+            # to strip data of the entities
+            #
+            def create_entities_update( rows_and_objects ):
+
+                def entities_update():
+                    self._add_rows( self._columns, rows_and_objects )
+                    return ( rows_and_objects[0][0], rows_and_objects[-1][0] )
+
+                return entities_update
+
+            post( create_entities_update( updated_rows ), self._emit_range_changes )
+        if deleted_rows:
+            self.remove_rows( [ row for row, _entity in deleted_rows ], delete = False )
+
     @QtCore.pyqtSlot( object, object )
     def handle_entity_delete( self, sender, entity ):
         """Handles the entity signal, indicating that the model is out of
@@ -473,7 +793,7 @@ position in the query.
         self.logger.debug( 'received entity delete signal' )
         if sender != self:
             try:
-                row = self.display_cache.get_row_by_entity(entity)
+                row = self.cache.get_row_by_entity(entity)
             except KeyError:
                 self.logger.debug( 'entity not in cache' )
                 return
@@ -519,6 +839,7 @@ position in the query.
         assert object_thread( self )
         self.logger.debug( 'setColumns' )
         self._columns = columns
+        self._row_extractor = RowExtractor( columns, self._static_field_attributes )
 
         delegate_manager = delegates.DelegateManager()
         delegate_manager.set_columns_desc( columns )
@@ -623,42 +944,41 @@ position in the query.
         return super( CollectionProxy, self ).headerData( section, orientation, role )
 
     def sort( self, column, order ):
-        """reimplementation of the :class:`QtGui.QAbstractItemModel` its sort function"""
+        """reimplementation of the :class:`QtGui.QAbstractItemModel` its sort 
+        function.  The rows are sorted by this column only, use 
+        :meth:`sort_columns` to sort by multiple columns."""
         assert object_thread( self )
-
-        def create_sort(column, order):
+        self.sort_columns( [ ( column, order ) ] )
+        
+    def sort_columns( self, sort_columns ):
+        """Sort the rows by multiple columns
+        
+        :param sort_columns: a list of `(column, order)` tuples, with the
+            most significant column first
+        """
+        assert object_thread( self )
+        self._sort_columns = list( sort_columns )
+        
+        def create_sort( sort_columns ):
 
             def sort():
-                unsorted_collection = [(i,o) for i,o in enumerate(self.get_collection())]
-                field_name = self._columns[column][0]
-                
-                # handle the case of one of the values being None
-                def compare_none( line_1, line_2 ):
-                    key_1, key_2 = None, None
-                    try:
-                        key_1 = getattr( line_1[1], field_name )
-                    except Exception, e:
-                        logger.error( 'could not get attribute %s from object'%field_name, exc_info = e )
-                    try:
-                        key_2 = getattr( line_2[1], field_name )
-                    except Exception, e:
-                        logger.error( 'could not get attribute %s from object'%field_name, exc_info = e )
-                    if key_1 == None and key_2 == None:
-                        return 0
-                    if key_1 == None:
-                        return -1
-                    if key_2 == None:
-                        return 1
-                    return cmp( key_1, key_2 )
-                    
-                unsorted_collection.sort( cmp = compare_none, reverse = order )
-                for j,(i,_o) in enumerate(unsorted_collection):
+                collection = list( self.get_collection() )
+                rows = range( len( collection ) )
+                # sort by the least significant column first, since the
+                # sort is stable, rows with equal values remain in the order
+                # of the less significant columns
+                for column, order in reversed( sort_columns ):
+                    sort_key = _sort_key_getter( self._columns[column][0] )
+                    keys = [ sort_key( obj ) for obj in collection ]
+                    rows.sort( key = keys.__getitem__, reverse = bool( order ) )
+                self._sort_and_filter.clear()
+                for j, i in enumerate( rows ):
                     self._sort_and_filter[j] = i
-                return len(unsorted_collection)
+                return len( rows )
 
             return sort
 
-        post(create_sort(column, order), self._refresh_content)
+        post( create_sort( self._sort_columns ), self._refresh_content )
 
     def data( self, index, role = Qt.DisplayRole):
         """:return: the data at index for the specified role
@@ -681,10 +1001,9 @@ position in the query.
             return QtCore.QVariant()
         if role in (Qt.EditRole, Qt.DisplayRole):
             if role == Qt.EditRole:
-                cache = self.edit_cache
+                data = self._get_row_data( index.row() ).edit
             else:
-                cache = self.display_cache
-            data = self._get_row_data( index.row(), cache )
+                data = self._get_row_data( index.row() ).display
             value = data[index.column()]
             if isinstance( value, DelayedProxy ):
                 value = value()
@@ -706,13 +1025,13 @@ position in the query.
             return QtCore.QVariant(self._get_field_attribute_value(index, 'background_color') or QtCore.QVariant())
         elif role == Qt.UserRole:
             field_attributes = ProxyDict(self._static_field_attributes[index.column()])
-            dynamic_field_attributes = self._get_row_data( index.row(), self.attributes_cache )[index.column()]
+            dynamic_field_attributes = self._get_row_data( index.row() ).attributes[index.column()]
             if dynamic_field_attributes != ValueLoading:
                 field_attributes.update( dynamic_field_attributes )
             return QtCore.QVariant(field_attributes)
         elif role == Qt.UserRole + 1:
             try:
-                return QtCore.QVariant( self.edit_cache.get_entity_at_row( index.row() ) )
+                return QtCore.QVariant( self.cache.get_entity_at_row( index.row() ) )
             except KeyError:
                 return QtCore.QVariant( ValueLoading )
         return QtCore.QVariant()
@@ -723,7 +1042,7 @@ position in the query.
         try:
             return self._static_field_attributes[index.column()][field_attribute]
         except KeyError:
-            value = self._get_row_data( index.row(), self.attributes_cache )[index.column()]
+            value = self._get_row_data( index.row() ).attributes[index.column()]
             if value == ValueLoading:
                 return None
             return value.get(field_attribute, None)
@@ -731,26 +1050,20 @@ position in the query.
     @model_function
     def _handle_update_requests(self):
         #
-        # wait for a while until the update requests array doesn't change any
-        # more
+        # Take the update requests and clear the list of requests, requests
+        # posted while the task was waiting in the queue are coalesced into
+        # this task
         #
-        previous_length = 0
         locker = QtCore.QMutexLocker(self._mutex)
-        while previous_length != len(self._update_requests):
-            previous_length = len(self._update_requests)
-            locker.unlock()
-            QThread.msleep(5)
-            locker.relock()
-        #
-        # Copy the update requests and clear the list of requests
-        #
-        update_requests = [u for u in self._update_requests]
+        update_requests = self._update_requests
         self._update_requests = []
         locker.unlock()
         #
         # Handle the requests
         #
         return_list = []
+        # the other views are informed of all changes at once
+        changeset = EntityChangeset()
         grouped_requests = collections.defaultdict( list )
         for flushed, row, column, value in update_requests:
             grouped_requests[row].append( (flushed, column, value) )
@@ -760,7 +1073,7 @@ position in the query.
             # cache, otherwise it is not sure that the object updated is the
             # one that was edited
             #
-            o = self.edit_cache.get_entity_at_row( row )
+            o = self.cache.get_entity_at_row( row )
             if not o:
                 # the object might have been deleted from the collection while the editor
                 # was still open
@@ -832,10 +1145,9 @@ position in the query.
                     locker.unlock()
                 # update the cache
                 self._add_data(self._columns, row, o)
-                #@todo: update should only be sent remotely when flush was done
-                self.rsh.sendEntityUpdate( self, o )
+                changeset.add_update( o )
                 for depending_obj in self.admin.get_depending_objects( o ):
-                    self.rsh.sendEntityUpdate( self, depending_obj )
+                    changeset.add_update( depending_obj )
                 return_list.append(( ( row, 0 ), ( row, len( self._columns ) ) ))
             elif flushed:
                 locker.relock()
@@ -845,6 +1157,7 @@ position in the query.
                 except KeyError:
                     pass
                 locker.unlock()
+        self.rsh.send_entity_changes( self, changeset )
         return return_list
 
     def setData( self, index, value, role = Qt.EditRole ):
@@ -873,7 +1186,8 @@ position in the query.
             self.unflushed_rows.add( index.row() )
             self._update_requests.append( (flushed, index.row(), index.column(), value) )
             locker.unlock()
-            post( self._handle_update_requests )
+            post( self._handle_update_requests, 
+                  key = ( self, '_handle_update_requests' ) )
 
         return True
 
@@ -886,6 +1200,13 @@ position in the query.
             bottom_right = self.index( row, column_count - 1 )
             self.dataChanged.emit( top_left, bottom_right )
 
+    @QtCore.pyqtSlot(object)
+    def _emit_range_changes( self, row_range ):
+        assert object_thread( self )
+        first_row, last_row = row_range
+        self.dataChanged.emit( self.index( first_row, 0 ),
+                               self.index( last_row, self.columnCount() - 1 ) )
+
     def flags( self, index ):
         """Returns the item flags for the given index"""
         assert object_thread( self )
@@ -902,27 +1223,47 @@ position in the query.
         :param row: the row in the cache into which to add data
         :param obj: the object from which to strip the data
         """
-        if not self.admin.is_deleted( obj ):
-            row_data = strip_data_from_object( obj, columns )
-            dynamic_field_attributes = list(self.admin.get_dynamic_field_attributes( obj, (c[0] for c in columns)))
-            static_field_attributes = self.admin.get_static_field_attributes( (c[0] for c in columns) )
-            unicode_row_data = stripped_data_to_unicode( row_data, obj, static_field_attributes, dynamic_field_attributes )
-        else:
-            row_data = [None] * len(columns)
-            dynamic_field_attributes =  [{'editable':False}] * len(columns)
-            static_field_attributes = self.admin.get_static_field_attributes( (c[0] for c in columns) )
-            unicode_row_data = [u''] * len(columns)
-        locker = QtCore.QMutexLocker( self._mutex )
-        self.edit_cache.add_data( row, obj, row_data )
-        self.display_cache.add_data( row, obj, unicode_row_data )
-        self.attributes_cache.add_data(row, obj, dynamic_field_attributes )
-        locker.unlock()
-        #
-        # it might be that the CollectionProxy is deleted on the QT side of
-        # the application
-        #
-        if not is_deleted( self ):
-            self.row_changed_signal.emit( row )
+        self._add_rows( columns, [ ( row, obj ) ] )
+        
+    def _add_rows(self, columns, rows_and_objects):
+        """Add data from a window of objects to the cache, the dynamic field
+        attributes of all objects are requested from the admin at once.
+        :param columns: the columns of which to strip data
+        :param rows_and_objects: a list of `(row, obj)` tuples, with the row
+            in the cache into which to add the data of the object
+        """
+        if not rows_and_objects:
+            return
+        field_names = [c[0] for c in columns]
+        row_extractor = self._row_extractor
+        if row_extractor == None or row_extractor.columns is not columns:
+            static_field_attributes = list( self.admin.get_static_field_attributes( field_names ) )
+            row_extractor = RowExtractor( columns, static_field_attributes )
+        existing_objects = [ obj for _row, obj in rows_and_objects if not self.admin.is_deleted( obj ) ]
+        dynamic_field_attributes_batch = self.admin.get_dynamic_field_attributes_batch( existing_objects, field_names )
+        dynamic_field_attributes_by_object = dict( zip( ( id( obj ) for obj in existing_objects ), 
+                                                        dynamic_field_attributes_batch ) )
+        for row, obj in rows_and_objects:
+            dynamic_field_attributes = dynamic_field_attributes_by_object.get( id( obj ) )
+            if dynamic_field_attributes != None:
+                row_data = row_extractor.strip( obj )
+                dynamic_field_attributes = list( dynamic_field_attributes )
+                unicode_row_data = row_extractor.to_unicode( row_data, obj, dynamic_field_attributes )
+            else:
+                row_data = [None] * len(columns)
+                dynamic_field_attributes =  [{'editable':False}] * len(columns)
+                unicode_row_data = [u''] * len(columns)
+            locker = QtCore.QMutexLocker( self._mutex )
+            self.cache.add_data( row, obj, RowData( row_data,
+                                                    unicode_row_data,
+                                                    dynamic_field_attributes ) )
+            locker.unlock()
+            #
+            # it might be that the CollectionProxy is deleted on the QT side of
+            # the application
+            #
+            if not is_deleted( self ):
+                self.row_changed_signal.emit( row )
 
     def _skip_row(self, row, obj):
         """:return: True if the object obj is already in the cache, but at a
@@ -930,77 +1271,66 @@ position in the query.
         be put in the cache at row, and this row should be skipped alltogether.
         """
         try:
-            return self.edit_cache.get_row_by_entity(obj)!=row
+            return self.cache.get_row_by_entity(obj)!=row
         except KeyError:
             pass
         return False
 
-    def _offset_and_limit_rows_to_get( self ):
-        """From the current set of rows to get, find the first
-        continuous range of rows that should be fetched.
-        :return: (offset, limit)
+    def _ranges_to_get( self ):
+        """From the current set of rows under request, decide which ranges
+        of rows should be fetched, reading ahead in the direction of scrolling.
+        
+        :return: `(requested_rows, ranges)` with the set of rows under request
+            that are handled by these ranges, and a list of `(offset, limit)`
+            tuples.
         """
-        offset, limit, previous_length, i = 0, 0, 0, 0
-        #
-        # wait for a while until the rows under request don't change any
-        # more
-        #
         locker = QtCore.QMutexLocker(self._mutex)
-        while previous_length != len(self.rows_under_request):
-            previous_length = len(self.rows_under_request)
-            locker.unlock()
-            QThread.msleep(5)
-            locker.relock()
+        requested_rows = set( self.rows_under_request )
+        locker.unlock()
         #
-        # now filter out all rows that have been put in the cache
+        # filter out all rows that have been put in the cache
         # the gui thread didn't know about
         #
-        rows_to_get = self.rows_under_request
-        rows_already_there = set()
-        for row in rows_to_get:
-            if self.edit_cache.has_data_at_row(row):
-                rows_already_there.add(row)
-        rows_to_get.difference_update( rows_already_there )
-        rows_to_get = list(rows_to_get)
-        locker.unlock()        
-        #
-        # see if there is anything left to do
-        #
-        try:
-            if len(rows_to_get):
-                rows_to_get.sort()
-                offset = rows_to_get[0]
-                #
-                # find first discontinuity
-                #
-                for i in range(offset, rows_to_get[-1]+1):
-                    if rows_to_get[i-offset] != i:
-                        break
-                limit = i - offset + 1
-        except IndexError, e:
-            logger.error('index error with rows_to_get %s'%unicode(rows_to_get), exc_info=e)
-            raise e
-        return (offset, limit)
+        rows_to_get = [ row for row in requested_rows if not self.cache.has_data_at_row( row ) ]
+        ranges = self._read_ahead.ranges( rows_to_get, 
+                                          self._rows, 
+                                          self.cache.has_data_at_row )
+        return requested_rows, ranges
 
     @model_function
     def _extend_cache( self ):
-        """Extend the cache around the rows under request"""
-        offset, limit = self._offset_and_limit_rows_to_get()
-        if limit:
-            columns = self._columns
-            collection = self.get_collection()
+        """Extend the cache around the rows under request
+        :return: the set of rows under request that were handled
+        """
+        requested_rows, ranges = self._ranges_to_get()
+        if not ranges:
+            return requested_rows
+        columns = self._columns
+        query = self._get_collection_query()
+        if query != None:
+            # consecutive ranges are fetched with a single query
+            for offset, limit, rows in self._read_ahead.batches( ranges ):
+                objects = query.offset( offset ).limit( limit ).all()
+                self._add_rows( columns, [ ( offset + i, obj ) for i, obj in enumerate( objects ) if offset + i in rows and not self._skip_row( offset + i, obj ) ] )
+            return requested_rows
+        collection = self.get_collection()
+        for offset, limit in ranges:
             skipped_rows = 0
-            for i in range(offset, min(offset + limit + 1, self._rows)):
+            rows_and_objects = []
+            objects = set()
+            for i in range(offset, min(offset + limit, self._rows)):
                 object_found = False
                 while not object_found:
                     unsorted_row = self._sort_and_filter[i]
                     obj = collection[unsorted_row+skipped_rows]
-                    if self._skip_row(i, obj):
+                    if self._skip_row(i, obj) or obj in objects:
                         skipped_rows = skipped_rows + 1
                     else:
-                        self._add_data(columns, i, obj)
+                        rows_and_objects.append( ( i, obj ) )
+                        objects.add( obj )
                         object_found = True
-        return ( offset, limit )
+            self._add_rows( columns, rows_and_objects )
+        return requested_rows
 
     @model_function
     def _get_object( self, sorted_row_number ):
@@ -1010,53 +1340,88 @@ position in the query.
         try:
             # first try to get the primary key out of the cache, if it's not
             # there, query the collection_getter
-            return self.edit_cache.get_entity_at_row( sorted_row_number )
+            return self.cache.get_entity_at_row( sorted_row_number )
         except KeyError:
             pass
+        query = self._get_collection_query()
+        if query != None:
+            if sorted_row_number < 0:
+                return None
+            return query.offset( sorted_row_number ).limit( 1 ).first()
         try:
             return self.get_collection()[self.map_to_source(sorted_row_number)]
         except IndexError:
             pass
         return None
 
-    @QtCore.pyqtSlot(tuple)
-    def _cache_extended( self, interval ):
-        offset, limit = interval
+    @model_function
+    def _get_objects( self, first_row, last_row = None, yield_per = None ):
+        """Generator over the objects in the rows from first_row until and
+        including last_row.  If last_row is None, all objects in the
+        collection starting from first_row are returned.
+        
+        :param yield_per: a hint on how many objects should be fetched at
+            once, this only has effect when the collection is read with a 
+            query.
+        """
+        if last_row == None:
+            query = self._get_collection_query()
+            if query != None:
+                for obj in query.offset( first_row ).yield_per( yield_per or 10 * self.max_number_of_rows ):
+                    yield obj
+                return
+            for obj in self.get_collection()[first_row:]:
+                yield obj
+        else:
+            for row in range( first_row, last_row + 1 ):
+                yield self._get_object( row )
+
+    @QtCore.pyqtSlot(object)
+    def _cache_extended( self, rows ):
         locker = QtCore.QMutexLocker(self._mutex)
-        self.rows_under_request.difference_update( set( range( offset, offset + limit + 1) ) )
+        self.rows_under_request.difference_update( rows )
         locker.unlock()
 
-    def _get_row_data( self, row, cache ):
+    def _get_row_data( self, row ):
         """Get the data which is to be visualized at a certain row of the
         table, if needed, post a refill request the cache to get the object
         and its neighbours in the cache, meanwhile, return an empty object
         :param row: the row of the table for which to get the data
-        :param cache: the cache out of which to get row data
-        :return: row_data
+        :return: a RowData object
         """
+        post_extend_cache = False
+        # reading from the cache marks the row as recently used, so it
+        # should not happen while the model thread adds data
+        locker = QtCore.QMutexLocker(self._mutex)
         try:
-            data = cache.get_data_at_row( row )
-            #
-            # check if data is None, then the cache was a copy of previous
-            # cache, and the data should be refetched
-            #
-            if data is None:
-                raise KeyError
-            return data
+            data = self.cache.get_data_at_row( row )
         except KeyError:
+            data = None
+        #
+        # check if data is None, then the cache was a copy of previous
+        # cache, and the data should be refetched
+        #
+        if data is None:
+            data = empty_row_data
             if row not in self.rows_under_request:
-                locker = QtCore.QMutexLocker(self._mutex)
                 self.rows_under_request.add( row )
-                locker.unlock()
-                post( self._extend_cache, self._cache_extended )
-            return empty_row_data
+                post_extend_cache = True
+        locker.unlock()
+        if post_extend_cache:
+            #
+            # all rows requested while the task is waiting in the queue
+            # are handled by the same task
+            #
+            post( self._extend_cache, self._cache_extended,
+                  key = ( self, '_extend_cache' ), priority = INTERACTIVE,
+                  owner = self )
+        return data
 
     @model_function
     def remove( self, o ):
         collection = self.get_collection()
         if o in collection:
             collection.remove( o )
-            self._rows -= 1
 
     @model_function
     def append( self, o ):
@@ -1077,6 +1442,13 @@ position in the query.
         # the object has been removed from the collection
         #
         depending_objects = set( itertools.chain.from_iterable( self.admin.get_depending_objects( o ) for o in objects_to_remove ) )
+        #
+        # the cached rows can only be shifted when the rows of all objects
+        # are known and the rows map 1:1 to the collection
+        #
+        removed_rows = []
+        reconcilable = ( len( self._sort_and_filter ) == 0 )
+        changeset = EntityChangeset()
         for obj in objects_to_remove:
             #
             # We should not update depending objects that have
@@ -1091,7 +1463,7 @@ position in the query.
             # if needed, delete the objects
             #
             if delete:
-                self.rsh.sendEntityDelete( self, obj )
+                changeset.add_delete( obj )
                 self.admin.delete( obj )
                 # remove only when delete took place without exception
                 self.remove( obj )
@@ -1105,12 +1477,27 @@ position in the query.
             # remove the entity from the cache, only if the delete and remove
             # took place without exception
             #
-            self.display_cache.delete_by_entity( obj )
-            self.attributes_cache.delete_by_entity( obj )
-            self.edit_cache.delete_by_entity( obj )
+            try:
+                removed_rows.append( self.cache.get_row_by_entity( obj ) )
+            except KeyError:
+                reconcilable = False
         for depending_obj in depending_objects:
-            self.rsh.sendEntityUpdate( self, depending_obj )
-        post( self.getRowCount, self._refresh_content )
+            changeset.add_update( depending_obj )
+        self.rsh.send_entity_changes( self, changeset )
+        if reconcilable:
+            #
+            # shift the cache before other requests in the model thread use
+            # the row numbers after the removal
+            #
+            removed_rows = sorted( set( removed_rows ) )
+            locker = QtCore.QMutexLocker( self._mutex )
+            self._remove_cached_rows( removed_rows )
+            locker.unlock()
+            self._rows_removed_signal.emit( removed_rows )
+        else:
+            for obj in objects_to_remove:
+                self.cache.delete_by_entity( obj )
+            post( self.getRowCount, self._refresh_content, owner = self )
 
     def remove_rows( self, rows, delete = True ):
         """Remove the entity associated with this row from this collection
@@ -1169,6 +1556,45 @@ position in the query.
     def _rows_inserted( self, _first, _last ):
         self.endInsertRows()
         
+    def _remove_cached_rows( self, rows ):
+        """Remove rows from the cache and the row administration, the rows
+        after a removed row move up.  This method is called with the mutex
+        locked.
+        
+        :param rows: a sorted list with the numbers of the removed rows
+        """
+        
+        def shift( row_set ):
+            return set( row - bisect.bisect_left( rows, row ) for row in row_set if row not in removed )
+        
+        removed = set( rows )
+        self.cache.remove_rows( rows )
+        self.rows_under_request = shift( self.rows_under_request )
+        self.unflushed_rows = shift( self.unflushed_rows )
+        
+    @QtCore.pyqtSlot( object )
+    def _rows_removed( self, rows ):
+        """Inform the views that rows were removed, the cache was already
+        shifted in the model thread
+        
+        :param rows: the numbers of the rows whose objects were removed from
+            the collection
+        """
+        assert object_thread( self )
+        rows = sorted( set( row for row in rows if row < self._rows ) )
+        #
+        # remove blocks of consecutive rows, starting from the last block
+        # so the numbers of the rows still to remove remain valid
+        #
+        while rows:
+            last = rows.pop()
+            first = last
+            while rows and rows[-1] == first - 1:
+                first = rows.pop()
+            self.beginRemoveRows( QtCore.QModelIndex(), first, last )
+            self._rows -= ( last - first + 1 )
+            self.endRemoveRows()
+        
     @model_function
     def append_object( self, obj, flush = True ):
         """Append an object to this collection, set the possible defaults and flush
@@ -1192,8 +1618,10 @@ position in the query.
                     self.unflushed_rows.remove( row )
                 except KeyError:
                     pass
+        changeset = EntityChangeset()
         for depending_obj in self.admin.get_depending_objects( obj ):
-            self.rsh.sendEntityUpdate( self, depending_obj )
+            changeset.add_update( depending_obj )
+        self.rsh.send_entity_changes( self, changeset )
         self._rows = rows + 1
         #
         # update the cache, so the object can be retrieved
@@ -24,18 +24,105 @@
 
 """Proxies representing the results of a query"""
 
+import bisect
+import collections
 import functools
 import logging
 logger = logging.getLogger('camelot.view.proxy.queryproxy')
 
+from PyQt4 import QtCore
+
 from collection_proxy import CollectionProxy, strip_data_from_object
-from camelot.view.model_thread import model_function, object_thread, post
+from row_count import row_count_cache, estimate_row_count
+from camelot.view.model_thread import ( model_function, object_thread, post,
+                                        BACKGROUND )
+from camelot.view.model_thread.model_thread_pool import in_worker_session
+
+def _sort_key( expression, descending = False ):
+    """Split an expression used in an order by clause in the sorted
+    column and the direction of the sort.
+    
+    :return: a `(column, descending)` tuple, or `None` if the expression is 
+        not a plain ascending or descending sort of a column
+    """
+    from sqlalchemy.sql import operators
+    modifier = getattr( expression, 'modifier', None )
+    if modifier == None:
+        return ( expression, descending )
+    if modifier == operators.asc_op:
+        return ( expression.element, descending )
+    if modifier == operators.desc_op:
+        return ( expression.element, not descending )
+    return None
+
+def _nullable( mapper, expression ):
+    """:return: `False` if the expression is a column of the tables of the
+        mapper that cannot be NULL, `True` otherwise.  Columns of joined 
+        tables can be NULL because the joins are outer joins."""
+    if hasattr( expression, '__clause_element__' ):
+        expression = expression.__clause_element__()
+    if getattr( expression, 'nullable', True ):
+        return True
+    return getattr( expression, 'table', None ) not in mapper.tables
 
+def _sort_expression( mapper, entity, field_name ):
+    """Find the sql expression to sort the objects of a mapper on a field.
+    
+    :return: a `(expression, join)` tuple, where join is the name of the 
+        relation to join to be able to sort on expression, or None if no join
+        is needed.  If the field cannot be sorted in sql, expression is None.
+    """
+    from sqlalchemy import orm
+    from sqlalchemy.exc import InvalidRequestError
+    from sqlalchemy.sql.expression import ClauseElement
+    
+    try:
+        property = mapper.get_property( field_name )
+    except InvalidRequestError:
+        property = None
+    #
+    # If the field is a relation: 
+    #  If it specifies an order_by option we have to join the related table, 
+    #  else we use the foreing key as sort field, without joining
+    #
+    if isinstance( property, orm.properties.PropertyLoader ):
+        target = property.mapper
+        if target.order_by:
+            return target.order_by[0], field_name
+        #
+        # _foreign_keys is for sqla pre 0.6.4
+        # 
+        if hasattr(property, '_foreign_keys'):
+            return list(property._foreign_keys)[0], None
+        return list(property._calculated_foreign_keys)[0], None
+    #
+    # Column properties, as well as hybrid properties and other class 
+    # attributes that evaluate to an sql expression
+    #
+    try:
+        class_attribute = getattr( entity, field_name )
+    except Exception, e:
+        logger.debug( 'could not get class attribute %s'%field_name, exc_info = e )
+        return None, None
+    if isinstance( class_attribute, ClauseElement ) or \
+       hasattr( class_attribute, '__clause_element__' ):
+        return class_attribute, None
+    return None, None
+    
 class QueryTableProxy(CollectionProxy):
     """The QueryTableProxy contains a limited copy of the data in the SQLAlchemy
     model, which is fetched from the database to be used as the model for a
     QTableView
+    
+    When the `list_pagination` attribute of the admin is set to 'keyset', the
+    sort key values of the first and the last row of each range that was
+    fetched are kept as boundaries.  A new range is then fetched by seeking
+    from the nearest boundary, or from the end of the query, instead of using
+    an offset from the start of the query.
     """
+    
+    # the maximum number of boundary rows kept for keyset pagination
+    max_keyset_boundaries = 100
 
     def __init__(self, admin, query_getter, columns_getter,
                  max_number_of_rows=10,
@@ -44,6 +131,14 @@ class QueryTableProxy(CollectionProxy):
         logger.debug('initialize query table')
         self._query_getter = query_getter
         self._sort_decorator = None
+        # a list of (column, descending) tuples defining the order of the
+        # query, None if the order cannot be used for keyset pagination
+        self._sort_keys = None
+        self._sort_joins = []
+        # the sort key values of rows already fetched, by row number
+        self._keyset_boundaries = collections.OrderedDict()
+        # True while the number of rows is an estimate
+        self._row_count_estimated = False
         self._mapper = admin.mapper
         #rows appended to the table which have not yet been flushed to the
         #database, and as such cannot be a result of the query
@@ -83,11 +178,50 @@ class QueryTableProxy(CollectionProxy):
 
     @model_function
     def getRowCount(self):
+        return self._get_row_count( self.admin.list_count == 'estimated' )
+    
+    @staticmethod
+    def _get_exact_row_count( query, appended_rows ):
+        """Count the rows, this might happen in a worker of a model thread
+        pool, so the query is built by the primary thread and the state of 
+        the proxy is not used.
+        
+        :param query: the query of which to count the rows
+        :param appended_rows: the number of appended rows
+        """
+        return row_count_cache.count( in_worker_session( query ) ) + appended_rows
+    
+    def _get_row_count(self, estimate):
+        """
+        :param estimate: `True` if the number of rows may be estimated by the
+            database, in which case the exact number of rows is counted in a
+            separate task and the row count is corrected afterwards.
+        :return: the number of rows
+        """
         self._clean_appended_rows()
         if not self._query_getter:
             return 0
         query = self.get_query_getter()()
-        return query.count() + len(self._appended_rows)
+        rows = row_count_cache.get( query )
+        if rows == None and estimate:
+            rows = estimate_row_count( query )
+            if rows != None:
+                self._row_count_estimated = True
+                post( self._get_exact_row_count, self._correct_row_count,
+                      args = ( query, len(self._appended_rows) ),
+                      read_only = True, priority = BACKGROUND, owner = self )
+        if rows == None:
+            rows = row_count_cache.count( query )
+        return rows + len(self._appended_rows)
+    
+    @QtCore.pyqtSlot(int)
+    def _correct_row_count(self, rows):
+        """Set the exact number of rows, after an estimated number of rows
+        was used"""
+        assert object_thread( self )
+        self._row_count_estimated = False
+        if rows != self._rows:
+            self.setRowCount( rows )
 
     def setQuery(self, query_getter):
         """Set the query and refresh the view"""
@@ -117,73 +251,68 @@ class QueryTableProxy(CollectionProxy):
         return self.get_query_getter()().all()
     
     @model_function
-    def _set_sort_decorator( self, column=None, order=None ):
+    def _set_sort_decorator( self, sort_columns = None ):
         """set the sort decorator attribute of this model to a function that
-        sorts a query by the given column using the given order.  When no
-        arguments are given, use the default sorting, which is according to
-        the primary keys of the model.  This to impose a string ordening of
-        the rows in the model.
+        sorts a query by the given columns.  Columns that cannot be sorted in
+        sql are ignored.  Finally the query is sorted by the default sorting, 
+        which is according to the primary keys of the model.  This to impose
+        a strict ordening of the rows in the model.
+        
+        :param sort_columns: a list of `(column, order)` tuples, with the
+            most significant column first, or `None` to use only the default
+            sorting
         """
         from sqlalchemy import orm
-        from sqlalchemy.exc import InvalidRequestError
         
-        class_attributes_to_sort_by, join = [], None
+        if sort_columns == None:
+            sort_columns = []
+        class_attributes_to_sort_by, joins = [], []
+        sort_keys = []
         mapper = orm.class_mapper(self.admin.entity)
         #
-        # First sort according the requested column
+        # First sort according the requested columns
         #
-        if column != None and order != None:
-            property = None
+        for column, order in sort_columns:
             field_name = self._columns[column][0]
-            class_attribute = getattr(self.admin.entity, field_name)
-            try:
-                property = mapper.get_property(
-                    field_name,
-                )
-            except InvalidRequestError:
-                #
-                # If the field name is not a property of the mapper, we cannot
-                # sort it using sql
-                #
-                pass
-            
-            # If the field is a relation: 
-            #  If it specifies an order_by option we have to join the related table, 
-            #  else we use the foreing key as sort field, without joining
-            if property and isinstance(property, orm.properties.PropertyLoader):
-                target = property.mapper
-                if target:
-                    if target.order_by:
-                        join = field_name
-                        class_attribute = target.order_by[0]
-                    else:
-                        #
-                        # _foreign_keys is for sqla pre 0.6.4
-                        # 
-                        if hasattr(property, '_foreign_keys'):
-                            class_attribute = list(property._foreign_keys)[0]
-                        else:                             
-                            class_attribute = list(property._calculated_foreign_keys)[0]
-            if property:
-                if order:
-                    class_attributes_to_sort_by.append( class_attribute.desc() )
-                else:
-                    class_attributes_to_sort_by.append( class_attribute )
+            class_attribute, join = _sort_expression( mapper, 
+                                                      self.admin.entity,
+                                                      field_name )
+            if class_attribute is None:
+                logger.debug( 'cannot sort %s in sql'%field_name )
+                continue
+            if join and join not in joins:
+                joins.append( join )
+            if order:
+                class_attributes_to_sort_by.append( class_attribute.desc() )
+            else:
+                class_attributes_to_sort_by.append( class_attribute )
+            sort_keys.append( _sort_key( class_attribute, bool(order) ) )
                     
         #
         # Next sort according to default sort column if any
         #
         if mapper.order_by:
             class_attributes_to_sort_by.extend( mapper.order_by )
+            sort_keys.extend( _sort_key( order_by ) for order_by in mapper.order_by )
             
         #
         # In the end, sort according to the primary keys of the model, to enforce
         # a unique order in any case
         #
         class_attributes_to_sort_by.extend( mapper.primary_key )
+        sort_keys.extend( (column, False) for column in mapper.primary_key )
+        #
+        # A comparison with NULL matches no rows, so seeking from a boundary
+        # row would skip the rows with NULL values
+        #
+        if None in sort_keys or any( _nullable( mapper, column ) for column, _descending in sort_keys ):
+            sort_keys = None
+        self._sort_keys = sort_keys
+        self._sort_joins = joins
+        self._keyset_boundaries.clear()
                                 
-        def sort_decorator(class_attributes_to_sort_by, join, query):
-            if join:
+        def sort_decorator(class_attributes_to_sort_by, joins, query):
+            for join in joins:
                 query = query.outerjoin(join)                            
             if class_attributes_to_sort_by:
                 return query.order_by( *class_attributes_to_sort_by )
@@ -192,16 +321,27 @@ class QueryTableProxy(CollectionProxy):
         
         self._sort_decorator = functools.partial( sort_decorator,
                                                   class_attributes_to_sort_by, 
-                                                  join )
+                                                  joins )
         return self._rows
         
-    def sort( self, column, order ):
-        """Overwrites the :meth:`QAbstractItemModel.sort` method
+    def sort_columns( self, sort_columns ):
+        """Sort the rows by multiple columns
+        
+        :param sort_columns: a list of `(column, order)` tuples, with the
+            most significant column first
         """
         assert object_thread( self )
-        post( functools.update_wrapper( functools.partial( self._set_sort_decorator, column, order ), self._set_sort_decorator ), 
+        self._sort_columns = list( sort_columns )
+        post( functools.update_wrapper( functools.partial( self._set_sort_decorator, self._sort_columns ), self._set_sort_decorator ), 
               self._refresh_content )
 
+    @QtCore.pyqtSlot(int)
+    def _refresh_content(self, rows ):
+        # once the content changes, rows might have moved, so the sort key
+        # values of a row are no longer known
+        self._keyset_boundaries.clear()
+        super( QueryTableProxy, self )._refresh_content( rows )
+
     def append(self, o):
         """Add an object to this collection, used when inserting a new
         row, overwrite this method for specific behaviour in subclasses"""
@@ -212,7 +352,15 @@ class QueryTableProxy(CollectionProxy):
     def remove(self, o):
         if o in self._appended_rows:
             self._appended_rows.remove(o)
-        self._rows = self._rows - 1
+
+    def _remove_cached_rows( self, rows ):
+        super( QueryTableProxy, self )._remove_cached_rows( rows )
+        # the rows after a removed row keep their sort key values
+        boundaries = self._keyset_boundaries.items()
+        self._keyset_boundaries.clear()
+        for row, values in boundaries:
+            if row not in rows:
+                self._keyset_boundaries[ row - bisect.bisect_left( rows, row ) ] = values
 
     @model_function
     def getData(self):
@@ -227,86 +375,173 @@ class QueryTableProxy(CollectionProxy):
         :return: an iterator over the objects in the collection, starting at 
         offset, until limit
         """
-        from sqlalchemy import orm
-        from sqlalchemy.exc import InvalidRequestError
-        
-        query = self.get_query_getter()().offset(offset).limit(limit)
+        if self.admin.list_pagination == 'keyset':
+            query, reverse = self._get_keyset_range_query( offset, limit )
+        else:
+            query, reverse = self.get_query_getter()().offset(offset).limit(limit), False
         #
-        # undefer all columns displayed in the list, to reduce the number
-        # of queries
+        # load the relations and deferred columns displayed in the list
+        # together with the rows, to reduce the number of queries
         #
-        columns_to_undefer = []
-        for field_name, _field_attributes in self._columns:
-            
-            property = None
-            try:
-                property = self.admin.mapper.get_property(
-                    field_name,
-                )
-            except InvalidRequestError:
-                #
-                # If the field name is not a property of the mapper
-                #
-                pass
-
-            if property and isinstance(property, orm.properties.ColumnProperty):
-                columns_to_undefer.append( field_name )
-                
-        if columns_to_undefer:
-            options = [ orm.undefer( field_name ) for field_name in columns_to_undefer ]
+        options = self.admin.get_loader_options( [ field_name for field_name, _field_attributes in self._columns ] )
+        if options:
             query = query.options( *options )
-                
-        return query.all()
+        
+        if self._sort_keys == None or self.admin.list_pagination != 'keyset':
+            return query.all()
+        #
+        # the sort key values are queried together with the objects, to
+        # remember the values of the first and the last row as boundaries
+        #
+        query = query.add_columns( *[column for column, _descending in self._sort_keys] )
+        results = query.all()
+        if reverse:
+            results.reverse()
+        if results:
+            self._set_keyset_boundary( offset, results[0][1:] )
+            self._set_keyset_boundary( offset + len(results) - 1, results[-1][1:] )
+        return [result[0] for result in results]
+    
+    def _set_keyset_boundary( self, row, values ):
+        """Remember the sort key values of a row"""
+        if None in values:
+            # NULL values cannot be compared in a WHERE clause
+            return
+        self._keyset_boundaries.pop( row, None )
+        self._keyset_boundaries[row] = tuple( values )
+        while len( self._keyset_boundaries ) > self.max_keyset_boundaries:
+            self._keyset_boundaries.popitem( last = False )
+    
+    def _get_keyset_condition( self, values, forward ):
+        """
+        :param values: the sort key values of a boundary row
+        :param forward: `True` if the condition should select the rows after
+            the boundary row, `False` if it should select the rows before it
+        :return: a clause selecting the rows after or before a boundary row
+        """
+        from sqlalchemy import sql
+        clauses = []
+        for i, ( column, descending ) in enumerate( self._sort_keys ):
+            if descending == forward:
+                comparison = ( column < values[i] )
+            else:
+                comparison = ( column > values[i] )
+            equalities = [ ( previous_column == value ) for ( previous_column, _descending ), value in zip( self._sort_keys[:i], values[:i] ) ]
+            clauses.append( sql.and_( *( equalities + [comparison] ) ) )
+        return sql.or_( *clauses )
+        
+    def _get_keyset_range_query( self, offset, limit ):
+        """Construct a query for a range of rows that seeks to the range
+        from the nearest boundary row with known sort key values or from the
+        end of the query.  The query with an offset from the start of the 
+        query is used when no boundary is nearer.
+        
+        :return: `(query, reverse)` where reverse is `True` if the query 
+            returns the rows in reverse order.
+        """
+        if self._sort_decorator == None:
+            self._set_sort_decorator()
+        query = self._query_getter()
+        if self._sort_keys == None or query._order_by:
+            # the order of the query cannot be used to seek rows
+            return self.get_query_getter()().offset(offset).limit(limit), False
+        for join in self._sort_joins:
+            query = query.outerjoin( join )
+        #
+        # find the start of the seek with the least rows to skip, as
+        # (rows to skip, boundary row values, forward)
+        #
+        seeks = [ ( offset, None, True ) ]
+        rows_in_query = self._rows - len( self._appended_rows )
+        # seeking from the end needs the exact number of rows
+        if rows_in_query > offset and not self._row_count_estimated:
+            seeks.append( ( max( rows_in_query - offset - limit, 0 ), None, False ) )
+        for row, values in self._keyset_boundaries.iteritems():
+            if row < offset:
+                seeks.append( ( offset - row - 1, values, True ) )
+            elif row >= offset + limit:
+                seeks.append( ( row - offset - limit, values, False ) )
+        skip, values, forward = min( seeks, key = lambda seek:seek[0] )
+        if forward:
+            order_by = [ column.desc() if descending else column for column, descending in self._sort_keys ]
+        else:
+            order_by = [ column if descending else column.desc() for column, descending in self._sort_keys ]
+            if values == None:
+                # seeking from the end of the query, the range might be
+                # smaller than limit at the start of the query
+                limit = min( limit, rows_in_query - offset )
+        if values != None:
+            query = query.filter( self._get_keyset_condition( values, forward ) )
+        query = query.order_by( *order_by ).offset( skip ).limit( limit )
+        return query, not forward
                     
     @model_function
     def _extend_cache(self):
-        """Extend the cache around the rows under request"""
+        """Extend the cache around the rows under request
+        :return: the set of rows under request that were handled
+        """
+        requested_rows, ranges = self._ranges_to_get()
         if self._query_getter:
-            offset, limit = self._offset_and_limit_rows_to_get()
-            if limit:
-                columns = self._columns
-                #
-                # try to move the offset further by looking if the
-                # objects are already in the cache.
-                #
-                # this has the advantage that we might not need a query,
-                # and more important, that objects remain at the same row
-                # while their position in the query might have been changed
-                # since the previous query.
-                #
-                rows_in_cache = 0
-                for row in range(offset, offset + limit):
-                    try:
-                        cached_obj =  self.edit_cache.get_entity_at_row(row)                        
-                        self._add_data( columns, row, cached_obj)
-                        rows_in_cache += 1
-                    except KeyError:
-                        break
-                #
-                # query the remaining rows
-                #
-                query_offset = offset + rows_in_cache
-                query_limit = limit - rows_in_cache
-                if query_limit > 0:
-                    for i, obj in enumerate( self._get_collection_range(query_offset, 
-                                                                        query_limit) ):
-                        row = i + query_offset
-                        try:
-                            previous_obj = self.edit_cache.get_entity_at_row(row)
-                            if previous_obj != obj:
-                                continue
-                        except KeyError:
-                            pass
-                        if self._skip_row(row, obj) == False:
-                            self._add_data(columns, row, obj)
-                rows_in_query = (self._rows - len(self._appended_rows))
-                # Verify if rows that have not yet been flushed have been 
-                # requested
-                if offset+limit >= rows_in_query:
-                    for row in range(max(rows_in_query, offset), min(offset+limit, self._rows)):
-                        obj = self._get_object(row)
-                        self._add_data(columns, row, obj)                
-            return (offset, limit)
+            # consecutive ranges are fetched with a single query
+            for offset, limit, rows in self._read_ahead.batches( ranges ):
+                self._extend_cache_range( offset, limit, rows )
+        return requested_rows
+        
+    def _extend_cache_range(self, offset, limit, rows = None):
+        """Fill the cache with the rows from offset until offset + limit
+        
+        :param rows: the set of rows within the range to put in the cache,
+            `None` to put all rows of the range in the cache
+        """
+        columns = self._columns
+        #
+        # try to move the offset further by looking if the
+        # objects are already in the cache.
+        #
+        # this has the advantage that we might not need a query,
+        # and more important, that objects remain at the same row
+        # while their position in the query might have been changed
+        # since the previous query.
+        #
+        rows_and_objects = []
+        for row in range(offset, offset + limit):
+            try:
+                cached_obj =  self.cache.get_entity_at_row(row)                        
+                rows_and_objects.append( ( row, cached_obj ) )
+            except KeyError:
+                break
+        rows_in_cache = len( rows_and_objects )
+        #
+        # query the remaining rows
+        #
+        query_offset = offset + rows_in_cache
+        query_limit = limit - rows_in_cache
+        if query_limit > 0:
+            objects = set( obj for _row, obj in rows_and_objects )
+            for i, obj in enumerate( self._get_collection_range(query_offset, 
+                                                                query_limit) ):
+                row = i + query_offset
+                try:
+                    previous_obj = self.cache.get_entity_at_row(row)
+                    if previous_obj != obj:
+                        continue
+                except KeyError:
+                    pass
+                if self._skip_row(row, obj) == False and obj not in objects:
+                    rows_and_objects.append( ( row, obj ) )
+                    objects.add( obj )
+        rows_in_query = (self._rows - len(self._appended_rows))
+        # Verify if rows that have not yet been flushed have been 
+        # requested
+        if offset+limit >= rows_in_query:
+            for row in range(max(rows_in_query, offset), min(offset+limit, self._rows)):
+                obj = self._get_object(row)
+                rows_and_objects.append( ( row, obj ) )
+        if rows != None:
+            rows_and_objects = [ ( row, obj ) for row, obj in rows_and_objects if row in rows ]
+        # the dynamic field attributes of the whole window are evaluated
+        # at once
+        self._add_rows( columns, rows_and_objects )
 
     @model_function
     def _get_object(self, row):
@@ -320,9 +555,14 @@ class QueryTableProxy(CollectionProxy):
             # first try to get the primary key out of the cache, if it's not
             # there, query the collection_getter
             try:
-                return self.edit_cache.get_entity_at_row(row)
+                return self.cache.get_entity_at_row(row)
             except KeyError:
                 pass
+            if self._query_getter and self.admin.list_pagination == 'keyset':
+                objects = self._get_collection_range( row, 1 )
+                if objects:
+                    return objects[0]
+                return None
             # momentary hack for list error that prevents forms to be closed
             if self._query_getter:
                 res = self.get_query_getter()().offset(row)
@@ -334,3 +574,57 @@ class QueryTableProxy(CollectionProxy):
                     return res.limit(1).first()
                 except:
                     pass
+
+    @model_function
+    def _get_objects( self, first_row, last_row = None, yield_per = None ):
+        """Generator over the objects in the rows from first_row until and
+        including last_row.  If last_row is None, all objects from first_row
+        until the end of the query are returned, followed by the appended 
+        rows.
+        
+        If last_row is None, the objects are fetched `yield_per` rows at a
+        time from a single query, since a range query for each `yield_per`
+        rows would make the database skip an ever growing number of rows.
+        Otherwise the objects are queried with one range query for each 
+        `yield_per` rows.  Objects at the start of such a range that are 
+        already in the cache are not queried again.
+        """
+        yield_per = yield_per or 10 * self.max_number_of_rows
+        self._clean_appended_rows()
+        appended_rows = list( self._appended_rows )
+        rows_in_query = self._rows - len( appended_rows )
+        if last_row == None:
+            last_query_row = None
+            if self._query_getter:
+                query = self.get_query_getter()()
+                if first_row:
+                    query = query.offset( first_row )
+                for obj in query.yield_per( yield_per ):
+                    yield obj
+        else:
+            last_query_row = min( last_row, rows_in_query - 1 )
+        offset = first_row
+        while self._query_getter and last_query_row != None:
+            limit = min( yield_per, last_query_row - offset + 1 )
+            if limit <= 0:
+                break
+            objects = []
+            for row in range( offset, min( offset + limit, rows_in_query ) ):
+                try:
+                    objects.append( self.cache.get_entity_at_row( row ) )
+                except KeyError:
+                    break
+            if len( objects ) < limit:
+                objects.extend( self._get_collection_range( offset + len( objects ),
+                                                            limit - len( objects ) ) )
+            for obj in objects:
+                yield obj
+            if len( objects ) < limit:
+                # the end of the query was reached
+                break
+            offset += limit
+        if last_row == None:
+            last_row = self._rows - 1
+        for row in range( max( first_row, rows_in_query ), 
+                          min( last_row, self._rows - 1 ) + 1 ):
+            yield appended_rows[row - rows_in_query]
@@ -0,0 +1,148 @@
+#  ============================================================================
+#
+#  Copyright (C) 2007-2012 Conceptive Engineering bvba. All rights reserved.
+#  www.conceptive.be / project-camelot@conceptive.be
+#
+#  This file is part of the Camelot Library.
+#
+#  This file may be used under the terms of the GNU General Public
+#  License version 2.0 as published by the Free Software Foundation
+#  and appearing in the file license.txt included in the packaging of
+#  this file.  Please review this information to ensure GNU
+#  General Public Licensing requirements will be met.
+#
+#  If you are unsure which license is appropriate for your use, please
+#  visit www.python-camelot.com or contact project-camelot@conceptive.be
+#
+#  This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+#  WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  For use of this library in commercial applications, please contact
+#  project-camelot@conceptive.be
+#
+#  ============================================================================
+
+
+"""Read ahead scheduling for the cache of a collection proxy.
+
+When the user scrolls through a table, the rows that come into view are 
+requested one by one by the view.  The read ahead scheduler turns those
+requests into a small number of ranges of rows to fetch in one go, 
+anticipating on the rows that will be requested next.
+"""
+
+class ReadAhead( object ):
+    """Predicts the scroll direction and velocity from the rows requested by
+    the view and decides which ranges of rows should be fetched.
+
+    :param viewport: the number of rows visible at once in the view, this
+        is the minimal number of rows fetched around a requested row.
+    :param max_window: the maximum number of rows fetched around the 
+        requested rows, this should be smaller than the size of the cache,
+        to prevent fetched rows from being evicted before they are used.
+    """
+    
+    def __init__( self, viewport, max_window = None ):
+        self.viewport = max( viewport, 1 )
+        self.max_window = max_window or 4 * self.viewport
+        # the maximum number of rows fetched with a single query when
+        # combining several ranges
+        self.max_batch = 2 * self.max_window
+        # the average number of rows the requests moved, a positive
+        # number when scrolling down, negative when scrolling up
+        self.velocity = 0.0
+        self._previous_center = None
+        
+    def _update_velocity( self, first, last ):
+        center = ( first + last ) / 2.0
+        if self._previous_center != None:
+            delta = center - self._previous_center
+            # rows that were read ahead are not requested, so the distance 
+            # between requests can be as large as the read ahead window
+            if abs( delta ) > self.viewport + self.max_window:
+                # the user jumped to another position instead of scrolling
+                self.velocity = 0.0
+            else:
+                self.velocity = ( self.velocity + delta ) / 2.0
+        self._previous_center = center
+        
+    def window( self ):
+        """:return: a tuple with the number of rows to fetch before and after
+        the requested rows"""
+        speed = int( abs( self.velocity ) )
+        if speed == 0:
+            before = after = self.viewport // 2
+        else:
+            ahead = min( self.viewport + 2 * speed, self.max_window )
+            behind = self.viewport // 4
+            if self.velocity > 0:
+                before, after = behind, ahead
+            else:
+                before, after = ahead, behind
+        return before, after
+    
+    def ranges( self, requested_rows, rows, has_data ):
+        """
+        :param requested_rows: an iterable with the numbers of the rows that
+            were requested by the view, but are not yet in the cache
+        :param rows: the total number of rows in the collection
+        :param has_data: a function that takes a row number as its argument,
+            and returns `True` if the cache already has data for the row
+        :return: a list of `(offset, limit)` tuples with the ranges of rows
+            to fetch, ordered by offset.  Gaps between rows that are not in 
+            the cache are merged if they are less than a viewport apart.
+        """
+        requested_rows = sorted( row for row in requested_rows if 0 <= row < rows )
+        if not requested_rows:
+            return []
+        self._update_velocity( requested_rows[0], requested_rows[-1] )
+        before, after = self.window()
+        #
+        # group the requested rows that are near each other, and extend
+        # each group with the read ahead window
+        #
+        windows = []
+        for row in requested_rows:
+            if windows and row - windows[-1][1] <= self.viewport:
+                windows[-1][1] = row
+            else:
+                windows.append( [row, row] )
+        #
+        # within each window, look for the rows without data and merge
+        # them into ranges
+        #
+        ranges = []
+        requested = set( requested_rows )
+        for first, last in windows:
+            for row in xrange( max( first - before, 0 ), 
+                               min( last + after + 1, rows ) ):
+                if row not in requested and has_data( row ):
+                    continue
+                if ranges and row - ranges[-1][1] <= self.viewport:
+                    ranges[-1][1] = row
+                else:
+                    ranges.append( [row, row] )
+        return [ ( first, last - first + 1 ) for first, last in ranges ]
+    
+    def batches( self, ranges ):
+        """Combine ranges of rows so they can be fetched with a single query
+        each.  Consecutive ranges are combined as long as the combined range
+        is not larger than `max_batch` rows, the rows in between are queried
+        as well but should not be put in the cache again.
+        
+        :param ranges: a list of `(offset, limit)` tuples ordered by offset, 
+            as returned by :meth:`ranges`
+        :return: a list of `(offset, limit, rows)` tuples with the range of
+            rows to query, and the set of rows in that range to put in the
+            cache
+        """
+        batches = []
+        for offset, limit in ranges:
+            rows = set( xrange( offset, offset + limit ) )
+            if batches:
+                first, last, batch_rows = batches[-1]
+                if offset + limit - first <= self.max_batch:
+                    batches[-1] = ( first, offset + limit - 1, batch_rows | rows )
+                    continue
+            batches.append( ( offset, offset + limit - 1, rows ) )
+        return [ ( first, last - first + 1, rows ) for first, last, rows in batches ]
@@ -0,0 +1,190 @@
+#  ============================================================================
+#
+#  Copyright (C) 2007-2012 Conceptive Engineering bvba. All rights reserved.
+#  www.conceptive.be / project-camelot@conceptive.be
+#
+#  This file is part of the Camelot Library.
+#
+#  This file may be used under the terms of the GNU General Public
+#  License version 2.0 as published by the Free Software Foundation
+#  and appearing in the file license.txt included in the packaging of
+#  this file.  Please review this information to ensure GNU
+#  General Public Licensing requirements will be met.
+#
+#  If you are unsure which license is appropriate for your use, please
+#  visit www.python-camelot.com or contact project-camelot@conceptive.be
+#
+#  This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+#  WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  For use of this library in commercial applications, please contact
+#  project-camelot@conceptive.be
+#
+#  ============================================================================
+
+
+"""Counting the rows of a query, as needed by the 
+:class:`camelot.view.proxy.queryproxy.QueryTableProxy` to size its table.
+
+Counting the rows of a query is expensive for large or joined tables, so
+exact counts are kept in a cache, keyed on the compiled query.  The counts
+are invalidated after each flush that inserts or deletes rows in one of the 
+tables used by the query.  Counts of filtered queries are invalidated by
+updates as well, since an update might move a row in or out of the filter.
+Changes that are not flushed by the session, such as bulk updates, raw sql
+or changes made by other clients, are not noticed, so counts expire after a
+while, and the cache is cleared when the session is refreshed.
+
+For unfiltered queries on PostgreSQL, the number of rows can be estimated
+from the planner statistics instead.
+"""
+
+import collections
+import itertools
+import logging
+import time
+
+from PyQt4 import QtCore
+
+from sqlalchemy import event, orm, sql
+from sqlalchemy.sql.util import find_tables
+
+from camelot.core.threading import synchronized
+
+LOGGER = logging.getLogger( 'camelot.view.proxy.row_count' )
+
+def _query_tables( query ):
+    """:return: a frozenset with the tables used by a query"""
+    tables = find_tables( query.statement, 
+                          check_columns = True, 
+                          include_aliases = True )
+    return frozenset( getattr( table, 'original', table ) for table in tables )
+
+class RowCountCache( object ):
+    """Cache of the number of rows of queries
+    
+    :param max_entries: the maximum number of counts to keep, if more 
+        counts are added, the least recently used count is removed.
+    :param ttl: the number of seconds after which a count expires
+    """
+    
+    def __init__( self, max_entries = 100, ttl = 300 ):
+        self._mutex = QtCore.QMutex()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> ( count, tables, filtered, time counted )
+        self._counts = collections.OrderedDict()
+        
+    @staticmethod
+    def _key( query ):
+        """:return: the key of a query in the cache or None if the query
+        cannot be used as a key"""
+        compiled = query.statement.compile()
+        key = ( unicode( compiled ), tuple( sorted( compiled.params.items() ) ) )
+        try:
+            hash( key )
+        except TypeError:
+            return None
+        return key
+    
+    @synchronized
+    def _get( self, key ):
+        try:
+            count, tables, filtered, counted = self._counts.pop( key )
+        except KeyError:
+            return None
+        if time.time() - counted > self.ttl:
+            return None
+        self._counts[key] = ( count, tables, filtered, counted )
+        return count
+    
+    @synchronized
+    def _set( self, key, count, tables, filtered ):
+        self._counts.pop( key, None )
+        self._counts[key] = ( count, tables, filtered, time.time() )
+        while len( self._counts ) > self.max_entries:
+            self._counts.popitem( last = False )
+    
+    def get( self, query ):
+        """:return: the cached number of rows of a query, None if the number
+        of rows is not in the cache"""
+        key = self._key( query )
+        if key != None:
+            return self._get( key )
+        
+    def count( self, query ):
+        """:return: the number of rows of a query, from the cache if 
+        possible, otherwise the rows are counted and put in the cache"""
+        key = self._key( query )
+        if key == None:
+            return query.count()
+        count = self._get( key )
+        if count == None:
+            count = query.count()
+            tables = _query_tables( query )
+            filtered = ( query.whereclause is not None ) or len( tables ) > 1
+            self._set( key, count, tables, filtered )
+        return count
+    
+    @synchronized
+    def invalidate( self, tables, filtered_only = False ):
+        """Remove the counts of the queries that use any of the tables
+        
+        :param tables: an iterable of tables
+        :param filtered_only: only remove the counts of filtered queries
+        """
+        tables = set( tables )
+        for key, ( _count, query_tables, filtered, _counted ) in self._counts.items():
+            if filtered_only and not filtered:
+                continue
+            if not tables.isdisjoint( query_tables ):
+                del self._counts[key]
+                
+    @synchronized
+    def clear( self ):
+        """Remove all counts from the cache"""
+        self._counts.clear()
+        
+row_count_cache = RowCountCache()
+
+@event.listens_for( orm.Session, 'after_flush' )
+def invalidate_row_counts( session, flush_context ):
+    """Invalidate the counts of the queries using the tables in which rows
+    were inserted, deleted or updated by a flush.  Within `after_flush` the
+    session still contains the flushed objects in its `new`, `deleted` and
+    `dirty` collections."""
+    inserted_or_deleted, updated = set(), set()
+    for obj in itertools.chain( session.new, session.deleted ):
+        inserted_or_deleted.update( orm.object_mapper( obj ).tables )
+    for obj in session.dirty:
+        updated.update( orm.object_mapper( obj ).tables )
+    if inserted_or_deleted:
+        row_count_cache.invalidate( inserted_or_deleted )
+    if updated:
+        row_count_cache.invalidate( updated, filtered_only = True )
+
+def estimate_row_count( query ):
+    """Use the planner statistics of the database to estimate the number of
+    rows of an unfiltered query on a single table.
+    
+    :return: the estimated number of rows, or None if no estimate is 
+        available for this query or this database.
+    """
+    if query.whereclause is not None or query._distinct or query._group_by:
+        return None
+    if query._limit is not None or query._offset is not None:
+        return None
+    tables = _query_tables( query )
+    if len( tables ) != 1:
+        return None
+    table = list( tables )[0]
+    bind = getattr( table, 'bind', None )
+    if bind == None or bind.dialect.name != 'postgresql':
+        return None
+    estimate = bind.execute( sql.text( 'SELECT reltuples FROM pg_class WHERE oid = CAST(:table_name AS regclass)' ),
+                             table_name = table.fullname ).scalar()
+    # tables that have never been analyzed have no usefull statistics
+    if estimate == None or estimate <= 0:
+        return None
+    LOGGER.debug( 'estimated %s rows in %s'%( estimate, table.fullname ) )
+    return int( estimate )
@@ -27,16 +27,115 @@ Classes to connect the QT event loop with a messaging
 server.  To enable multiple clients to push model updates
 to each other or messages for the users.
 
-As a messaging server, Apache active MQ was tested in combination
-with the stomp library (http://docs.codehaus.org/display/STOMP/Python)
+When the signal handler is constructed with a 
+:class:`camelot.view.message_bus.MessageBus`, the changes of every flush of
+a session are published on the bus once the transaction is committed, as 
+well as the changes sent with the `'remote'` scope.  The changes published by other clients expire the affected objects in the session and update the
+views that display them.  The message bus of an application is set up with
+the `CAMELOT_MESSAGE_BUS` setting, a function that returns the bus ::
+
+    CAMELOT_MESSAGE_BUS = lambda:SocketMessageBus('localhost:61613')
 """
 
 import logging
 import re
+import sys
+import weakref
 
 LOGGER = logging.getLogger('remote_signals')
 
 from PyQt4 import QtCore
+from sqlalchemy import event, orm
+
+class EntityChangeset(object):
+    """The changes to entities, such as those of a single flush of a session,
+    grouped by entity type and primary key.  Sending a changeset through the
+    signal handler informs each collection proxy once about all the changes,
+    instead of once per changed entity.
+    
+    Entities without a primary key, such as unmapped objects or objects that
+    have not been flushed yet, are identified by their identity.
+    """
+    
+    def __init__(self):
+        self.updated = dict()
+        self.deleted = dict()
+        self.created = dict()
+        # the entities with local changes that were changed or deleted by
+        # another client
+        self.conflicts = []
+        
+    @staticmethod
+    def _key(entity):
+        from sqlalchemy.orm.exc import UnmappedInstanceError
+        try:
+            mapper = orm.object_mapper(entity)
+        except UnmappedInstanceError:
+            return id(entity)
+        # use the identity key, since the attributes of objects that were
+        # expunged might no longer be available
+        key = orm.attributes.instance_state(entity).key
+        if key != None:
+            return tuple(key[1])
+        # objects that are being flushed have a primary key, but no identity
+        # key yet
+        primary_key = tuple(mapper.primary_key_from_instance(entity))
+        if None in primary_key:
+            return id(entity)
+        return primary_key
+    
+    def _add(self, changes, entity):
+        changes.setdefault(type(entity), dict())[self._key(entity)] = entity
+        
+    def add_update(self, entity):
+        """Register an entity that has changed"""
+        self._add(self.updated, entity)
+        
+    def add_delete(self, entity):
+        """Register an entity that is about to be deleted, if the entity
+        was registered as changed before, it is no longer considered changed"""
+        self._add(self.deleted, entity)
+        self.updated.get(type(entity), dict()).pop(self._key(entity), None)
+        
+    def add_create(self, entity):
+        """Register an entity that was created"""
+        self._add(self.created, entity)
+        
+    @staticmethod
+    def _entities(changes):
+        for entities in changes.itervalues():
+            for entity in entities.itervalues():
+                yield entity
+                
+    def updated_entities(self):
+        """:return: an iterator over the changed entities"""
+        return self._entities(self.updated)
+    
+    def deleted_entities(self):
+        """:return: an iterator over the deleted entities"""
+        return self._entities(self.deleted)
+    
+    def created_entities(self):
+        """:return: an iterator over the created entities"""
+        return self._entities(self.created)
+    
+    def messages(self):
+        """:return: a list of `(entity, primary_key, change_type)` tuples to
+            publish on a message bus, for the entities with a primary key"""
+        messages = []
+        for change_type, changes in (('update', self.updated), 
+                                     ('delete', self.deleted), 
+                                     ('create', self.created)):
+            for entity_type, entities in changes.iteritems():
+                entity_name = '%s.%s'%(entity_type.__module__, entity_type.__name__)
+                for key in entities.iterkeys():
+                    if isinstance(key, tuple):
+                        messages.append((entity_name, list(key), change_type))
+        return messages
+    
+    def __len__(self):
+        return sum(len(entities) for changes in (self.updated, self.deleted, self.created) 
+                                 for entities in changes.itervalues())
 
 class SignalHandler(QtCore.QObject):
     """The signal handler connects multiple collection proxy classes to
@@ -59,12 +158,19 @@ class SignalHandler(QtCore.QObject):
     entity_update_signal = QtCore.pyqtSignal(object, object)
     entity_delete_signal = QtCore.pyqtSignal(object, object)
     entity_create_signal = QtCore.pyqtSignal(object, object)
+    entity_changes_signal = QtCore.pyqtSignal(object, object)
+    # emitted with a list of objects with unflushed changes, that were
+    # changed or deleted by another client
+    remote_conflicts_signal = QtCore.pyqtSignal(object)
     
     entity_update_pattern = r'^/topic/Camelot.Entity.(?P<entity>.*).update$' 
     
-    def __init__(self):
+    def __init__(self, message_bus=None):
         super(SignalHandler, self).__init__()
         self.update_expression = re.compile(self.entity_update_pattern)
+        self.message_bus = message_bus
+        if message_bus != None:
+            message_bus.messages_received_signal.connect(self._messages_received)
             
     def connect_signals(self, obj):
         """Connect the SignalHandlers its signals to the slots of obj, while
@@ -72,6 +178,7 @@ class SignalHandler(QtCore.QObject):
         self.entity_update_signal.connect( obj.handle_entity_update, QtCore.Qt.QueuedConnection )
         self.entity_delete_signal.connect( obj.handle_entity_delete, QtCore.Qt.QueuedConnection )
         self.entity_create_signal.connect( obj.handle_entity_create, QtCore.Qt.QueuedConnection )   
+        self.entity_changes_signal.connect( obj.handle_entity_changes, QtCore.Qt.QueuedConnection )
         
     def send_entity_update(self, sender, entity, scope='local'):
         """Call this method to inform the whole application an entity has 
@@ -93,6 +200,128 @@ class SignalHandler(QtCore.QObject):
         """Call this method to inform the whole application an entity 
         was created"""
         self.entity_create_signal.emit( sender, entity )
+        
+    def send_entity_changes(self, sender, changeset, scope='local'):
+        """Call this method to inform the whole application about all the
+        changes in an :class:`EntityChangeset` at once"""
+        if len(changeset):
+            self.entity_changes_signal.emit( sender, changeset )
+            if scope == 'remote' and self.message_bus != None:
+                self.message_bus.publish( changeset.messages() )
+                
+    @QtCore.pyqtSlot(object)
+    def _messages_received(self, messages):
+        from camelot.view.model_thread import post
+        post(lambda:apply_messages(messages), self._remote_changes_applied)
+        
+    @QtCore.pyqtSlot(object)
+    def _remote_changes_applied(self, changeset):
+        from camelot.view.completion import clear_completion_cache
+        from camelot.view.proxy.row_count import row_count_cache
+        # the other client might have inserted or deleted rows that are
+        # not in the session
+        row_count_cache.clear()
+        clear_completion_cache()
+        self.send_entity_changes(None, changeset)
+        if changeset.conflicts:
+            self.remote_conflicts_signal.emit(changeset.conflicts)
+
+# session -> the messages of the flushes in its current transaction
+_unpublished_messages_ = weakref.WeakKeyDictionary()
+
+def _message_bus():
+    """:return: the message bus of the signal handler, or None"""
+    if not has_signal_handler():
+        return None
+    return get_signal_handler().message_bus
+
+@event.listens_for(orm.Session, 'after_flush')
+def collect_flushed_changes(session, flush_context):
+    """Collect the rows inserted, updated or deleted by a flush, whatever code
+    path caused the flush, to publish them when the transaction is committed.
+    Within `after_flush` the session still contains the flushed objects in 
+    its `new`, `deleted` and `dirty` collections."""
+    if _message_bus() == None:
+        return
+    changeset = EntityChangeset()
+    for obj in session.new:
+        changeset.add_create(obj)
+    for obj in session.dirty:
+        changeset.add_update(obj)
+    for obj in session.deleted:
+        changeset.add_delete(obj)
+    _unpublished_messages_.setdefault(session, []).extend(changeset.messages())
+    
+@event.listens_for(orm.Session, 'after_commit')
+def publish_committed_changes(session):
+    """Publish the changes of the flushes of a committed transaction on the
+    message bus, other clients can only see them once they are committed"""
+    messages = _unpublished_messages_.pop(session, None)
+    message_bus = _message_bus()
+    if messages and message_bus != None:
+        message_bus.publish(messages)
+        
+@event.listens_for(orm.Session, 'after_rollback')
+def discard_rolled_back_changes(session):
+    """The changes of the flushes of a rolled back transaction are never 
+    seen by other clients"""
+    _unpublished_messages_.pop(session, None)
+
+def _entity_class(entity_name):
+    """:return: the class with a dotted name, or None if it is not imported"""
+    module_name, _sep, class_name = entity_name.rpartition('.')
+    module = sys.modules.get(module_name)
+    if module == None:
+        return None
+    return getattr(module, class_name, None)
+
+def apply_messages(messages):
+    """Expire the objects in the session that were changed by other clients,
+    expunge the objects that were deleted by other clients and load the 
+    objects that were created by other clients.  Objects that are changed or
+    deleted, but are not in the session, are not displayed, so they can be 
+    ignored.  Objects with local changes that were not flushed are neither
+    expired nor expunged, but reported as conflicts in the changeset.
+    
+    :param messages: a list of `(entity, primary_key, change_type)` tuples
+    :return: an :class:`EntityChangeset` with the affected objects
+    """
+    from sqlalchemy.orm.util import identity_key
+    from camelot.core.orm import Session
+    session = Session()
+    changeset = EntityChangeset()
+    deleted_objects = set(session.deleted)
+    for entity_name, primary_key, change_type in messages:
+        entity_type = _entity_class(entity_name)
+        if entity_type == None:
+            continue
+        try:
+            obj = session.identity_map.get(identity_key(entity_type, tuple(primary_key)))
+        except Exception, e:
+            LOGGER.warn('could not find %s %s'%(entity_name, primary_key), exc_info=e)
+            continue
+        if change_type == 'create':
+            if obj == None:
+                # the object is loaded to inform the views of its creation
+                obj = session.query(entity_type).get(tuple(primary_key))
+                if obj != None:
+                    changeset.add_create(obj)
+            continue
+        if obj == None:
+            continue
+        if orm.attributes.instance_state(obj).modified or obj in deleted_objects:
+            # expiring or expunging the object would discard the changes 
+            # that were not flushed yet
+            LOGGER.warn('%s %s was changed by another client, while it has local changes'%(entity_name, primary_key))
+            changeset.conflicts.append(obj)
+            continue
+        if change_type == 'delete':
+            session.expunge(obj)
+            changeset.add_delete(obj)
+        elif change_type == 'update':
+            session.expire(obj)
+            changeset.add_update(obj)
+    return changeset
 
 _signal_handler_ = []
 
@@ -33,6 +33,51 @@ import sqlalchemy.types
 from sqlalchemy import sql, orm, schema
 
 import camelot.types
+from camelot.core import search_index
+
+def _search_columns( admin ):
+    """:return: a tuple `(columns, joins)`, where columns is a list of
+    `( column, joined )` tuples of the columns on which search clauses are
+    build, with joined True if the column is in a joined table, and joins
+    a list of the join entities"""
+    joins = []
+    columns = []
+    if admin.search_all_fields:
+        mapper = orm.class_mapper( admin.entity )
+        for property in mapper.iterate_properties:
+            if isinstance( property, orm.properties.ColumnProperty ):
+                for column in property.columns:
+                    if isinstance( column, schema.Column ):
+                        columns.append( ( column, False ) )
+    for column_name in admin.list_search:
+        path = column_name.split('.')
+        target = admin.entity
+        for path_segment in path:
+            mapper = orm.class_mapper( target )
+            property = mapper.get_property( path_segment )
+            if isinstance(property, orm.properties.PropertyLoader):
+                joins.append(getattr(target, path_segment))
+                target = property.mapper.class_
+            else:
+                columns.append( ( property.columns[0], len(path) > 1 ) )
+    return columns, joins
+
+def create_search_index( admin ):
+    """Create the search index of an admin with a :attr:`list_search_index`
+    in the database, if it does not exist yet.  Creating an index can take
+    a long time and locks the table, so this should be done when the schema
+    is set up or migrated.
+    
+    :return: the created :class:`camelot.core.search_index.SearchIndex`, or
+        None if no index was created
+    """
+    kind = getattr( admin, 'list_search_index', None )
+    if kind == None:
+        return None
+    columns, _joins = _search_columns( admin )
+    return search_index.create_search_index( orm.class_mapper( admin.entity ),
+                                             [ column for column, joined in columns if not joined ],
+                                             kind )
 
 def create_entity_search_query_decorator( admin, text ):
     """create a query decorator to search through a collection of entities
@@ -41,14 +86,24 @@ def create_entity_search_query_decorator( admin, text ):
     :return: a function that can be applied to a query to make the query filter
     only the objects related to the requested text or None if no such decorator
     could be build
+    
+    When the admin has a :attr:`list_search_index`, the text columns covered
+    by the index are matched through the index instead of through `ILIKE`.
     """
     from camelot.view import utils
 
     if len(text.strip()):
         # arguments for the where clause
         args = []
-        # join conditions : list of join entities
-        joins = []
+        # the columns on which search clauses are build and the join 
+        # conditions
+        columns, joins = _search_columns( admin )
+        index = None
+        search_index_kind = getattr( admin, 'list_search_index', None )
+        if search_index_kind != None:
+            index = search_index.get_search_index( orm.class_mapper( admin.entity ),
+                                                   [ column for column, joined in columns if not joined ],
+                                                   search_index_kind )
 
         def append_column( c, text, args ):
             """add column c to the where clause using a clause that
@@ -98,25 +153,14 @@ def create_entity_search_query_decorator( admin, text ):
 
         for t in text.split(' '):
             subexp = []
-            if admin.search_all_fields:
-                mapper = orm.class_mapper( admin.entity )
-                for property in mapper.iterate_properties:
-                    if isinstance( property, orm.properties.ColumnProperty ):
-                        for column in property.columns:
-                            if isinstance( column, schema.Column ):
-                                append_column( column, t, subexp )
-
-            for column_name in admin.list_search:
-                path = column_name.split('.')
-                target = admin.entity
-                for path_segment in path:
-                    mapper = orm.class_mapper( target )
-                    property = mapper.get_property( path_segment )
-                    if isinstance(property, orm.properties.PropertyLoader):
-                        joins.append(getattr(target, path_segment))
-                        target = property.mapper.class_
-                    else:
-                        append_column(property.columns[0], t, subexp)
+            if index != None:
+                arg = index.match( t )
+                if arg is not None:
+                    subexp.append( arg )
+            for column, joined in columns:
+                if index != None and not joined and index.covers( column ):
+                    continue
+                append_column( column, t, subexp )
 
             args.append(subexp)
 
@@ -0,0 +1,44 @@
+"""Micro benchmarks of the collection proxy, these are not part of the test
+suite, since their outcome depends on the load of the machine.  Run them 
+with ::
+
+    python -m unittest benchmark_proxy
+"""
+
+import logging
+import time
+import unittest
+
+from test_proxy import RowExtractorCase
+
+logger = logging.getLogger( 'benchmark_proxy' )
+
+class RowExtractorBenchmark( RowExtractorCase ):
+    """Compare the time needed by the row extractor, specialized once for 
+    the columns, with inspecting the field attributes for each row"""
+    
+    rows = 100000
+    
+    def test_extraction_cost( self ):
+        from camelot.view.proxy.collection_proxy import ( RowExtractor,
+                                                          strip_data_from_object,
+                                                          stripped_data_to_unicode )
+        row_extractor = RowExtractor( self.columns, self.static_field_attributes )
+        start = time.time()
+        for _i in range( self.rows ):
+            row_data = strip_data_from_object( self.row, self.columns )
+            stripped_data_to_unicode( row_data, self.row, 
+                                      self.static_field_attributes,
+                                      self.dynamic_field_attributes )
+        inspecting = time.time() - start
+        start = time.time()
+        for _i in range( self.rows ):
+            row_data = row_extractor.strip( self.row )
+            row_extractor.to_unicode( row_data, self.row, self.dynamic_field_attributes )
+        specialized = time.time() - start
+        logger.info( 'seconds for %i rows of %i columns : %.2f when inspecting field attributes, %.2f specialized',
+                     self.rows, len( self.columns ), inspecting, specialized )
+        self.assertTrue( specialized < inspecting )
+
+if __name__ == '__main__':
+    unittest.main()
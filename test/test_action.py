@@ -234,13 +234,53 @@ class ListActionsCase( ModelThreadTestCase ):
             self.grab_widget( dialog )
             
     def test_export_spreadsheet( self ):
-        import xlrd
+        import zipfile
+        from xml.etree import ElementTree
         export_spreadsheet = list_action.ExportSpreadsheet()
         for step in export_spreadsheet.model_run( self.context ):
             if isinstance( step, action_steps.OpenFile ):
                 # see if the generated file can be parsed
                 filename = step.get_path()
-                xlrd.open_workbook( filename )
+                archive = zipfile.ZipFile( filename )
+                for name in archive.namelist():
+                    if name.endswith( '.xml' ):
+                        ElementTree.fromstring( archive.read( name ) )
+                        
+    def test_export_dynamic_field_attributes( self ):
+        # the number format of a cell uses the precision of its row
+        import zipfile
+        from camelot.admin.object_admin import ObjectAdmin
+        
+        class Payment( object ):
+            
+            def __init__( self, amount, precision ):
+                self.amount = amount
+                self.precision = precision
+                
+        class PaymentAdmin( ObjectAdmin ):
+            list_display = [ 'amount' ]
+            field_attributes = { 'amount': { 'python_type': float,
+                                             'precision': lambda o:o.precision } }
+            
+        context = MockModelContext()
+        context.obj = Payment( 2.5, 1 )
+        context.admin = PaymentAdmin( self.app_admin, Payment )
+        export_spreadsheet = list_action.ExportSpreadsheet()
+        for step in export_spreadsheet.model_run( context ):
+            if isinstance( step, action_steps.OpenFile ):
+                archive = zipfile.ZipFile( step.get_path() )
+                self.assertTrue( 'formatCode="0.0"' in archive.read( 'xl/styles.xml' ) )
+        # the field attributes of the admin are not changed
+        self.assertTrue( callable( context.admin.get_field_attributes( 'amount' )['precision'] ) )
+                        
+    def test_export_csv( self ):
+        import csv
+        export_csv = list_action.ExportSpreadsheet()
+        export_csv.file_format = 'csv'
+        for step in export_csv.model_run( self.context ):
+            if isinstance( step, action_steps.OpenFile ):
+                rows = list( csv.reader( open( step.get_path(), 'rb' ) ) )
+                self.assertEqual( len( rows ), self.context.collection_count + 1 )
 
     def test_import_from_xls_file( self ):
         self.test_import_from_file( 'import_example.xls' )
@@ -336,8 +376,28 @@ class ApplicationActionsCase( ModelThreadTestCase ):
         #
         # refresh the session through the action
         #
-        list( refresh_action.model_run( self.context ) )
+        from sqlalchemy import event
+        engine = session.connection().engine
+        statements = []
+        
+        # with retval, the listener is not wrapped, so it can be removed
+        def count_statement( conn, cursor, statement, parameters, *args ):
+            statements.append( statement )
+            return statement, parameters
+            
+        event.listen( engine, 'before_cursor_execute', count_statement,
+                      retval = True )
+        objects = len( session.identity_map )
+        try:
+            list( refresh_action.model_run( self.context ) )
+        finally:
+            event.remove( engine, 'before_cursor_execute', count_statement )
         self.assertEqual( p2.last_name, 'dirty' )
+        self.assertFalse( p6 in session )
+        self.assertTrue( p1 in session )
+        # the objects are reloaded with a query per mapper, not per object
+        self.assertTrue( objects > 6 )
+        self.assertTrue( len( statements ) < objects )
         
     def test_backup_and_restore( self ):
         backup_action = application_action.Backup()
@@ -61,3 +61,154 @@ class AutoReloadCase( ModelThreadTestCase ):
         pass
         #from camelot.core.auto_reload import auto_reload
         #auto_reload.source_changed( None )
+
+class BackupCase( unittest.TestCase ):
+    
+    def setUp( self ):
+        from sqlalchemy import ( create_engine, MetaData, Table, Column, 
+                                 Integer, Unicode )
+        self.tables = []
+        for _i in range( 2 ):
+            engine = create_engine( 'sqlite:///' )
+            metadata = MetaData()
+            metadata.bind = engine
+            table = Table( 'person', metadata,
+                           Column( 'id', Integer, primary_key = True ),
+                           Column( 'name', Unicode( 50 ) ) )
+            metadata.create_all()
+            self.tables.append( table )
+        self.tables[0].insert().execute( [ dict( name = u'person %s'%i ) for i in range( 25 ) ] )
+        
+    def test_copy_in_batches( self ):
+        from camelot.core.backup import BackupMechanism
+        from_table, to_table = self.tables
+        backup_mechanism = BackupMechanism( 'backup.db' )
+        backup_mechanism.batch_size = 10
+        self.assertEqual( backup_mechanism.count_table_rows( from_table ), 25 )
+        progress = list( backup_mechanism.copy_table_data_in_batches( from_table, to_table ) )
+        self.assertEqual( progress, [ 10, 20, 25 ] )
+        self.assertEqual( backup_mechanism.count_table_rows( to_table ), 25 )
+        # the pragmas of the connection are restored after the bulk load
+        synchronous = to_table.bind.execute( 'PRAGMA synchronous' ).scalar()
+        self.assertNotEqual( synchronous, 0 )
+        
+    def test_copy_text( self ):
+        from camelot.core.backup import _copy_text, _copy_binary
+        self.assertEqual( _copy_text( None ), '\\N' )
+        self.assertEqual( _copy_text( True ), 't' )
+        self.assertEqual( _copy_text( u'a\tb\\c\n' ), 'a\\tb\\\\c\\n' )
+        self.assertEqual( _copy_text( 0.1 ), '0.1' )
+        self.assertEqual( _copy_binary( '\x00\xff' ), '\\\\x00ff' )
+
+class ThumbnailCase( ModelThreadTestCase ):
+    
+    def setUp( self ):
+        super( ThumbnailCase, self ).setUp()
+        import tempfile
+        from PyQt4 import QtGui
+        from camelot.core.files.storage import Storage, StoredImage
+        self.storage = Storage( root = tempfile.mkdtemp() )
+        self.storage.available()
+        image = QtGui.QImage( 400, 300, QtGui.QImage.Format_RGB32 )
+        image.fill( 0 )
+        self.names = []
+        for i in range( 3 ):
+            name = 'image_%s.png'%i
+            image.save( self.storage.path( name ) )
+            self.names.append( name )
+        self.image = StoredImage( self.storage, self.names[0] )
+        
+    def test_thumbnail_cache( self ):
+        from camelot.core.files.storage import StoredImage
+        self.assertFalse( self.image.thumbnail_cached( 100, 100 ) )
+        thumbnail = self.image.checkout_thumbnail( 100, 100 )
+        self.assertEqual( thumbnail.width(), 100 )
+        # a reloaded object finds the thumbnail in the cache
+        reloaded_image = StoredImage( self.storage, self.names[0] )
+        self.assertTrue( reloaded_image.thumbnail_cached( 100, 100 ) )
+        self.assertEqual( reloaded_image.checkout_thumbnail_in_background( 100, 100 ).width(), 100 )
+        self.assertFalse( reloaded_image.thumbnail_cached( 50, 50 ) )
+        
+    def test_eviction( self ):
+        from camelot.core.files.storage import StoredImage
+        thumbnail_cache = self.storage.thumbnail_cache
+        for name in self.names:
+            StoredImage( self.storage, name ).checkout_thumbnail( 100, 100 )
+        sizes = [ size for _t, size, _p in thumbnail_cache._thumbnails() ]
+        self.assertEqual( len( sizes ), 3 )
+        thumbnail_cache.max_size = sum( sizes ) - 1
+        StoredImage( self.storage, self.names[0] ).checkout_thumbnail( 50, 50 )
+        self.assertTrue( len( thumbnail_cache._thumbnails() ) < 4 )
+        self.assertTrue( thumbnail_cache._size <= thumbnail_cache.max_size )
+        
+    def test_background_generation( self ):
+        import threading
+        ready = threading.Event()
+        thumbnail = self.image.checkout_thumbnail_in_background( 80, 80, ready.set )
+        self.assertEqual( thumbnail, None )
+        ready.wait( 10 )
+        self.assertTrue( ready.is_set() )
+        self.assertEqual( self.image.checkout_thumbnail_in_background( 80, 80 ).width(), 80 )
+        
+    def test_storage_without_cache( self ):
+        # the original image is not checked out in the model thread, when
+        # the storage has no thumbnail cache, such as a remote storage
+        import threading
+        from camelot.core.files.storage import Storage, StoredImage
+        
+        class UncachedStorage( Storage ):
+            thumbnail_cache = None
+            
+        storage = UncachedStorage( root = self.storage._root )
+        image = StoredImage( storage, self.names[1] )
+        ready = threading.Event()
+        self.assertEqual( image.checkout_thumbnail_in_background( 80, 80, ready.set ), None )
+        ready.wait( 10 )
+        self.assertTrue( ready.is_set() )
+        self.assertEqual( image.checkout_thumbnail_in_background( 80, 80 ).width(), 80 )
+
+class ContentAddressedStorageCase( unittest.TestCase ):
+    
+    def setUp( self ):
+        import os
+        import tempfile
+        from camelot.core.files.storage import ContentAddressedStorage
+        self.folder = tempfile.mkdtemp()
+        self.storage = ContentAddressedStorage( 'documents', root = self.folder )
+        self.path = os.path.join( self.folder, 'document.txt' )
+        with open( self.path, 'wb' ) as document:
+            document.write( 'content' * 1000 )
+            
+    def test_deduplicate( self ):
+        import StringIO
+        stored_file = self.storage.checkin( self.path )
+        self.assertEqual( stored_file.name.count( '/' ), 2 )
+        self.assertTrue( stored_file.name.endswith( '.txt' ) )
+        stream = StringIO.StringIO( 'content' * 1000 )
+        self.assertEqual( self.storage.checkin_stream( 'copy', '.txt', stream ).name,
+                          stored_file.name )
+        self.assertEqual( [ f.name for f in self.storage.list() ], [ stored_file.name ] )
+        self.assertEqual( self.storage.checkout_stream( stored_file ).read(), 'content' * 1000 )
+        
+class HttpStorageCase( ContentAddressedStorageCase ):
+    
+    def setUp( self ):
+        import tempfile
+        from camelot.core.files.http_storage import HttpStorage, ObjectServer
+        super( HttpStorageCase, self ).setUp()
+        self.server = ObjectServer( tempfile.mkdtemp() )
+        self.server.start()
+        self.storage = HttpStorage( 'documents', 
+                                    url = self.server.url + 'bucket',
+                                    cache = tempfile.mkdtemp() )
+        
+    def tearDown( self ):
+        self.server.stop()
+        
+    def test_checkout( self ):
+        self.assertTrue( self.storage.available() )
+        stored_file = self.storage.checkin( self.path )
+        self.assertTrue( self.storage.exists( stored_file.name ) )
+        self.assertFalse( self.storage.exists( 'document.txt' ) )
+        with open( self.storage.checkout( stored_file ), 'rb' ) as document:
+            self.assertEqual( document.read(), 'content' * 1000 )
@@ -0,0 +1,154 @@
+import unittest
+
+from camelot.test import get_application
+
+class SignalSlotModelThreadCase( unittest.TestCase ):
+    """Test the queue of the SignalSlotModelThread, without starting the
+    thread"""
+    
+    def setUp( self ):
+        from camelot.view.model_thread.signal_slot_model_thread import SignalSlotModelThread
+        self.app = get_application()
+        self.model_thread = SignalSlotModelThread( setup_thread = lambda:None )
+        
+    def request( self ):
+        pass
+    
+    def test_coalesce_requests( self ):
+        for _i in range( 3 ):
+            self.model_thread.post( self.request, key = 'request' )
+        self.model_thread.post( self.request )
+        self.assertEqual( len( self.model_thread._request_queue ), 2 )
+        # once the task is taken from the queue, a new one should be queued
+        self.assertTrue( self.model_thread.pop() )
+        self.model_thread.post( self.request, key = 'request' )
+        self.assertEqual( len( self.model_thread._request_queue ), 2 )
+        
+    def test_priorities( self ):
+        from camelot.view.model_thread import INTERACTIVE, BACKGROUND
+        for priority in ( BACKGROUND, None, INTERACTIVE ):
+            if priority == None:
+                self.model_thread.post( self.request )
+            else:
+                self.model_thread.post( self.request, priority = priority )
+        popped = [ self.model_thread.pop().priority for _i in range( 3 ) ]
+        self.assertEqual( popped, sorted( popped ) )
+        self.assertEqual( self.model_thread.pop(), None )
+        wait_times = self.model_thread.queue_wait_times()
+        self.assertEqual( wait_times[INTERACTIVE][0], 1 )
+        self.assertEqual( wait_times[BACKGROUND][0], 1 )
+        
+    def test_cancel( self ):
+        from PyQt4 import QtCore
+        import sip
+        deleted_owner, cancelled_owner = QtCore.QObject(), QtCore.QObject()
+        self.model_thread.post( self.request, owner = deleted_owner )
+        self.model_thread.post( self.request, key = 'request', 
+                                owner = cancelled_owner )
+        self.model_thread.post( self.request )
+        sip.delete( deleted_owner )
+        self.model_thread.cancel( cancelled_owner )
+        self.assertEqual( len( self.model_thread._request_queue ), 2 )
+        self.assertEqual( self.model_thread.pop().owner, None )
+        self.assertEqual( self.model_thread.pop(), None )
+        # the key of a cancelled request is released
+        self.model_thread.post( self.request, key = 'request' )
+        self.assertEqual( len( self.model_thread._request_queue ), 1 )
+
+class ModelThreadPoolCase( unittest.TestCase ):
+    """Test the distribution of requests over the threads of a 
+    ModelThreadPool, without starting the threads"""
+    
+    def setUp( self ):
+        from camelot.view.model_thread.model_thread_pool import ModelThreadPool
+        self.app = get_application()
+        self.model_thread = ModelThreadPool( setup_thread = lambda:None,
+                                             workers = 2 )
+        
+    def request( self ):
+        pass
+    
+    def test_distribute_requests( self ):
+        primary = self.model_thread
+        first, second = self.model_thread._workers
+        # requests that might modify the model go to the primary thread
+        primary.post( self.request )
+        self.assertEqual( len( primary._request_queue ), 1 )
+        # read only requests are spread over the workers
+        primary.post( self.request, read_only = True )
+        primary.post( self.request, read_only = True )
+        self.assertEqual( len( primary._request_queue ), 1 )
+        self.assertEqual( len( first._request_queue ), 1 )
+        self.assertEqual( len( second._request_queue ), 1 )
+        # read only requests with the same key are coalesced
+        for _i in range( 3 ):
+            primary.post( self.request, key = 'request', read_only = True )
+        self.assertEqual( len( first._request_queue ) + 
+                          len( second._request_queue ), 3 )
+        
+    def test_owns_thread( self ):
+        from PyQt4 import QtCore
+        for worker in self.model_thread._workers:
+            self.assertTrue( self.model_thread.owns_thread( worker ) )
+        self.assertTrue( self.model_thread.owns_thread( self.model_thread ) )
+        self.assertFalse( self.model_thread.owns_thread( QtCore.QThread.currentThread() ) )
+
+class TaskMetricsCase( unittest.TestCase ):
+    
+    def setUp( self ):
+        from camelot.view.model_thread.metrics import TaskMetrics
+        self.app = get_application()
+        self.metrics = TaskMetrics( window = 10.0 )
+        
+    def test_record( self ):
+        self.metrics.record( 'request', 0.5, 1.0 )
+        self.metrics.record( 'request', 1.5, 2.0 )
+        tasks = self.metrics.tasks()
+        self.assertEqual( tasks['request']['number'], 2 )
+        self.assertAlmostEqual( tasks['request']['total_wait'], 2.0 )
+        self.assertAlmostEqual( tasks['request']['max_execution'], 2.0 )
+        self.assertAlmostEqual( self.metrics.busy_ratio(), 0.3 )
+        
+    def test_slow_task( self ):
+        import logging
+        
+        class RecordingHandler( logging.Handler ):
+            records = []
+            def emit( self, record ):
+                self.records.append( record )
+        
+        def post():
+            # the stack is taken in the post method
+            return self.metrics.posting_stack()
+        
+        handler = RecordingHandler()
+        logger = logging.getLogger( 'camelot.view.model_thread.metrics' )
+        logger.addHandler( handler )
+        try:
+            self.assertEqual( post(), None )
+            self.metrics.slow_task_threshold = 0.1
+            stack = post()
+            self.metrics.record( 'fast', 0.0, 0.01, stack )
+            self.assertEqual( len( handler.records ), 0 )
+            self.metrics.record( 'slow', 0.0, 0.2, stack )
+            self.assertEqual( len( handler.records ), 1 )
+            self.assertTrue( 'test_slow_task' in handler.records[0].getMessage() )
+        finally:
+            logger.removeHandler( handler )
+        
+    def test_export( self ):
+        import json
+        import os
+        import tempfile
+        from camelot.view.model_thread.metrics import MetricsExporter
+        from camelot.view.model_thread.signal_slot_model_thread import SignalSlotModelThread
+        model_thread = SignalSlotModelThread( setup_thread = lambda:None )
+        model_thread.post( lambda:None )
+        filename = os.path.join( tempfile.mkdtemp(), 'metrics.json' )
+        exporter = MetricsExporter( model_thread, filename, max_bytes = 1000 )
+        for _i in range( 10 ):
+            exporter.export()
+        self.assertTrue( os.path.exists( filename + '.1' ) )
+        with open( filename ) as metrics_file:
+            for line in metrics_file:
+                self.assertEqual( json.loads( line )['queue_depth'], 1 )
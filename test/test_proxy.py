@@ -1,9 +1,243 @@
+import time
+import unittest
+
 from PyQt4.QtCore import Qt
 from PyQt4 import QtCore
 
 from camelot.core.utils import variant_to_pyobject
 from camelot.test import ModelThreadTestCase
 
+class FifoCase( unittest.TestCase ):
+    """Test the cache used by the collection proxy"""
+    
+    def test_lru( self ):
+        from camelot.view.fifo import Fifo
+        fifo = Fifo( 3 )
+        for row, entity in enumerate( ['a', 'b', 'c'] ):
+            fifo.add_data( row, entity, [row] )
+        # reading row 0 makes 'b' the least recently used entity
+        self.assertEqual( fifo.get_data_at_row( 0 ), [0] )
+        fifo.add_data( 3, 'd', [3] )
+        self.assertEqual( len( fifo ), 3 )
+        self.assertFalse( fifo.has_data_at_row( 1 ) )
+        self.assertRaises( KeyError, fifo.get_row_by_entity, 'b' )
+        self.assertEqual( fifo.get_row_by_entity( 'a' ), 0 )
+        # moving an entity to another row removes it from its previous row
+        fifo.add_data( 5, 'a', [5] )
+        self.assertFalse( fifo.has_data_at_row( 0 ) )
+        self.assertEqual( fifo.get_entity_at_row( 5 ), 'a' )
+        # putting an entity in an occupied row removes the previous entity
+        fifo.add_data( 5, 'e', [5] )
+        self.assertRaises( KeyError, fifo.get_row_by_entity, 'a' )
+        self.assertEqual( fifo.delete_by_entity( 'e' ), 5 )
+        self.assertEqual( fifo.delete_by_entity( 'e' ), None )
+        # a shallow copy keeps the rows, but not the data
+        copied_fifo = fifo.shallow_copy( 10 )
+        self.assertEqual( copied_fifo.get_entity_at_row( 3 ), 'd' )
+        self.assertFalse( copied_fifo.has_data_at_row( 3 ) )
+        
+    def test_remove_rows( self ):
+        from camelot.view.fifo import Fifo
+        fifo = Fifo( 10 )
+        for row, entity in enumerate( ['a', 'b', 'c', 'd', 'e'] ):
+            fifo.add_data( row, entity, [row] )
+        fifo.remove_rows( [1, 3, 7] )
+        self.assertEqual( len( fifo ), 3 )
+        self.assertEqual( [ fifo.get_entity_at_row( row ) for row in range( 3 ) ],
+                          ['a', 'c', 'e'] )
+        self.assertEqual( fifo.get_row_by_entity( 'e' ), 2 )
+        self.assertEqual( fifo.get_data_at_row( 1 ), [2] )
+        self.assertFalse( fifo.has_data_at_row( 3 ) )
+        
+    def test_fill_cost( self ):
+        # the cost of filling the cache while scrolling should not depend
+        # on the size of the cache, the cost is measured as the number of
+        # times an entity is hashed or compared
+        from camelot.view.fifo import Fifo
+        
+        operations = []
+        
+        class Entity( object ):
+            
+            def __hash__( self ):
+                operations.append( self )
+                return id( self )
+            
+            def __eq__( self, other ):
+                operations.append( self )
+                return self is other
+        
+        def fill_cost( max_entries, rows = 20000 ):
+            del operations[:]
+            fifo = Fifo( max_entries )
+            for row in range( rows ):
+                fifo.add_data( row, Entity(), [row] )
+                fifo.has_data_at_row( row - max_entries // 2 )
+                fifo.get_data_at_row( row )
+            return len( operations )
+        
+        small_cache = fill_cost( 100 )
+        large_cache = fill_cost( 10000 )
+        self.assertTrue( large_cache <= small_cache )
+        self.assertTrue( small_cache < 20000 * 10 )
+
+    def test_row_data_memory( self ):
+        # a row in the cache stores its edit, display and attribute data
+        # in slots, without the overhead of a dictionary per row
+        import sys
+        import logging
+        from camelot.view.proxy.collection_proxy import RowData
+        
+        class DictRowData( object ):
+        
+            def __init__( self, edit, display, attributes ):
+                self.edit = edit
+                self.display = display
+                self.attributes = attributes
+        
+        columns = 40
+        edit = [None] * columns
+        display = [u''] * columns
+        attributes = [{}] * columns
+        
+        row_data = RowData( edit, display, attributes )
+        dict_row_data = DictRowData( edit, display, attributes )
+        self.assertFalse( hasattr( row_data, '__dict__' ) )
+        slots_size = sys.getsizeof( row_data )
+        dict_size = sys.getsizeof( dict_row_data ) + sys.getsizeof( dict_row_data.__dict__ )
+        logging.getLogger( 'test_proxy' ).info( 'bytes per row : %i with slots, %i with a dictionary',
+                                                slots_size, dict_size )
+        self.assertTrue( slots_size < dict_size )
+
+class RowExtractorCase( ModelThreadTestCase ):
+    """Compare the row extractor, specialized once for the columns, with 
+    inspecting the field attributes for each row"""
+    
+    def setUp( self ):
+        super( RowExtractorCase, self ).setUp()
+        import datetime
+        
+        class Row( object ):
+            pass
+        
+        self.columns, self.static_field_attributes, self.dynamic_field_attributes = [], [], []
+        values = [ u'text', 5, 3.5, datetime.date( 2012, 3, 4 ), 
+                   datetime.datetime( 2012, 3, 4, 5, 6 ), None, 'b' ]
+        row = Row()
+        for i in range( 20 ):
+            field_name = 'field_%i'%i
+            value = values[ i % len( values ) ]
+            setattr( row, field_name, value )
+            attributes = dict( name = field_name, 
+                               python_type = type( value ),
+                               getter = lambda o, field_name = field_name:getattr( o, field_name ) )
+            if value == 'b':
+                attributes['choices'] = [ ( chr( c ), unicode( c ) ) for c in range( ord( 'a' ), ord( 'z' ) ) ]
+            if i == 1:
+                attributes['unicode_format'] = lambda value:u'%i %%'%value
+            self.columns.append( ( field_name, attributes ) )
+            self.static_field_attributes.append( attributes )
+            self.dynamic_field_attributes.append( dict() )
+        self.row = row
+        
+    def test_extraction( self ):
+        # the specialized row extractor returns the same data as inspecting
+        # the field attributes for each row, its cost is compared in
+        # benchmark_proxy
+        from camelot.view.proxy.collection_proxy import ( RowExtractor,
+                                                          strip_data_from_object,
+                                                          stripped_data_to_unicode )
+        row_extractor = RowExtractor( self.columns, self.static_field_attributes )
+        expected_data = strip_data_from_object( self.row, self.columns )
+        expected_unicode = stripped_data_to_unicode( expected_data, self.row, 
+                                                     self.static_field_attributes,
+                                                     self.dynamic_field_attributes )
+        self.assertEqual( row_extractor.strip( self.row ), expected_data )
+        self.assertEqual( row_extractor.to_unicode( expected_data, self.row, self.dynamic_field_attributes ),
+                          expected_unicode )
+
+class ReadAheadCase( unittest.TestCase ):
+    """Replay scroll traces against an SQLite table, to compare the read 
+    ahead scheduler with fetching the first continuous range of requested 
+    rows"""
+    
+    rows = 10000
+    viewport = 20
+    
+    def setUp( self ):
+        import sqlite3
+        self.connection = sqlite3.connect( ':memory:' )
+        self.connection.execute( 'create table t ( id integer primary key, name text )' )
+        self.connection.executemany( 'insert into t ( name ) values ( ? )',
+                                     ( ( 'row %i'%i, ) for i in range( self.rows ) ) )
+        
+    def tearDown( self ):
+        self.connection.close()
+        
+    def _replay( self, trace, get_batches ):
+        """Replay a trace of the first visible row of the view
+        
+        :param get_batches: a function that takes the requested rows and the
+            cache and returns a list of `(offset, limit, rows)` tuples with
+            the ranges to query and the rows to put in the cache
+        :return: a tuple with the number of queries and the time needed
+        """
+        from camelot.view.fifo import Fifo
+        cache = Fifo( 10 * self.viewport )
+        queries = 0
+        start = time.time()
+        for top in trace:
+            visible_rows = range( top, min( top + self.viewport, self.rows ) )
+            requested = set( row for row in visible_rows if not cache.has_data_at_row( row ) )
+            while requested:
+                for offset, limit, rows in get_batches( requested, cache ):
+                    queries += 1
+                    result = self.connection.execute( 'select id, name from t order by id limit ? offset ?', 
+                                                      ( limit, offset ) )
+                    for i, ( primary_key, name ) in enumerate( result ):
+                        if offset + i in rows:
+                            cache.add_data( offset + i, primary_key, name )
+                requested = set( row for row in requested if not cache.has_data_at_row( row ) )
+        return queries, time.time() - start
+    
+    def test_scroll_traces( self ):
+        import logging
+        from camelot.view.proxy.read_ahead import ReadAhead
+        
+        def first_continuous_range( requested, cache ):
+            rows = sorted( requested )
+            limit = 1
+            while limit < len( rows ) and rows[limit] == rows[0] + limit:
+                limit += 1
+            return [ ( rows[0], limit, set( rows[:limit] ) ) ]
+        
+        traces = { 'scroll down' : range( 0, 3000, 3 ),
+                   'fast scroll down' : range( 0, 9000, 15 ),
+                   'jump and scroll up' : [ 9000 ] + range( 5000, 3000, -3 ), }
+        for name, trace in traces.items():
+            read_ahead = ReadAhead( self.viewport )
+            
+            def read_ahead_batches( requested, cache ):
+                ranges = read_ahead.ranges( requested, self.rows, cache.has_data_at_row )
+                return read_ahead.batches( ranges )
+            
+            continuous_queries, continuous_time = self._replay( trace, first_continuous_range )
+            read_ahead_queries, read_ahead_time = self._replay( trace, read_ahead_batches )
+            logging.getLogger( 'test_proxy' ).info( '%s : %i queries in %.3fs without, %i queries in %.3fs with read ahead',
+                                                    name, continuous_queries, continuous_time, 
+                                                    read_ahead_queries, read_ahead_time )
+            self.assertTrue( read_ahead_queries * 2 < continuous_queries )
+            
+    def test_batches( self ):
+        # ranges near each other are fetched with a single query, without
+        # putting the rows in between in the cache again
+        from camelot.view.proxy.read_ahead import ReadAhead
+        read_ahead = ReadAhead( self.viewport )
+        batches = read_ahead.batches( [ ( 0, 10 ), ( 50, 10 ), ( 5000, 10 ) ] )
+        self.assertEqual( [ ( offset, limit ) for offset, limit, _rows in batches ],
+                          [ ( 0, 60 ), ( 5000, 10 ) ] )
+        self.assertEqual( batches[0][2], set( range( 0, 10 ) + range( 50, 60 ) ) )
+
 class QueryProxyCase( ModelThreadTestCase ):
     """Test the functionality of the QueryProxy to perform CRUD operations on 
     stand alone data"""
@@ -101,3 +335,309 @@ class QueryProxyCase( ModelThreadTestCase ):
         self.assertTrue( self.person_proxy._get_object( rows - 1 ) )        
         self.assertFalse( self.person_proxy._get_object( rows ) )
         self.assertFalse( self.person_proxy._get_object( rows + 1 ) )
+
+    def test_dynamic_field_attributes_batch( self ):
+        # the dynamic field attributes of a window of rows are requested at 
+        # once
+        batches = []
+        original_batch = self.person_admin.get_dynamic_field_attributes_batch
+        
+        def get_dynamic_field_attributes_batch( objects, field_names ):
+            batches.append( len( objects ) )
+            return original_batch( objects, field_names )
+        
+        self.person_admin.get_dynamic_field_attributes_batch = get_dynamic_field_attributes_batch
+        try:
+            self._load_data()
+        finally:
+            del self.person_admin.get_dynamic_field_attributes_batch
+        self.assertTrue( self.person_proxy.rowCount() > 1 )
+        self.assertTrue( max( batches ) > 1 )
+        field_names = [ 'first_name', 'last_name' ]
+        persons = [ self.person_proxy._get_object( row ) for row in range( 2 ) ]
+        self.assertEqual( self.person_admin.get_dynamic_field_attributes_batch( persons, field_names ),
+                          [ list( self.person_admin.get_dynamic_field_attributes( person, field_names ) ) for person in persons ] )
+        
+    def test_sort_columns( self ):
+        from camelot.model.party import Person
+        from camelot.view.proxy.collection_proxy import CollectionProxy
+        persons = [ Person( first_name = u'B', last_name = u'X' ),
+                    Person( first_name = u'A', last_name = None ),
+                    Person( first_name = u'A', last_name = u'Y' ) ]
+        proxy = CollectionProxy( self.person_admin, lambda:persons,
+                                 self.person_admin.get_columns )
+        self.process()
+        # sort on the first name, and on the last name for equal first names
+        proxy.sort_columns( [ ( 0, Qt.AscendingOrder ),
+                              ( 1, Qt.DescendingOrder ) ] )
+        self.process()
+        self.assertEqual( [ proxy._get_object( row ) for row in range( 3 ) ],
+                          [ persons[2], persons[1], persons[0] ] )
+        # clicking a header sorts by that column only
+        proxy.sort( 0, Qt.AscendingOrder )
+        self.assertEqual( proxy._sort_columns, [ ( 0, Qt.AscendingOrder ) ] )
+        # None values are sorted before other values
+        proxy.sort_columns( [ ( 1, Qt.AscendingOrder ) ] )
+        self.process()
+        self.assertEqual( proxy._get_object( 0 ), persons[1] )
+        # column properties can be sorted in sql
+        from camelot.view.proxy.queryproxy import _sort_expression
+        expression, _join = _sort_expression( self.person_admin.mapper, Person,
+                                               'contact_mechanisms_email' )
+        self.assertNotEqual( expression, None )
+        # sort in sql on multiple columns
+        self.person_proxy.sort_columns( [ ( 0, Qt.AscendingOrder ),
+                                          ( 1, Qt.DescendingOrder ) ] )
+        self.process()
+        self._load_data()
+        rows = [ ( self._data( row, 0 ), self._data( row, 1 ) ) for row in range( self.person_proxy.rowCount() ) ]
+        for row, next_row in zip( rows[:-1], rows[1:] ):
+            self.assertTrue( row[0] < next_row[0] or ( row[0] == next_row[0] and row[1] >= next_row[1] ) )
+        
+    def test_get_objects( self ):
+        from camelot.admin.action.list_action import ListActionModelContext
+        rows = self.person_proxy.rowCount()
+        self.assertTrue( rows > 2 )
+        expected = [ self.person_proxy._get_object( row ) for row in range( rows ) ]
+        # query in batches smaller than the number of rows
+        self.assertEqual( list( self.person_proxy._get_objects( 0, None, 2 ) ), expected )
+        self.assertEqual( list( self.person_proxy._get_objects( 1, None, 2 ) ), expected[1:] )
+        self.assertEqual( list( self.person_proxy._get_objects( 1, rows - 1, 2 ) ), expected[1:] )
+        self.assertEqual( list( self.person_proxy._get_objects( 1, rows + 5 ) ), expected[1:] )
+        model_context = ListActionModelContext()
+        model_context._model = self.person_proxy
+        model_context.collection_count = rows
+        model_context.selection_count = 2
+        model_context.selected_rows = [ ( 0, 0 ), ( 2, 2 ) ]
+        self.assertEqual( list( model_context.get_selection( yield_per = 1 ) ),
+                          [ expected[0], expected[2] ] )
+        self.assertEqual( list( model_context.get_collection( yield_per = 2 ) ),
+                          expected )
+        
+    def test_eager_load_plan( self ):
+        from sqlalchemy import event
+        from camelot.core.orm import Session
+        from camelot_example.model import Movie
+        from camelot.view.proxy.queryproxy import QueryTableProxy
+        movie_admin = self.app_admin.get_related_admin( Movie )
+        field_names = [ 'title', 'director', 'tags' ]
+        # the plan is cached per admin and set of columns
+        options = movie_admin.get_loader_options( field_names )
+        self.assertEqual( len( options ), 2 )
+        self.assertTrue( movie_admin.get_loader_options( field_names ) is options )
+        # the email and phone columns used by the contact mechanisms
+        self.assertEqual( len( self.person_admin.get_loader_options( [ 'first_name', 'contact_mechanisms_email' ] ) ), 2 )
+        movie_proxy = QueryTableProxy( movie_admin, 
+                                       query_getter = lambda:Movie.query, 
+                                       columns_getter = lambda:[ ( field_name, movie_admin.get_field_attributes( field_name ) ) for field_name in field_names ] )
+        rows = movie_proxy.rowCount()
+        self.assertTrue( rows > 2 )
+        session = Session()
+        engine = session.connection().engine
+        statements = []
+        
+        # with retval, the listener is not wrapped, so it can be removed
+        def count_statement( conn, cursor, statement, parameters, *args ):
+            statements.append( statement )
+            return statement, parameters
+            
+        event.listen( engine, 'before_cursor_execute', count_statement,
+                      retval = True )
+        try:
+            # the number of queries for a page does not depend on the
+            # number of rows in the page
+            for page_size in ( 1, rows ):
+                session.expire_all()
+                del statements[:]
+                movie_proxy.cache = movie_proxy.cache.shallow_copy( 0 )
+                for row in range( page_size ):
+                    self._data( row, 1, movie_proxy )
+                    self._data( row, 2, movie_proxy )
+                self.process()
+                self.assertEqual( self._data( 0, 1, movie_proxy ), 
+                                  unicode( movie_proxy._get_object( 0 ).director ) )
+                # one query for the movies and their director, one for the tags
+                self.assertEqual( len( statements ), 2 )
+        finally:
+            event.remove( engine, 'before_cursor_execute', count_statement )
+        
+    def test_keyset_pagination( self ):
+        from camelot.view.proxy.queryproxy import QueryTableProxy
+        from camelot.model.party import Person
+        self.person_proxy.sort( 1, Qt.DescendingOrder )
+        self._load_data()
+        rows = self.person_proxy.rowCount()
+        expected = [ self._data( row, 1 ) for row in range( rows ) ]
+        self.person_admin.list_pagination = 'keyset'
+        try:
+            keyset_proxy = QueryTableProxy( self.person_admin, 
+                                            query_getter = lambda:Person.query, 
+                                            columns_getter = self.person_admin.get_columns,
+                                            max_number_of_rows = 2 )
+            keyset_proxy.sort( 1, Qt.DescendingOrder )
+            self.process()
+            # first jump to the end, and then scroll back and forward
+            for row in range( rows - 1, -1, -1 ) + range( rows ):
+                self._data( row, 1, keyset_proxy )
+                self.process()
+                self.assertEqual( self._data( row, 1, keyset_proxy ), expected[row] )
+                keyset_proxy.cache.delete_by_row( row )
+            self.assertEqual( keyset_proxy._get_object( rows - 1 ), 
+                              self.person_proxy._get_object( rows - 1 ) )
+        finally:
+            del self.person_admin.list_pagination
+        # seeking is not possible when a sort column can be NULL
+        from sqlalchemy import orm
+        from camelot.view.proxy.queryproxy import _nullable
+        mapper = orm.class_mapper( Person )
+        self.assertFalse( _nullable( mapper, Person.last_name ) )
+        self.assertTrue( _nullable( mapper, Person.middle_name ) )
+
+    def test_row_count_cache( self ):
+        from camelot.model.party import Person
+        from camelot.view.proxy.row_count import row_count_cache
+        rows = self.person_proxy.getRowCount()
+        query = self.person_proxy.get_query_getter()()
+        self.assertEqual( row_count_cache.get( query ), rows )
+        # a flush inserting a row invalidates the count
+        person = Person( first_name = u'Row', last_name = u'Count' )
+        self.person_admin.flush( person )
+        self.assertEqual( row_count_cache.get( query ), None )
+        self.assertEqual( self.person_proxy.getRowCount(), rows + 1 )
+        # counts expire
+        ttl, row_count_cache.ttl = row_count_cache.ttl, -1
+        try:
+            self.assertEqual( row_count_cache.get( query ), None )
+        finally:
+            row_count_cache.ttl = ttl
+        # estimates are not available on sqlite, so rows are counted
+        self.person_admin.list_count = 'estimated'
+        try:
+            self.assertEqual( self.person_proxy.getRowCount(), rows + 1 )
+        finally:
+            del self.person_admin.list_count
+
+    def test_edit_latency( self ):
+        # editing a single cell should not wait for other edits to arrive,
+        # the edits waiting in the queue are handled by a single task
+        self._load_data()
+        handle_update_requests = self.person_proxy._handle_update_requests
+        handled = []
+        
+        def count_update_requests():
+            handled.append( len( self.person_proxy._update_requests ) )
+            return handle_update_requests()
+            
+        self.person_proxy._handle_update_requests = count_update_requests
+        try:
+            self._set_data( 0, 0, u'Latency' )
+            self.process()
+            self.assertEqual( handled, [ 1 ] )
+            self.assertEqual( self.person_proxy._update_requests, [] )
+            self.assertEqual( self._data( 0, 0 ), u'Latency' )
+            # edits posted while the task waits are taken by the same task
+            self.person_proxy._update_requests.append( ( True, 1, 0, lambda:u'Coalesced' ) )
+            self.person_proxy.unflushed_rows.add( 1 )
+            self._set_data( 2, 0, u'Latency' )
+            self.process()
+            self.assertEqual( handled, [ 1, 2 ] )
+            self.assertEqual( self._data( 1, 0 ), u'Coalesced' )
+            self.assertEqual( self._data( 2, 0 ), u'Latency' )
+        finally:
+            del self.person_proxy._handle_update_requests
+
+    def test_edit_changeset( self ):
+        # the changes of an edit are sent to the other views as a single
+        # changeset
+        self._load_data()
+        changesets = []
+        collect_changeset = lambda sender, changeset:changesets.append( changeset )
+        signal_handler = self.person_proxy.rsh
+        signal_handler.entity_changes_signal.connect( collect_changeset )
+        try:
+            self._set_data( 0, 0, u'Changeset' )
+            self.process()
+        finally:
+            signal_handler.entity_changes_signal.disconnect( collect_changeset )
+        self.assertEqual( len( changesets ), 1 )
+        self.assertTrue( self.person_proxy._get_object( 0 ) in list( changesets[0].updated_entities() ) )
+
+    def test_entity_changes( self ):
+        # all changes of a flush are handled by the proxy at once
+        from camelot.view.remote_signals import EntityChangeset
+        self._load_data()
+        persons = [ self.person_proxy._get_object( row ) for row in range( 3 ) ]
+        changeset = EntityChangeset()
+        for i, person in enumerate( persons ):
+            person.first_name = u'Changed %i'%i
+            changeset.add_update( person )
+            changeset.add_update( person )
+        self.assertEqual( len( changeset ), 3 )
+        self.assertEqual( len( changeset.updated[ type( persons[0] ) ] ), 3 )
+        changed_ranges = []
+        self.person_proxy.dataChanged.connect( lambda top_left, bottom_right:changed_ranges.append( ( top_left.row(), bottom_right.row() ) ) )
+        self.person_proxy.handle_entity_changes( None, changeset )
+        self.process()
+        self.assertEqual( changed_ranges, [ ( 0, 2 ) ] )
+        for i in range( 3 ):
+            self.assertEqual( self._data( i, 0 ), u'Changed %i'%i )
+        # a deleted entity is no longer considered changed
+        changeset.add_delete( persons[0] )
+        self.assertEqual( len( list( changeset.updated_entities() ) ), 2 )
+        self.assertEqual( list( changeset.deleted_entities() ), [ persons[0] ] )
+
+    def test_remove_rows( self ):
+        # removing a cached row shifts the cache instead of reloading it
+        from camelot.model.party import Person
+        person = Person( first_name = u'Remove', last_name = u'Me' )
+        self.person_admin.flush( person )
+        self.person_proxy.refresh()
+        self.process()
+        self._load_data()
+        rows = self.person_proxy.rowCount()
+        row = self.person_proxy.cache.get_row_by_entity( person )
+        self.assertTrue( row > 0 )
+        previous_data = self._data( row - 1, 0 )
+        counts = []
+        original_get_row_count = self.person_proxy.getRowCount
+        self.person_proxy.getRowCount = lambda:counts.append( True ) or original_get_row_count()
+        try:
+            self.person_proxy.remove_rows( [row] )
+            self.process()
+        finally:
+            del self.person_proxy.getRowCount
+        self.assertEqual( counts, [] )
+        self.assertEqual( self.person_proxy.rowCount(), rows - 1 )
+        self.assertRaises( KeyError, self.person_proxy.cache.get_row_by_entity, person )
+        self.assertTrue( self.person_proxy.cache.has_data_at_row( row - 1 ) )
+        self.assertEqual( self._data( row - 1, 0 ), previous_data )
+
+    def test_relationship_collection( self ):
+        # the related objects of a persistent object are counted and read
+        # in pages without loading the collection
+        from camelot.core.orm import Session
+        from camelot_example.model import Movie, Tag
+        from camelot.view.proxy.collection_proxy import ( CollectionProxy,
+                                                          RelationshipCollectionGetter )
+        session = Session()
+        movie = Movie.query.first()
+        for i in range( 5 ):
+            movie.tags.append( Tag( name = u'tag %i'%i ) )
+        session.flush()
+        tags = len( movie.tags )
+        session.expire( movie, ['tags'] )
+        tag_admin = self.app_admin.get_related_admin( Tag )
+        tag_proxy = CollectionProxy( tag_admin,
+                                     RelationshipCollectionGetter( movie, 'tags' ),
+                                     tag_admin.get_columns )
+        self.process()
+        self.assertEqual( tag_proxy.rowCount(), tags )
+        self._load_data( tag_proxy )
+        self.assertTrue( self._data( tags - 1, 0, tag_proxy ) )
+        self.assertTrue( tag_proxy._get_object( tags - 1 ) in movie.tags )
+        session.expire( movie, ['tags'] )
+        self.assertEqual( len( list( tag_proxy._get_objects( 0, yield_per = 2 ) ) ), tags )
+        self.assertFalse( 'tags' in movie.__dict__ )
+        # pending changes to the collection are handled in memory
+        movie.tags.append( Tag( name = u'pending' ) )
+        self.assertEqual( tag_proxy.getRowCount(), tags + 1 )
@@ -92,4 +92,42 @@ class SearchCase( unittest.TestCase ):
             
             self.assertTrue( query.count() > 0 )
             
-    
\ No newline at end of file
+    
+    def test_search_index( self ):
+        """Verify the search results are the same with a search index, also
+        for objects created after the index"""
+        from sqlalchemy.exc import OperationalError
+        self.admin.list_search_index = 'fulltext'
+        try:
+            self._test_search_index()
+        except OperationalError, e:
+            if 'fts5' not in unicode( e ):
+                raise
+            self.skipTest( 'sqlite has no fts5 module' )
+        finally:
+            del self.admin.list_search_index
+            
+    def _test_search_index( self ):
+        from sqlalchemy import orm
+        from camelot.core.search_index import get_search_index
+        from camelot.view.search import ( create_entity_search_query_decorator,
+                                          create_search_index )
+        self.assertTrue( create_search_index( self.admin ) )
+        columns = [ column for column in orm.class_mapper( T ).local_table.columns ]
+        self.assertTrue( get_search_index( orm.class_mapper( T ), columns, 'fulltext' ) )
+        # rows inserted before the index was created are indexed
+        self.test_search_decorator()
+        for (i,name), definition in types_to_test.items():
+            if issubclass( definition, sqlalchemy.types.String ):
+                break
+        t = T()
+        setattr( t, name, u'indexed text' )
+        self.session.flush()
+        query = self.session.query( T )
+        for text in [ u'indexed', u'indexed text' ]:
+            search_decorator = create_entity_search_query_decorator( self.admin,
+                                                                     text )
+            self.assertEqual( search_decorator( query ).all(), [ t ] )
+        t.delete()
+        self.session.flush()
+        self.assertEqual( search_decorator( query ).count(), 0 )
@@ -1121,3 +1121,259 @@ class SnippetsTest(ModelThreadTestCase):
         editor.set_value(proxy)
         self.process()
         self.grab_widget(editor)
+
+class SpreadsheetWriterCase( unittest.TestCase ):
+    
+    def setUp( self ):
+        import datetime
+        import decimal
+        import tempfile
+        self.field_attributes = [ dict( name = 'name' ),
+                                  dict( name = 'amount', precision = 3 ),
+                                  dict( name = 'date' ),
+                                  dict( name = 'code' ) ]
+        self.row = [ u'<Pedro & Sons>', decimal.Decimal( '2.5' ),
+                     datetime.date( 2012, 1, 1 ), [ '1', '2' ] ]
+        handle, self.filename = tempfile.mkstemp()
+        os.close( handle )
+        
+    def tearDown( self ):
+        if os.path.exists( self.filename ):
+            os.remove( self.filename )
+        
+    def test_xlsx_writer( self ):
+        import zipfile
+        from xml.etree import ElementTree
+        from camelot.view.export.spreadsheet import XlsxWriter
+        writer = XlsxWriter( self.filename, u'Title', self.field_attributes )
+        writer.max_rows = 10
+        writer.sample_rows = 4
+        for _i in range( 20 ):
+            writer.write_row( self.row )
+        writer.write_row( [ None, None, None, None ] )
+        writer.close()
+        archive = zipfile.ZipFile( self.filename )
+        namespace = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+        rows = 0
+        for i in range( 1, 4 ):
+            sheet = ElementTree.fromstring( archive.read( 'xl/worksheets/sheet%i.xml'%i ) )
+            # title, empty line and header
+            rows += len( sheet.findall( '%ssheetData/%srow'%( namespace, namespace ) ) ) - 2
+        self.assertEqual( rows, 21 )
+        for name in archive.namelist():
+            ElementTree.fromstring( archive.read( name ) )
+        
+    def test_csv_writer( self ):
+        import csv
+        from camelot.view.export.spreadsheet import CsvWriter
+        writer = CsvWriter( self.filename, u'Title', self.field_attributes )
+        writer.write_row( self.row )
+        writer.write_row( [ None, None, None, None ] )
+        writer.close()
+        rows = list( csv.reader( open( self.filename, 'rb' ) ) )
+        self.assertEqual( rows[0], [ 'name', 'amount', 'date', 'code' ] )
+        self.assertEqual( rows[1], [ '<Pedro & Sons>', '2.5', '2012-01-01', '1.2' ] )
+        self.assertEqual( rows[2], [ '', '', '', '' ] )
+        
+    def test_aware_datetime( self ):
+        import datetime
+        from camelot.view.export.spreadsheet import _excel_datetime
+        
+        class Offset( datetime.tzinfo ):
+            
+            def utcoffset( self, dt ):
+                return datetime.timedelta( hours = 2 )
+            
+            def dst( self, dt ):
+                return datetime.timedelta( 0 )
+            
+        naive = datetime.datetime( 2012, 3, 4, 5, 6 )
+        aware = naive.replace( tzinfo = Offset() )
+        self.assertEqual( _excel_datetime( aware ), _excel_datetime( naive ) )
+        
+    def test_abort( self ):
+        from camelot.view.export.spreadsheet import XlsxWriter
+        writer = XlsxWriter( self.filename, u'Title', self.field_attributes )
+        writer.sample_rows = 0
+        writer.write_row( self.row )
+        writer.abort()
+        self.assertFalse( os.path.exists( self.filename ) )
+
+class CompletionCase( ModelThreadTestCase ):
+    
+    def setUp( self ):
+        super( CompletionCase, self ).setUp()
+        from camelot.admin.application_admin import ApplicationAdmin
+        from camelot.model.party import Organization
+        from camelot.view.completion import CompletionService
+        self.admin = ApplicationAdmin().get_related_admin( Organization )
+        for name in [ u'Completion Johnson', u'Completion Johnny', u'Completion Joe' ]:
+            Organization( name = name )
+        Organization.query.session.flush()
+        self.service = CompletionService( self.admin )
+        
+    def test_narrow_completions( self ):
+        completions = self.service.search( u'completion jo' )
+        self.assertEqual( len( completions ), 3 )
+        self.assertEqual( len( self.service.cached_completions( u'completion joh' ) ), 2 )
+        self.assertEqual( len( self.service.cached_completions( u'completion johns' ) ), 1 )
+        # text with digits might match numbers, so it cannot be narrowed
+        self.assertEqual( self.service.cached_completions( u'completion jo1' ), None )
+        organization = completions[0].object_getter()
+        self.assertEqual( unicode( organization ), completions[0].representation )
+        # a flush clears the cache
+        organization.name = u'Completion Jack'
+        organization.flush()
+        self.assertEqual( self.service.cached_completions( u'completion joh' ), None )
+        
+    def test_completions_without_objects( self ):
+        # the objects are only loaded when a completion is selected
+        from camelot.model.party import Organization
+        session = Organization.query.session
+        session.expunge_all()
+        completions = self.service.search( u'completion johns' )
+        self.assertEqual( [ c.representation for c in completions ], [ u'Completion Johnson' ] )
+        self.assertFalse( any( isinstance( obj, Organization ) for obj in session ) )
+        organization = completions[0].object_getter()
+        self.assertEqual( organization.name, u'Completion Johnson' )
+        
+    def test_clear_completions( self ):
+        from camelot.view.completion import ( CompletionService, 
+                                              clear_completion_cache,
+                                              get_completion_service )
+        service = get_completion_service( self.admin )
+        service.search( u'completion jo' )
+        # changes by other clients clear all cached completions
+        clear_completion_cache()
+        self.assertEqual( service.cached_completions( u'completion jo' ), None )
+        # the search index does not match substrings, so completions are
+        # not narrowed in memory
+        self.admin.list_search_index = 'fulltext'
+        try:
+            self.assertFalse( CompletionService( self.admin ).narrowable )
+        finally:
+            del self.admin.list_search_index
+        
+    def test_completions_in_editor( self ):
+        from camelot.view.controls.editors.many2oneeditor import Many2OneEditor
+        editor = Many2OneEditor( self.admin )
+        editor.search_input.set_user_input( u'Completion Jo' )
+        editor.textEdited( u'Completion Jo' )
+        # completions are only searched after a delay
+        self.assertEqual( editor.completions_model.rowCount(), 0 )
+        editor.post_search_completions()
+        self.process()
+        self.assertEqual( editor.completions_model.rowCount(), 3 )
+        # narrowing the text uses the cache
+        editor.search_input.set_user_input( u'Completion Joh' )
+        editor.textEdited( u'Completion Joh' )
+        self.assertEqual( editor.completions_model.rowCount(), 2 )
+
+class MessageBusCase( ModelThreadTestCase ):
+    """Broadcast the changes of one client to the other clients"""
+    
+    def setUp( self ):
+        super( MessageBusCase, self ).setUp()
+        from camelot.view.message_bus import MessageBroker, SocketMessageBus
+        self.broker = MessageBroker( 'camelot-test-bus' )
+        self.buses = [ SocketMessageBus( 'camelot-test-bus' ) for _i in range( 3 ) ]
+        
+    def tearDown( self ):
+        for bus in self.buses:
+            bus.close()
+        self.broker.close()
+        super( MessageBusCase, self ).tearDown()
+        
+    def _wait_for( self, condition ):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            QtCore.QCoreApplication.processEvents( QtCore.QEventLoop.AllEvents, 50 )
+            self.process()
+        
+    def test_broadcast( self ):
+        received = [ [] for _bus in self.buses ]
+        for bus, messages in zip( self.buses, received ):
+            bus.messages_received_signal.connect( messages.extend )
+        self.buses[0].publish( [ ( 'camelot.model.party.Person', [1], 'update' ) ] )
+        self._wait_for( lambda:received[1] and received[2] )
+        self.assertEqual( received[0], [] )
+        for messages in received[1:]:
+            self.assertEqual( messages, [ ( 'camelot.model.party.Person', ( 1, ), 'update' ) ] )
+            
+    def test_encode_keys( self ):
+        # primary keys that json does not support survive the bus
+        import datetime, decimal, uuid
+        bus = self.buses[0]
+        primary_key = ( decimal.Decimal( '1.5' ),
+                        uuid.uuid4(),
+                        datetime.date( 2012, 3, 4 ),
+                        datetime.datetime( 2012, 3, 4, 5, 6, 7 ) )
+        line = bus.encode( [ ( 'camelot.model.party.Person', primary_key, 'update' ) ] )
+        bus.origin = None
+        self.assertEqual( bus.decode( line ),
+                          [ ( 'camelot.model.party.Person', primary_key, 'update' ) ] )
+        # keys that cannot be encoded are logged instead of raised
+        self.assertEqual( bus.encode( [ ( 'camelot.model.party.Person', [ object() ], 'update' ) ] ), None )
+            
+    def test_flush_publishes( self ):
+        # every flush is published, whatever code path caused it
+        from sqlalchemy import orm
+        from camelot.model.party import Person
+        from camelot.view import remote_signals
+        received = []
+        self.buses[1].messages_received_signal.connect( received.extend )
+        remote_signals.construct_signal_handler( message_bus = self.buses[0] )
+        try:
+            person = Person( first_name = u'Flush', last_name = u'Published' )
+            person.flush()
+            self._wait_for( lambda:received )
+        finally:
+            remote_signals._signal_handler_.pop()
+        primary_key = tuple( orm.attributes.instance_state( person ).key[1] )
+        self.assertTrue( ( 'camelot.model.party.Person', primary_key, 'create' ) in received )
+        
+    def test_rollback_discards( self ):
+        # the changes of a transaction are only published when it commits
+        from camelot.core.orm import Session
+        from camelot.model.party import Person
+        from camelot.view import remote_signals
+        remote_signals.construct_signal_handler( message_bus = self.buses[0] )
+        session = Session()
+        try:
+            session.begin()
+            Person( first_name = u'Rolled', last_name = u'Back' )
+            session.flush()
+            self.assertTrue( session in remote_signals._unpublished_messages_ )
+            session.rollback()
+            self.assertFalse( session in remote_signals._unpublished_messages_ )
+        finally:
+            remote_signals._signal_handler_.pop()
+        
+    def test_remote_changes( self ):
+        # the changes of another client expire only the affected objects
+        from camelot.model.party import Person
+        from camelot.view.remote_signals import SignalHandler, EntityChangeset
+        person = Person( first_name = u'Remote', last_name = u'Change' )
+        person.flush()
+        other_person = Person( first_name = u'Other', last_name = u'Person' )
+        other_person.flush()
+        sending_handler = SignalHandler( message_bus = self.buses[0] )
+        receiving_handler = SignalHandler( message_bus = self.buses[1] )
+        changesets = []
+        receiving_handler.entity_changes_signal.connect( lambda sender, changeset:changesets.append( changeset ) )
+        changeset = EntityChangeset()
+        changeset.add_update( person )
+        sending_handler.send_entity_changes( None, changeset, scope = 'remote' )
+        self._wait_for( lambda:changesets )
+        self.assertEqual( list( changesets[0].updated_entities() ), [ person ] )
+        self.assertFalse( 'first_name' in person.__dict__ )
+        self.assertTrue( 'first_name' in other_person.__dict__ )
+        # local changes that were not flushed are not discarded
+        from camelot.view.remote_signals import apply_messages
+        from sqlalchemy import orm
+        other_person.first_name = u'Unflushed'
+        primary_key = tuple( orm.attributes.instance_state( other_person ).key[1] )
+        changeset = apply_messages( [ ( 'camelot.model.party.Person', primary_key, 'update' ) ] )
+        self.assertEqual( changeset.conflicts, [ other_person ] )
+        self.assertEqual( len( changeset ), 0 )
+        self.assertEqual( other_person.first_name, u'Unflushed' )